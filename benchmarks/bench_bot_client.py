@@ -0,0 +1,88 @@
+"""
+Бенчмарк клиента бота: новая ClientSession на каждый вызов против общей сессии bot/api.py.
+
+Меряется задержка выбора города — три последовательных вызова, как в
+city_choose_handler: /user/city, /city/search, /weather — против локальной заглушки API.
+
+Запуск: python -m benchmarks.bench_bot_client [--interactions 500] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import logging
+import time
+import aiohttp
+from aiohttp import web
+from bot import api
+from benchmarks.stub_upstream import free_port
+
+def build_stub_api() -> web.Application:
+    async def user_city(request: web.Request) -> web.Response:
+        return web.json_response({"message": "Город выбран!"})
+
+    async def city_search(request: web.Request) -> web.Response:
+        return web.json_response({"cities": [{"id": 2145091, "name": "Moscow", "country": "Russia"}], "has_next": False})
+
+    async def weather(request: web.Request) -> web.Response:
+        return web.json_response({"success": True, "formatted_message": "🌤 Погода в <b>Москва</b>"})
+
+    app = web.Application()
+    app.router.add_post("/user/city", user_city)
+    app.router.add_post("/city/search", city_search)
+    app.router.add_post("/weather", weather)
+    return app
+
+async def legacy_api_post(endpoint, payload):
+    """Прежняя реализация bot/api.py: новая сессия на каждый вызов"""
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{api.API_URL}{endpoint}", json=payload) as resp:
+            return await resp.json()
+
+async def _choose_city(post, user_id: int):
+    await post("/user/city", {"user_id": user_id, "city_id": 2145091})
+    await post("/city/search", {"user_id": user_id, "query": "Moscow", "page": 1, "page_size": 3})
+    await post("/weather", {"user_id": user_id})
+
+async def _measure(post, interactions: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(user_id: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await _choose_city(post, user_id)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(i) for i in range(interactions)))
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "avg": sum(latencies) / len(latencies) * 1000,
+    }
+
+async def bench(interactions: int, concurrency: int):
+    runner = web.AppRunner(build_stub_api(), access_log=None)
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    api.API_URL = f"http://127.0.0.1:{port}"
+    try:
+        before = await _measure(legacy_api_post, interactions, concurrency)
+        await api.init_api_session()
+        after = await _measure(api.api_post, interactions, concurrency)
+        await api.close_api_session()
+    finally:
+        await runner.cleanup()
+
+    print(f"Выборов города: {interactions}, параллельно: {concurrency} (3 вызова API на каждый)")
+    print(f"{'':22}{'p50, мс':>10}{'p99, мс':>10}{'сред., мс':>12}")
+    for name, result in (("сессия на вызов", before), ("общая сессия", after)):
+        print(f"{name:22}{result['p50']:10.2f}{result['p99']:10.2f}{result['avg']:12.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--interactions", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(bench(args.interactions, args.concurrency))
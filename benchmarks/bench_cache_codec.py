@@ -0,0 +1,81 @@
+"""
+Бенчмарк кодеков кэша: время кодирования/разбора и объём 1000 прогнозов в Redis.
+
+Прогноз — ответ forecast.json на 3 дня с почасовыми данными из заглушки WeatherAPI,
+в конверте SWR, как его пишет set_cached_data. Объём считается по длине значений;
+если Redis доступен по REDIS_URL, дополнительно меряется прирост used_memory.
+
+Запуск: python -m benchmarks.bench_cache_codec [--entries 1000] [--days 3]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import redis.asyncio as redis
+import cache
+from benchmarks.stub_upstream import make_forecast
+
+def _variants():
+    """Все доступные сочетания кодека и сжатия; первым — прежний формат"""
+    yield "json (как раньше)", None, None
+    for codec in cache.CODECS:
+        for compression in cache.COMPRESSIONS:
+            yield f"{codec}+{compression}", codec, compression
+
+def _legacy_encode(value):
+    return json.dumps(value).encode("utf-8")
+
+async def _redis_memory(client, payloads) -> int:
+    """Прирост used_memory после записи значений (байты)"""
+    await client.delete(*(f"bench:codec:{i}" for i in range(len(payloads))))
+    before = (await client.info("memory"))["used_memory"]
+    pipe = client.pipeline(transaction=False)
+    for i, payload in enumerate(payloads):
+        pipe.set(f"bench:codec:{i}", payload)
+    await pipe.execute()
+    used = (await client.info("memory"))["used_memory"] - before
+    await client.delete(*(f"bench:codec:{i}" for i in range(len(payloads))))
+    return used
+
+async def bench(entries: int, days: int):
+    entry = {cache._ENVELOPE_MARKER: 1, "fresh_until": time.time() + 600, "data": make_forecast(days)}
+    client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379"))
+    try:
+        await client.ping()
+    except Exception:
+        client = None
+
+    print(f"Записей: {entries}, прогноз на {days} дн., сжатие от {cache.CACHE_COMPRESS_MIN_BYTES} байт")
+    header = f"{'':20}{'кодир., мкс':>12}{'разбор, мкс':>13}{'байт/запись':>13}{'КБ на 1000':>12}"
+    print(header + (f"{'Redis, КБ':>12}" if client else ""))
+    for name, codec, compression in _variants():
+        started = time.perf_counter()
+        if codec is None:
+            payloads = [_legacy_encode(entry) for _ in range(entries)]
+        else:
+            payloads = [cache.encode_value(entry, codec, compression) for _ in range(entries)]
+        encode_us = (time.perf_counter() - started) / entries * 1e6
+
+        started = time.perf_counter()
+        for payload in payloads:
+            cache.decode_value(payload)
+        decode_us = (time.perf_counter() - started) / entries * 1e6
+
+        size = len(payloads[0])
+        line = f"{name:20}{encode_us:12.1f}{decode_us:13.1f}{size:13}{size * 1000 / 1024:12.1f}"
+        if client:
+            line += f"{await _redis_memory(client, payloads) / entries * 1000 / 1024:12.1f}"
+        print(line)
+
+    if client:
+        await client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(bench(args.entries, args.days))
@@ -0,0 +1,59 @@
+"""
+Бенчмарк: новая ClientSession на каждый запрос против общей сессии с пулом.
+
+Запуск: python -m benchmarks.bench_http_session [--requests 2000] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+os.environ.setdefault("USERS_DB_PATH", os.path.join(tempfile.mkdtemp(), "users.db"))
+os.environ.setdefault("WEATHER_API_KEY", "bench")
+
+import main  # noqa: E402
+import http_client  # noqa: E402
+from benchmarks.stub_upstream import start_stub  # noqa: E402
+
+async def _run(total: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            # Уникальный город, чтобы не упираться в кэш
+            data = await main.fetch_weather_api(city=f"city-{i}", retries=1)
+            assert data is not None
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - started)
+
+async def bench(total: int, concurrency: int):
+    runner, base_url = await start_stub()
+    main.WEATHER_API_BASE_URL = base_url
+    try:
+        # До: общей сессии нет, каждый запрос открывает своё соединение
+        await http_client.close_http_session()
+        before = await _run(total, concurrency)
+
+        # После: общая сессия с keep-alive и пулом соединений
+        await http_client.init_http_session()
+        after = await _run(total, concurrency)
+        await http_client.close_http_session()
+    finally:
+        await runner.cleanup()
+
+    print(f"Запросов: {total}, параллельно: {concurrency}")
+    print(f"Сессия на запрос: {before:10.1f} req/s")
+    print(f"Общая сессия:     {after:10.1f} req/s")
+    print(f"Ускорение:        {after / before:10.2f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(bench(args.requests, args.concurrency))
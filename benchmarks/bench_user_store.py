@@ -0,0 +1,105 @@
+"""
+Бенчмарк: блокирующий sqlite3.connect на каждый вызов против UserStore.
+
+Пока идут одновременные запись/чтение городов пользователей, фоновая задача
+каждую миллисекунду просыпается и меряет, насколько event loop опоздал её разбудить.
+
+Запуск: python -m benchmarks.bench_user_store [--users 2000] [--concurrency 100]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Optional
+from user_store import UserStore
+
+def _legacy_connection(db_path: str):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def legacy_set_user_city(db_path: str, user_id: int, city_id: int):
+    """Прежняя реализация из main.py: новое соединение и синхронный запрос в event loop"""
+    conn = _legacy_connection(db_path)
+    conn.execute("INSERT OR REPLACE INTO users (user_id, city_id) VALUES (?, ?)", (user_id, city_id))
+    conn.commit()
+    conn.close()
+
+def legacy_get_user_city(db_path: str, user_id: int) -> Optional[int]:
+    conn = _legacy_connection(db_path)
+    row = conn.execute("SELECT city_id FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    conn.close()
+    return row["city_id"] if row else None
+
+async def _measure(workload, users: int, concurrency: int):
+    stalls = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            expected = loop.time() + 0.001
+            await asyncio.sleep(0.001)
+            stalls.append(max(loop.time() - expected, 0.0))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user_id: int):
+        async with semaphore:
+            await workload(user_id)
+
+    monitor = asyncio.create_task(heartbeat())
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await monitor
+
+    stalls.sort()
+    return {
+        "elapsed": elapsed,
+        "total_stall_ms": sum(stalls) * 1000,
+        "p99_stall_ms": stalls[int(len(stalls) * 0.99) - 1] * 1000 if stalls else 0.0,
+        "max_stall_ms": stalls[-1] * 1000 if stalls else 0.0,
+    }
+
+async def bench(users: int, concurrency: int):
+    db_dir = tempfile.mkdtemp()
+
+    legacy_path = os.path.join(db_dir, "legacy.db")
+    conn = _legacy_connection(legacy_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, city_id INTEGER)")
+    conn.commit()
+    conn.close()
+
+    async def legacy(user_id: int):
+        legacy_set_user_city(legacy_path, user_id, user_id % 50)
+        legacy_get_user_city(legacy_path, user_id)
+
+    store = UserStore(os.path.join(db_dir, "store.db"))
+    await store.open()
+
+    async def pooled(user_id: int):
+        await store.set_city(user_id, user_id % 50)
+        await store.get_city(user_id)
+
+    before = await _measure(legacy, users, concurrency)
+    after = await _measure(pooled, users, concurrency)
+    await store.close()
+
+    print(f"Пользователей: {users}, параллельно: {concurrency} (запись + чтение на каждого)")
+    print(f"{'':24}{'время, с':>10}{'простой, мс':>14}{'p99, мс':>10}{'макс, мс':>10}")
+    for name, result in (("sqlite3.connect в loop", before), ("UserStore", after)):
+        print(
+            f"{name:24}{result['elapsed']:10.2f}{result['total_stall_ms']:14.1f}"
+            f"{result['p99_stall_ms']:10.2f}{result['max_stall_ms']:10.2f}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(bench(args.users, args.concurrency))
@@ -0,0 +1,75 @@
+"""
+Бенчмарк: N вызовов /weather/by_city подряд против одного /weather/batch.
+
+Приложение вызывается в процессе через ASGI-транспорт httpx, WeatherAPI — локальная
+заглушка с задержкой. Первый прогон идёт по пустому кэшу, второй — по заполненному
+(если Redis доступен по REDIS_URL; без Redis кэш не работает и прогоны одинаковы).
+
+Запуск: python -m benchmarks.bench_weather_batch [--cities 20] [--delay 0.05]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+os.environ.setdefault("USERS_DB_PATH", os.path.join(tempfile.mkdtemp(), "users.db"))
+os.environ.setdefault("WEATHER_API_KEY", "bench")
+
+import httpx  # noqa: E402
+import main  # noqa: E402
+import http_client  # noqa: E402
+from cache import init_redis, close_redis, clear_cache  # noqa: E402
+from benchmarks.stub_upstream import start_stub  # noqa: E402
+
+async def _single_calls(client: httpx.AsyncClient, cities) -> float:
+    started = time.perf_counter()
+    for city in cities:
+        response = await client.post("/weather/by_city", json={"city": city})
+        assert response.json()["success"]
+    return time.perf_counter() - started
+
+async def _batch_call(client: httpx.AsyncClient, cities) -> float:
+    started = time.perf_counter()
+    response = await client.post("/weather/batch", json={"cities": cities})
+    assert all(item["success"] for item in response.json()["results"])
+    return time.perf_counter() - started
+
+async def bench(count: int, delay: float):
+    runner, base_url = await start_stub(delay)
+    stats = runner.app["stats"]
+    main.WEATHER_API_BASE_URL = base_url
+    await init_redis()
+    await http_client.init_http_session()
+    rows = []
+    try:
+        async with httpx.AsyncClient(app=main.app, base_url="http://bench") as client:
+            for name, run, prefix in (
+                ("одиночные вызовы", _single_calls, "single"),
+                ("один пакет", _batch_call, "batch"),
+            ):
+                cities = [f"{prefix}-city-{i}" for i in range(count)]
+                calls_before = stats["calls"]
+                cold = await run(client, cities)
+                upstream = stats["calls"] - calls_before
+                warm = await run(client, cities)
+                rows.append((name, cold, warm, upstream))
+        await clear_cache("weather")
+    finally:
+        await http_client.close_http_session()
+        await close_redis()
+        await runner.cleanup()
+
+    print(f"Городов: {count}, задержка WeatherAPI: {delay * 1000:.0f} мс")
+    print(f"{'':20}{'холодный, мс':>14}{'тёплый, мс':>12}{'к WeatherAPI':>14}")
+    for name, cold, warm, upstream in rows:
+        print(f"{name:20}{cold * 1000:14.1f}{warm * 1000:12.1f}{upstream:14}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cities", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.05)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(bench(args.cities, args.delay))
@@ -0,0 +1,143 @@
+"""
+Локальная заглушка WeatherAPI для бенчмарков
+"""
+import asyncio
+import copy
+import socket
+from typing import Any, Dict, Tuple
+from aiohttp import web
+
+SAMPLE_CURRENT: Dict[str, Any] = {
+    "location": {
+        "name": "Москва",
+        "region": "Moscow City",
+        "country": "Россия",
+        "lat": 55.75,
+        "lon": 37.62,
+        "tz_id": "Europe/Moscow",
+        "localtime_epoch": 1720774800,
+        "localtime": "2024-07-12 12:00",
+    },
+    "current": {
+        "last_updated_epoch": 1720774800,
+        "last_updated": "2024-07-12 12:00",
+        "temp_c": 20.0,
+        "temp_f": 68.0,
+        "is_day": 1,
+        "condition": {"text": "Ясно", "icon": "//cdn.weatherapi.com/weather/64x64/day/113.png", "code": 1000},
+        "wind_mph": 8.1,
+        "wind_kph": 13.0,
+        "wind_degree": 250,
+        "wind_dir": "WSW",
+        "pressure_mb": 1015.0,
+        "pressure_in": 29.97,
+        "precip_mm": 0.0,
+        "precip_in": 0.0,
+        "humidity": 65,
+        "cloud": 0,
+        "feelslike_c": 19.5,
+        "feelslike_f": 67.1,
+        "vis_km": 10.0,
+        "vis_miles": 6.0,
+        "uv": 5.0,
+        "gust_mph": 10.2,
+        "gust_kph": 16.4,
+    },
+}
+
+SAMPLE_SEARCH = [
+    {"id": 2145091, "name": "Moscow", "region": "Moscow City", "country": "Russia",
+     "lat": 55.75, "lon": 37.62, "url": "moscow-moscow-city-russia"},
+    {"id": 2145092, "name": "Moscow", "region": "Idaho", "country": "United States of America",
+     "lat": 46.73, "lon": -117.0, "url": "moscow-idaho-united-states-of-america"},
+]
+
+def make_forecast(days: int) -> Dict[str, Any]:
+    """Ответ forecast.json с почасовыми данными, близкий по размеру к настоящему"""
+    data = copy.deepcopy(SAMPLE_CURRENT)
+    forecastday = []
+    for d in range(days):
+        date = f"2024-07-{12 + d:02d}"
+        forecastday.append({
+            "date": date,
+            "date_epoch": 1720742400 + d * 86400,
+            "day": {
+                "maxtemp_c": 24.0 + d,
+                "mintemp_c": 14.0 + d,
+                "avgtemp_c": 19.0 + d,
+                "maxwind_kph": 18.0,
+                "totalprecip_mm": 0.0,
+                "avghumidity": 60,
+                "daily_chance_of_rain": 0,
+                "condition": {"text": "Солнечно", "icon": "//cdn.weatherapi.com/weather/64x64/day/113.png", "code": 1000},
+                "uv": 6.0,
+            },
+            "astro": {"sunrise": "03:55 AM", "sunset": "09:15 PM", "moon_phase": "Waxing Crescent"},
+            "hour": [
+                {
+                    "time_epoch": 1720742400 + d * 86400 + h * 3600,
+                    "time": f"{date} {h:02d}:00",
+                    "temp_c": 14.0 + h / 2,
+                    "is_day": 1 if 4 <= h <= 21 else 0,
+                    "condition": {"text": "Ясно", "icon": "//cdn.weatherapi.com/weather/64x64/night/113.png", "code": 1000},
+                    "wind_kph": 10.0,
+                    "wind_dir": "W",
+                    "pressure_mb": 1015.0,
+                    "precip_mm": 0.0,
+                    "humidity": 60,
+                    "cloud": 5,
+                    "feelslike_c": 14.0 + h / 2,
+                    "chance_of_rain": 0,
+                    "vis_km": 10.0,
+                    "gust_kph": 14.0,
+                    "uv": 1.0,
+                }
+                for h in range(24)
+            ],
+        })
+    data["forecast"] = {"forecastday": forecastday}
+    return data
+
+def build_app(delay: float = 0.0) -> web.Application:
+    """Приложение-заглушка с эндпоинтами current.json, forecast.json и search.json"""
+    stats = {"calls": 0}
+
+    async def current(request: web.Request) -> web.Response:
+        stats["calls"] += 1
+        if delay:
+            await asyncio.sleep(delay)
+        return web.json_response(SAMPLE_CURRENT)
+
+    async def forecast(request: web.Request) -> web.Response:
+        stats["calls"] += 1
+        if delay:
+            await asyncio.sleep(delay)
+        return web.json_response(make_forecast(int(request.query.get("days", "3"))))
+
+    async def search(request: web.Request) -> web.Response:
+        stats["calls"] += 1
+        if delay:
+            await asyncio.sleep(delay)
+        return web.json_response(SAMPLE_SEARCH)
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_get("/current.json", current)
+    app.router.add_get("/forecast.json", forecast)
+    app.router.add_get("/search.json", search)
+    return app
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def start_stub(delay: float = 0.0) -> Tuple[web.AppRunner, str]:
+    """Запуск заглушки на свободном порту; возвращает runner и базовый URL"""
+    app = build_app(delay)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = free_port()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    return runner, f"http://127.0.0.1:{port}"
@@ -1,28 +1,106 @@
 import aiohttp
+import asyncio
+import logging
 import os
+import time
+from typing import Any, Awaitable, Callable, Optional
 from dotenv import load_dotenv
+from prometheus_client import Counter, Histogram
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 API_URL = os.getenv("API_BASE_URL", "http://api:8000")
 
+# Настройки клиента API сервиса
+BOT_HTTP_POOL_SIZE = int(os.getenv("BOT_HTTP_POOL_SIZE", "50"))
+BOT_HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("BOT_HTTP_KEEPALIVE_TIMEOUT", "60"))  # секунд
+BOT_HTTP_CONNECT_TIMEOUT = float(os.getenv("BOT_HTTP_CONNECT_TIMEOUT", "3"))  # секунд
+BOT_HTTP_TIMEOUT = float(os.getenv("BOT_HTTP_TIMEOUT", "30"))  # секунд на весь запрос
+BOT_HTTP_RETRIES = int(os.getenv("BOT_HTTP_RETRIES", "3"))
+BOT_HTTP_BACKOFF = float(os.getenv("BOT_HTTP_BACKOFF", "0.2"))  # секунд, удваивается с каждой попыткой
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = {502, 503, 504}
+
+# Метрики запросов бота к API сервису (отдаются на /metrics бота)
+API_REQUESTS = Counter(
+    "bot_api_requests_total",
+    "Запросы бота к API сервису по эндпоинтам и статусам (error — сетевая ошибка)",
+    ["endpoint", "status"],
+)
+API_SECONDS = Histogram(
+    "bot_api_request_seconds",
+    "Время запросов бота к API сервису",
+    ["endpoint"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+API_RETRIES = Counter("bot_api_retries_total", "Повторные запросы бота к API сервису", ["endpoint"])
+
+# Общая сессия бота (создаётся при запуске, закрывается при остановке)
+_session: Optional[aiohttp.ClientSession] = None
+
+async def init_api_session():
+    """Создание общей сессии для запросов к API сервису"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=BOT_HTTP_POOL_SIZE,
+            keepalive_timeout=BOT_HTTP_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(total=BOT_HTTP_TIMEOUT, connect=BOT_HTTP_CONNECT_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        logger.info(f"Сессия API сервиса создана: {API_URL}")
+
+async def close_api_session():
+    """Закрытие общей сессии"""
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+        logger.info("Сессия API сервиса закрыта")
+
+async def _post(endpoint: str, payload: dict, read: Callable[[aiohttp.ClientResponse], Awaitable[Any]]) -> Any:
+    """POST к API сервису с повтором при сетевых ошибках и 502/503/504"""
+    if _session is None or _session.closed:
+        await init_api_session()
+
+    attempts = max(BOT_HTTP_RETRIES, 1)
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        if attempt:
+            API_RETRIES.labels(endpoint).inc()
+        started = time.perf_counter()
+        status = "error"
+        try:
+            async with _session.post(f"{API_URL}{endpoint}", json=payload) as resp:
+                status = str(resp.status)
+                if resp.status not in RETRY_STATUSES or last_attempt:
+                    return await read(resp)
+                logger.warning(f"API {endpoint} вернул статус {resp.status}, попытка {attempt + 1}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if last_attempt:
+                raise
+            logger.warning(f"Ошибка запроса к API {endpoint} на попытке {attempt + 1}: {e}")
+        finally:
+            API_REQUESTS.labels(endpoint, status).inc()
+            API_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+        await asyncio.sleep(BOT_HTTP_BACKOFF * 2 ** attempt)
+
+async def _read_json(resp: aiohttp.ClientResponse) -> Any:
+    return await resp.json()
+
+async def _read_image(resp: aiohttp.ClientResponse) -> Optional[bytes]:
+    if resp.status == 200:
+        return await resp.read()  # возвращаем байты картинки
+    return None
+
 async def api_post(endpoint, payload):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{API_URL}{endpoint}", json=payload) as resp:
-            return await resp.json()
+    return await _post(endpoint, payload, _read_json)
 
 async def get_weather_image(user_id):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{API_URL}/weather/image", json={"user_id": user_id}) as resp:
-            if resp.status == 200:
-                return await resp.read()  # возвращаем байты картинки
-            else:
-                return None
+    return await _post("/weather/image", {"user_id": user_id}, _read_image)
 
 async def get_weather_image_by_city(city):
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{API_URL}/weather/image_by_city", json={"city": city}) as resp:
-            if resp.status == 200:
-                return await resp.read()  # возвращаем байты картинки
-            else:
-                return None 
\ No newline at end of file
+    return await _post("/weather/image_by_city", {"city": city}, _read_image)
@@ -8,8 +8,10 @@ from .handlers import router
 from .keyboards import main_kb
 import sqlite3
 from .middlewares import AntiSpamMiddleware
-from fastapi import FastAPI, Request
+from .api import init_api_session, close_api_session
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest, start_http_server
 import uvicorn
 
 # Настройка логирования
@@ -57,6 +59,8 @@ app.add_middleware(
 )
 
 API_URL = os.getenv("API_BASE_URL", "http://api:8000")
+# Порт с /metrics в режиме polling (в режиме webhook метрики отдаёт FastAPI-приложение)
+BOT_METRICS_PORT = int(os.getenv("BOT_METRICS_PORT", "0"))
 
 # Webhook endpoints
 @app.get("/")
@@ -80,6 +84,11 @@ async def webhook_handler(request: Request):
         logger.error(f"Ошибка обработки webhook: {e}")
         return {"ok": False, "error": str(e)}
 
+@app.get("/metrics")
+async def metrics():
+    """Метрики бота в формате Prometheus"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/webhook")
 async def webhook_info():
     """Информация о webhook"""
@@ -92,6 +101,7 @@ async def webhook_info():
 @app.on_event("startup")
 async def fastapi_startup():
     """Инициализация FastAPI приложения"""
+    await init_api_session()
     logger.info("FastAPI webhook сервер запущен")
     
     # Настройка webhook
@@ -114,6 +124,7 @@ async def fastapi_shutdown():
         logger.info("Webhook удален")
     except Exception as e:
         logger.error(f"Ошибка удаления webhook: {e}")
+    await close_api_session()
     logger.info("FastAPI webhook сервер остановлен")
 
 def get_all_user_ids():
@@ -139,6 +150,7 @@ async def notify_restart(bot):
             pass
 
 async def on_startup(dispatcher):
+    await init_api_session()
     logger.info("Бот успешно запущен!")
     logger.info(f"Проверка подключения к API: {API_URL}")
     try:
@@ -160,15 +172,21 @@ async def on_startup(dispatcher):
 
 async def on_shutdown(dispatcher):
     logger.warning("Бот завершает работу (graceful shutdown)...")
+    await close_api_session()
 
 async def main_polling():
     try:
+        if BOT_METRICS_PORT:
+            start_http_server(BOT_METRICS_PORT)
+            logger.info(f"Метрики бота доступны на порту {BOT_METRICS_PORT}")
         await on_startup(dp)
         logger.info("Бот запущен в режиме polling!")
         await dp.start_polling(bot)
     except (KeyboardInterrupt, SystemExit):
         await on_shutdown(dp)
         sys.exit(0)
+    finally:
+        await close_api_session()
 
 # --- МЕНЯЕМ ТОЧКУ ВХОДА ---
 if __name__ == "__main__":
@@ -130,21 +130,23 @@ async def city_search_handler(message: types.Message, state: FSMContext):
         await message.answer("Города не найдены. Попробуйте ещё раз.")
         return
     kb = get_cities_keyboard(cities, has_next, page, query)
+    total = data.get("total")
+    choose_text = f"Выберите город (найдено: {total}):" if total else "Выберите город:"
     fsm_data = await state.get_data()
     cancel_msg_id = fsm_data.get("cancel_msg_id")
     if cancel_msg_id:
         try:
             await message.bot.edit_message_text(
-                text="Выберите город:",
+                text=choose_text,
                 chat_id=message.chat.id,
                 message_id=cancel_msg_id,
                 reply_markup=kb
             )
         except Exception:
-            sent = await message.answer("Выберите город:", reply_markup=kb)
+            sent = await message.answer(choose_text, reply_markup=kb)
             await state.update_data(cancel_msg_id=sent.message_id)
     else:
-        sent = await message.answer("Выберите город:", reply_markup=kb)
+        sent = await message.answer(choose_text, reply_markup=kb)
         await state.update_data(cancel_msg_id=sent.message_id)
 
 @router.callback_query(F.data.startswith("city_"), CitySelectStates.waiting_for_city_name)
@@ -153,12 +155,9 @@ async def city_choose_handler(callback: types.CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     parts = callback.data.split("_", 3)
     city_id = int(parts[1])
-    page = int(parts[2])
-    query = parts[3]
-    await api_post("/user/city", {"user_id": user_id, "city_id": city_id})
-    data = await api_post("/city/search", {"user_id": user_id, "query": query, "page": page, "page_size": PAGE_SIZE})
-    cities = data.get("cities", [])
-    city_name = next((c["name"] for c in cities if int(c["id"]) == city_id), None)
+    # Один запрос: сохранить город и сразу получить погоду в нём
+    weather = await api_post("/user/city/weather", {"user_id": user_id, "city_id": city_id})
+    city_name = weather.get("city_name")
     if city_name:
         await callback.message.edit_text(f"{city_name} — 👀 я это запишу ✍️", reply_markup=None)
     else:
@@ -170,7 +169,6 @@ async def city_choose_handler(callback: types.CallbackQuery, state: FSMContext):
     except Exception:
         pass
     await state.update_data(cancel_msg_id=None)
-    weather = await api_post("/weather", {"user_id": user_id})
     if weather.get("success"):
         await callback.message.answer(
             weather["formatted_message"],
@@ -1,8 +1,30 @@
+import asyncio
+import base64
 import json
 import logging
 import os
-from typing import Optional, Dict, Any, List
+import statistics
+import time
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Any, List, Callable, Awaitable, Set, Tuple, Union
 import redis.asyncio as redis
+from metrics import CACHE_ERRORS, CACHE_L1_BYTES, CACHE_L1_ENTRIES, REDIS_SECONDS, count_cache
+
+# Необязательные быстрые кодеки: без них используется стандартный json и zlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
 
 logger = logging.getLogger(__name__)
 
@@ -14,114 +36,843 @@ DEFAULT_TTL_WEATHER = int(os.getenv("CACHE_TTL_WEATHER", "600"))  # 10 мину
 DEFAULT_TTL_FORECAST = int(os.getenv("CACHE_TTL_FORECAST", "1800"))  # 30 минут
 DEFAULT_TTL_CITIES = int(os.getenv("CACHE_TTL_CITIES", "3600"))  # 1 час
 
+# Жёсткие TTL: сколько запись живёт в Redis после того, как перестала быть свежей.
+# Между мягким (CACHE_TTL_*) и жёстким TTL запись считается устаревшей.
+HARD_TTL_WEATHER = int(os.getenv("CACHE_TTL_WEATHER_HARD", "3600"))  # 1 час
+HARD_TTL_FORECAST = int(os.getenv("CACHE_TTL_FORECAST_HARD", "7200"))  # 2 часа
+HARD_TTL_CITIES = int(os.getenv("CACHE_TTL_CITIES_HARD", str(DEFAULT_TTL_CITIES)))
+
+# Адаптивный TTL погоды: запись свежая до ожидаемого обновления данных в WeatherAPI
+# (current.last_updated_epoch + наблюдаемый интервал обновлений + запас), в пределах MIN..MAX
+CACHE_ADAPTIVE_TTL = os.getenv("CACHE_ADAPTIVE_TTL", "1") == "1"
+ADAPTIVE_TTL_MIN = int(os.getenv("CACHE_TTL_ADAPTIVE_MIN", "60"))
+ADAPTIVE_TTL_MAX = int(os.getenv("CACHE_TTL_ADAPTIVE_MAX", "1800"))
+ADAPTIVE_TTL_LAG = int(os.getenv("CACHE_TTL_ADAPTIVE_LAG", "60"))  # запас после ожидаемого обновления
+UPSTREAM_UPDATE_INTERVAL = int(os.getenv("WEATHERAPI_UPDATE_INTERVAL", "900"))  # начальная оценка, 15 минут
+ADAPTIVE_TTL_TRACKED = 10000  # городов, для которых помним последнее время обновления
+ADAPTIVE_TTL_SAMPLES = 50  # последних интервалов для оценки
+
+# Отрицательный кэш: «город не найден» и пустой результат поиска
+NEGATIVE_TTL = int(os.getenv("CACHE_TTL_NEGATIVE", "300"))  # 5 минут
+
+# Отдавать устаревшую запись сразу и обновлять её в фоне (stale-while-revalidate)
+CACHE_STALE_WHILE_REVALIDATE = os.getenv("CACHE_STALE_WHILE_REVALIDATE", "1") == "1"
+
+# Маркер записи с мягким TTL (старые записи хранятся как обычный JSON)
+_ENVELOPE_MARKER = "__swr__"
+
+# Ключи, которые сейчас обновляются в фоне, и ссылки на задачи обновления
+_refreshing: Set[str] = set()
+_refresh_tasks: Set["asyncio.Task[Any]"] = set()
+
+# Локальный кэш процесса (L1) перед Redis (L2): TTL по типам и ограничение размера
+L1_TTL = {
+    "weather": int(os.getenv("CACHE_L1_TTL_WEATHER", "60")),
+    "forecast": int(os.getenv("CACHE_L1_TTL_FORECAST", "120")),
+    "cities": int(os.getenv("CACHE_L1_TTL_CITIES", "300")),
+    "image": int(os.getenv("CACHE_L1_TTL_IMAGE", "300")),
+    "missing": int(os.getenv("CACHE_L1_TTL_NEGATIVE", "60")),
+}
+L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "1000"))  # 0 - L1 отключён
+L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", str(16 * 1024 * 1024)))  # 0 - без ограничения
+
+# Инвалидация L1 во всех воркерах через Redis pub/sub при очистке кэша
+L1_PUBSUB = os.getenv("CACHE_L1_PUBSUB", "0") == "1"
+L1_INVALIDATE_CHANNEL = "cache:invalidate"
+
+# Очистка кэша по типу: SCAN порциями и UNLINK пачками в фоновой задаче
+CACHE_CLEAR_SCAN_COUNT = int(os.getenv("CACHE_CLEAR_SCAN_COUNT", "1000"))  # подсказка COUNT для SCAN
+CACHE_CLEAR_BATCH_SIZE = int(os.getenv("CACHE_CLEAR_BATCH_SIZE", "500"))  # ключей в одном UNLINK
+CACHE_CLEAR_JOBS_KEEP = 20  # сколько последних задач очистки помнить
+
+# Поколения ключей по типам: очистка типа — один INCR, старые ключи истекают сами по TTL
+CACHE_GENERATIONS = os.getenv("CACHE_GENERATIONS", "0") == "1"
+CACHE_GENERATION_CHECK_INTERVAL = float(os.getenv("CACHE_GENERATION_CHECK_INTERVAL", "5"))  # секунд
+GENERATION_KEY_PREFIX = "cache:generation:"
+GENERATION_TYPES = ("weather", "forecast", "cities", "image", "weather_raw", "forecast_raw", "missing")
+
+# Формат значений в Redis: CACHE_CODEC — сериализация, CACHE_COMPRESSION — сжатие
+# значений длиннее CACHE_COMPRESS_MIN_BYTES
+CACHE_CODEC = os.getenv("CACHE_CODEC", "orjson")  # json, orjson или msgpack
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zlib")  # none, zlib или lz4
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+CACHE_ZLIB_LEVEL = int(os.getenv("CACHE_ZLIB_LEVEL", "3"))
+
+# Значение с заголовком: байт версии формата, байт кодека, байт сжатия.
+# Старые записи — JSON-текст, он не может начинаться с байта версии.
+_CODEC_VERSION = 1
+
+def _orjson_loads(payload: bytes) -> Any:
+    return orjson.loads(payload)
+
+def _msgpack_dumps(value: Any) -> bytes:
+    return msgpack.packb(value, use_bin_type=True)
+
+def _msgpack_loads(payload: bytes) -> Any:
+    return msgpack.unpackb(payload, raw=False)
+
+# Кодеки: имя -> (id в заголовке, dumps, loads); недоступные не регистрируются
+CODECS: Dict[str, Tuple[int, Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+    "json": (1, lambda value: json.dumps(value, ensure_ascii=False).encode("utf-8"), json.loads),
+}
+if orjson is not None:
+    CODECS["orjson"] = (2, orjson.dumps, _orjson_loads)
+if msgpack is not None:
+    CODECS["msgpack"] = (3, _msgpack_dumps, _msgpack_loads)
+
+# Сжатие: имя -> (id в заголовке, compress, decompress)
+COMPRESSIONS: Dict[str, Tuple[int, Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "none": (0, bytes, bytes),
+    "zlib": (1, lambda payload: zlib.compress(payload, CACHE_ZLIB_LEVEL), zlib.decompress),
+}
+if lz4_frame is not None:
+    COMPRESSIONS["lz4"] = (2, lz4_frame.compress, lz4_frame.decompress)
+
+_CODECS_BY_ID = {codec_id: loads for codec_id, _, loads in CODECS.values()}
+_COMPRESSIONS_BY_ID = {compression_id: decompress for compression_id, _, decompress in COMPRESSIONS.values()}
+
+def _resolve(table: Dict[str, Any], name: str, fallback: str, what: str) -> str:
+    if name in table:
+        return name
+    logger.warning(f"{what} '{name}' недоступен, используется '{fallback}'")
+    return fallback
+
+_codec_name = _resolve(CODECS, CACHE_CODEC, "json", "Кодек кэша")
+_compression_name = _resolve(COMPRESSIONS, CACHE_COMPRESSION, "zlib", "Сжатие кэша")
+
+def encode_value(value: Any, codec: Optional[str] = None, compression: Optional[str] = None) -> bytes:
+    """Сериализация значения для Redis с заголовком формата"""
+    codec_id, dumps, _ = CODECS[codec or _codec_name]
+    payload = dumps(value)
+    compression_id = 0
+    if len(payload) >= CACHE_COMPRESS_MIN_BYTES:
+        compression_id, compress, _ = COMPRESSIONS[compression or _compression_name]
+        payload = compress(payload)
+    return bytes((_CODEC_VERSION, codec_id, compression_id)) + payload
+
+def decode_value(raw: Union[bytes, str]) -> Any:
+    """Разбор значения из Redis: с заголовком формата или старый JSON-текст"""
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    if raw[0] != _CODEC_VERSION:
+        return json.loads(raw)
+    loads = _CODECS_BY_ID[raw[1]]
+    payload = raw[3:]
+    if raw[2]:
+        payload = _COMPRESSIONS_BY_ID[raw[2]](payload)
+    return loads(payload)
+
+class LocalCache:
+    """Ограниченный in-memory кэш с TTL и вытеснением давно неиспользуемых записей (LRU).
+
+    Значения возвращаются без копирования — изменять их нельзя.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._items: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value, _ = item
+        if time.monotonic() >= expires_at:
+            self.delete(key)
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float, size: int):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        if self.max_bytes and size > self.max_bytes:
+            return
+        self.delete(key)
+        self._items[key] = (time.monotonic() + ttl, value, size)
+        self.size_bytes += size
+        while len(self._items) > self.max_entries or (self.max_bytes and self.size_bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self._items.popitem(last=False)
+            self.size_bytes -= evicted_size
+
+    def delete(self, key: str):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.size_bytes -= item[2]
+
+    def delete_prefix(self, prefix: str):
+        for key in [k for k in self._items if k.startswith(prefix)]:
+            self.delete(key)
+
+    def clear(self):
+        self._items.clear()
+        self.size_bytes = 0
+
+_local_cache = LocalCache(L1_MAX_ENTRIES, L1_MAX_BYTES)
+CACHE_L1_ENTRIES.set_function(lambda: len(_local_cache))
+CACHE_L1_BYTES.set_function(lambda: _local_cache.size_bytes)
+
+# Счётчики попаданий: L1 — локальный кэш, L2 — Redis
+_hit_stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0}
+
+# Задача, слушающая канал инвалидации
+_invalidation_task: Optional["asyncio.Task[Any]"] = None
+
+# Текущие поколения типов (0 — без поколения) и время последней сверки с Redis
+_generations: Dict[str, int] = {}
+_generations_checked = 0.0
+
+# Задачи очистки кэша: id -> прогресс
+_clear_jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_clear_tasks: Set["asyncio.Task[Any]"] = set()
+
 async def init_redis():
     """Инициализация Redis соединения"""
     global redis_client
     try:
         redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
-        redis_client = redis.from_url(redis_url, encoding="utf-8", decode_responses=True)
+        redis_client = redis.from_url(redis_url)  # значения кэша — байты (см. encode_value)
         # Проверяем соединение
         await redis_client.ping()
         logger.info("Redis соединение установлено успешно")
     except Exception as e:
         logger.warning(f"Не удалось подключиться к Redis: {e}. Кэширование отключено.")
         redis_client = None
+        return
+
+    if CACHE_GENERATIONS:
+        await _sync_generations()
+    if L1_PUBSUB:
+        global _invalidation_task
+        _invalidation_task = asyncio.create_task(_listen_invalidations())
 
 async def close_redis():
     """Закрытие Redis соединения"""
-    global redis_client
+    global redis_client, _invalidation_task
+    if _invalidation_task:
+        _invalidation_task.cancel()
+        _invalidation_task = None
     if redis_client:
         await redis_client.close()
         logger.info("Redis соединение закрыто")
 
 def _generate_cache_key(cache_type: str, identifier: str) -> str:
-    """Генерация ключа кэша"""
-    return f"{cache_type}:{identifier.lower().replace(' ', '_')}"
+    """Генерация ключа кэша (с поколением типа, если оно есть)"""
+    identifier = identifier.lower().replace(' ', '_')
+    generation = _generations.get(cache_type)
+    if generation:
+        return f"{cache_type}:v{generation}:{identifier}"
+    return f"{cache_type}:{identifier}"
 
-async def get_cached_data(cache_type: str, identifier: str) -> Optional[Dict[str, Any]]:
-    """Получение данных из кэша"""
+async def _sync_generations():
+    """Чтение поколений всех типов из Redis одним MGET"""
+    global _generations_checked
+    _generations_checked = time.monotonic()
+    try:
+        values = await redis_client.mget([GENERATION_KEY_PREFIX + cache_type for cache_type in GENERATION_TYPES])
+        for cache_type, value in zip(GENERATION_TYPES, values):
+            generation = int(value) if value else 0
+            if generation != _generations.get(cache_type, 0):
+                _generations[cache_type] = generation
+                _local_cache.delete_prefix(f"{cache_type}:")
+    except Exception as e:
+        logger.error(f"Ошибка при чтении поколений кэша: {e}")
+
+async def _maybe_sync_generations():
+    """Периодическая сверка поколений: очистку могли сделать другие воркеры"""
+    if CACHE_GENERATIONS and time.monotonic() - _generations_checked >= CACHE_GENERATION_CHECK_INTERVAL:
+        await _sync_generations()
+
+def _invalidate_local(cache_type: Optional[str] = None, identifier: Optional[str] = None):
+    """Очистка локального кэша (L1) по тем же правилам, что и clear_cache"""
+    if cache_type and identifier:
+        _local_cache.delete(_generate_cache_key(cache_type, identifier))
+    elif cache_type:
+        _local_cache.delete_prefix(f"{cache_type}:")
+    else:
+        _local_cache.clear()
+
+async def _publish_invalidation(
+    cache_type: Optional[str], identifier: Optional[str], generation: Optional[int] = None
+):
+    """Сообщение остальным воркерам об очистке кэша"""
+    if not L1_PUBSUB:
+        return
+    try:
+        message = json.dumps({"cache_type": cache_type, "identifier": identifier, "generation": generation})
+        await redis_client.publish(L1_INVALIDATE_CHANNEL, message)
+    except Exception as e:
+        logger.error(f"Ошибка при публикации инвалидации кэша: {e}")
+
+async def _listen_invalidations():
+    """Очистка L1 по сообщениям из канала инвалидации"""
+    while redis_client:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(L1_INVALIDATE_CHANNEL)
+            logger.info(f"Подписка на канал инвалидации: {L1_INVALIDATE_CHANNEL}")
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                payload = json.loads(message["data"])
+                if payload.get("generation") is not None:
+                    _generations[payload["cache_type"]] = payload["generation"]
+                _invalidate_local(payload.get("cache_type"), payload.get("identifier"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка в подписке на инвалидацию кэша: {e}")
+            # После обрыва подписки сообщения могли потеряться — сбрасываем L1
+            _local_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+async def _get_entry(cache_type: str, identifier: str) -> Optional[Tuple[Any, bool]]:
+    """Чтение записи из кэша (сначала L1, потом Redis): (данные, свежая ли запись)"""
     if not redis_client:
         return None
     
     try:
+        await _maybe_sync_generations()
         cache_key = _generate_cache_key(cache_type, identifier)
-        cached_data = await redis_client.get(cache_key)
+        local = _local_cache.get(cache_key)
+        if local is not None:
+            _hit_stats["l1_hits"] += 1
+            count_cache(cache_type, "l1_hit")
+            data, fresh_until = local
+            return data, fresh_until is None or time.time() < fresh_until
+
+        with REDIS_SECONDS["get"].time():
+            cached_data = await redis_client.get(cache_key)
         if cached_data:
+            _hit_stats["l2_hits"] += 1
+            count_cache(cache_type, "l2_hit")
             logger.info(f"Данные найдены в кэше: {cache_key}")
-            return json.loads(cached_data)
+            data, fresh_until = _decode_entry(cache_type, cache_key, cached_data)
+            return data, fresh_until is None or time.time() < fresh_until
+        _hit_stats["misses"] += 1
+        count_cache(cache_type, "miss")
     except Exception as e:
+        CACHE_ERRORS.labels(cache_type, "get").inc()
         logger.error(f"Ошибка при получении данных из кэша: {e}")
     
     return None
 
-async def set_cached_data(cache_type: str, identifier: str, data: Any, ttl: int) -> bool:
-    """Сохранение данных в кэш"""
+def _decode_entry(cache_type: str, cache_key: str, cached_data: Union[bytes, str]) -> Tuple[Any, Optional[float]]:
+    """Разбор значения из Redis (конверт SWR или старый JSON) с заполнением L1"""
+    entry = decode_value(cached_data)
+    if isinstance(entry, dict) and entry.get(_ENVELOPE_MARKER):
+        data, fresh_until = entry["data"], entry["fresh_until"]
+    else:
+        data, fresh_until = entry, None
+    _local_cache.set(cache_key, (data, fresh_until), L1_TTL.get(cache_type, 0), len(cached_data))
+    return data, fresh_until
+
+async def get_many_cached(cache_type: str, identifiers: List[str]) -> Dict[str, Any]:
+    """Свежие записи для нескольких идентификаторов: L1, затем один MGET в Redis.
+
+    Возвращает только найденные свежие записи; промахи и устаревшие записи
+    вызывающий добирает обычным путём.
+    """
+    result: Dict[str, Any] = {}
+    if not redis_client or not identifiers:
+        return result
+
+    try:
+        await _maybe_sync_generations()
+        missing = []
+        now = time.time()
+        for identifier in dict.fromkeys(identifiers):
+            cache_key = _generate_cache_key(cache_type, identifier)
+            local = _local_cache.get(cache_key)
+            if local is None:
+                missing.append((identifier, cache_key))
+                continue
+            _hit_stats["l1_hits"] += 1
+            count_cache(cache_type, "l1_hit")
+            data, fresh_until = local
+            if fresh_until is None or now < fresh_until:
+                result[identifier] = data
+
+        if missing:
+            with REDIS_SECONDS["mget"].time():
+                values = await redis_client.mget([cache_key for _, cache_key in missing])
+            for (identifier, cache_key), cached_data in zip(missing, values):
+                if not cached_data:
+                    _hit_stats["misses"] += 1
+                    count_cache(cache_type, "miss")
+                    continue
+                _hit_stats["l2_hits"] += 1
+                count_cache(cache_type, "l2_hit")
+                data, fresh_until = _decode_entry(cache_type, cache_key, cached_data)
+                if fresh_until is None or now < fresh_until:
+                    result[identifier] = data
+        logger.info(f"Пакетное чтение {cache_type}: {len(result)} из {len(identifiers)} найдено в кэше")
+    except Exception as e:
+        CACHE_ERRORS.labels(cache_type, "mget").inc()
+        logger.error(f"Ошибка при пакетном чтении из кэша: {e}")
+
+    return result
+
+def _schedule_refresh(cache_key: str, refresh: Callable[[], Awaitable[Any]]):
+    """Фоновое обновление устаревшей записи (не больше одного на ключ)"""
+    if cache_key in _refreshing:
+        return
+
+    async def run():
+        try:
+            await refresh()
+        except Exception as e:
+            logger.error(f"Ошибка фонового обновления кэша {cache_key}: {e}")
+        finally:
+            _refreshing.discard(cache_key)
+
+    _refreshing.add(cache_key)
+    task = asyncio.create_task(run())
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+    logger.info(f"Запущено фоновое обновление кэша: {cache_key}")
+
+async def get_cached_data(
+    cache_type: str,
+    identifier: str,
+    refresh: Optional[Callable[[], Awaitable[Any]]] = None,
+) -> Optional[Dict[str, Any]]:
+    """Получение данных из кэша.
+
+    Устаревшая запись (между мягким и жёстким TTL) отдаётся сразу, если передан
+    refresh — он запускается в фоне. Без refresh устаревшая запись считается промахом.
+    """
+    entry = await _get_entry(cache_type, identifier)
+    if entry is None:
+        return None
+
+    data, fresh = entry
+    if fresh:
+        return data
+    if refresh is not None and CACHE_STALE_WHILE_REVALIDATE:
+        _schedule_refresh(_generate_cache_key(cache_type, identifier), refresh)
+        return data
+    return None
+
+async def get_fresh_seconds_left(cache_type: str, identifier: str) -> Optional[float]:
+    """Сколько секунд запись ещё будет свежей (None — записи нет). Для прогрева кэша."""
+    if not redis_client:
+        return None
+
+    try:
+        cache_key = _generate_cache_key(cache_type, identifier)
+        local = _local_cache.get(cache_key)
+        if local is not None and local[1] is not None:
+            return local[1] - time.time()
+        cached_data = await redis_client.get(cache_key)
+        if not cached_data:
+            return None
+        entry = decode_value(cached_data)
+        if isinstance(entry, dict) and entry.get(_ENVELOPE_MARKER):
+            return entry["fresh_until"] - time.time()
+        return float(await redis_client.ttl(cache_key))
+    except Exception as e:
+        logger.error(f"Ошибка при проверке свежести кэша: {e}")
+        return None
+
+def is_cache_available() -> bool:
+    """Подключён ли Redis"""
+    return redis_client is not None
+
+async def get_stale_cached_data(cache_type: str, identifier: str) -> Optional[Dict[str, Any]]:
+    """Получение данных из кэша без учёта мягкого TTL (для ответа при ошибке WeatherAPI)"""
+    entry = await _get_entry(cache_type, identifier)
+    return entry[0] if entry else None
+
+async def set_cached_data(
+    cache_type: str,
+    identifier: str,
+    data: Any,
+    ttl: int,
+    hard_ttl: Optional[int] = None,
+) -> bool:
+    """Сохранение данных в кэш.
+
+    ttl — сколько запись свежая; hard_ttl — сколько она хранится в Redis.
+    """
     if not redis_client:
         return False
     
     try:
         cache_key = _generate_cache_key(cache_type, identifier)
-        await redis_client.set(cache_key, json.dumps(data), ex=ttl)
-        logger.info(f"Данные сохранены в кэш: {cache_key} (TTL: {ttl}s)")
+        if hard_ttl and hard_ttl > ttl:
+            fresh_until = time.time() + ttl
+            payload = encode_value({_ENVELOPE_MARKER: 1, "fresh_until": fresh_until, "data": data})
+            with REDIS_SECONDS["set"].time():
+                await redis_client.set(cache_key, payload, ex=hard_ttl)
+        else:
+            fresh_until = None
+            payload = encode_value(data)
+            with REDIS_SECONDS["set"].time():
+                await redis_client.set(cache_key, payload, ex=ttl)
+        _local_cache.set(cache_key, (data, fresh_until), min(L1_TTL.get(cache_type, 0), ttl), len(payload))
+        logger.info(f"Данные сохранены в кэш: {cache_key} (TTL: {ttl}s, жёсткий TTL: {hard_ttl or ttl}s)")
         return True
     except Exception as e:
+        CACHE_ERRORS.labels(cache_type, "set").inc()
         logger.error(f"Ошибка при сохранении данных в кэш: {e}")
         return False
 
-async def get_weather_cached(city: str) -> Optional[Dict[str, Any]]:
+# Последнее время обновления по городам и наблюдаемые интервалы между обновлениями в WeatherAPI
+_last_updated: "OrderedDict[str, int]" = OrderedDict()
+_update_intervals: deque = deque(maxlen=ADAPTIVE_TTL_SAMPLES)
+
+def _observe_update(location: str, updated_epoch: int):
+    """Интервал между двумя разными last_updated_epoch одного города — образец интервала обновления"""
+    previous = _last_updated.get(location)
+    _last_updated[location] = updated_epoch
+    _last_updated.move_to_end(location)
+    while len(_last_updated) > ADAPTIVE_TTL_TRACKED:
+        _last_updated.popitem(last=False)
+    if previous is not None and 0 < updated_epoch - previous <= ADAPTIVE_TTL_MAX * 2:
+        _update_intervals.append(updated_epoch - previous)
+
+def update_interval() -> float:
+    """Оценка интервала обновления данных в WeatherAPI (медиана последних наблюдений)"""
+    if not _update_intervals:
+        return UPSTREAM_UPDATE_INTERVAL
+    return statistics.median(_update_intervals)
+
+def adaptive_ttl(location: str, data: Dict[str, Any], default_ttl: int) -> int:
+    """Сколько секунд запись погоды свежая: до следующего ожидаемого обновления в WeatherAPI"""
+    updated_epoch = data.get("current", {}).get("last_updated_epoch") if isinstance(data, dict) else None
+    if CACHE_ADAPTIVE_TTL and updated_epoch:
+        _observe_update(location, updated_epoch)
+    return freshness_ttl(data, default_ttl)
+
+def freshness_ttl(data: Dict[str, Any], default_ttl: int = DEFAULT_TTL_WEATHER) -> int:
+    """То же, что adaptive_ttl, без учёта наблюдения: сколько ещё свежи эти данные (для картинок)"""
+    updated_epoch = data.get("current", {}).get("last_updated_epoch") if isinstance(data, dict) else None
+    if not CACHE_ADAPTIVE_TTL or not updated_epoch:
+        return default_ttl
+    # Если обновление запаздывает, проверяем снова через ADAPTIVE_TTL_MIN
+    ttl = updated_epoch + update_interval() + ADAPTIVE_TTL_LAG - time.time()
+    return int(min(max(ttl, ADAPTIVE_TTL_MIN), ADAPTIVE_TTL_MAX))
+
+def get_adaptive_ttl_stats() -> Dict[str, Any]:
+    return {
+        "enabled": CACHE_ADAPTIVE_TTL,
+        "update_interval": update_interval(),
+        "samples": len(_update_intervals),
+        "min": ADAPTIVE_TTL_MIN,
+        "max": ADAPTIVE_TTL_MAX,
+    }
+
+def raw_cache_type(cache_type: str) -> str:
+    """Тип кэша для полного ответа WeatherAPI (по умолчанию кэшируется компактная модель)"""
+    return f"{cache_type}_raw"
+
+def _with_raw(cache_type: str) -> List[str]:
+    """Тип и тип его полного ответа: очищаются вместе"""
+    if cache_type in ("weather", "forecast"):
+        return [cache_type, raw_cache_type(cache_type)]
+    return [cache_type]
+
+async def get_weather_cached(
+    city: str, refresh: Optional[Callable[[], Awaitable[Any]]] = None, raw: bool = False
+) -> Optional[Dict[str, Any]]:
     """Получение погоды с кэшированием"""
-    return await get_cached_data("weather", city)
+    return await get_cached_data(raw_cache_type("weather") if raw else "weather", city, refresh)
 
-async def set_weather_cached(city: str, data: Dict[str, Any]) -> bool:
-    """Сохранение погоды в кэш"""
-    return await set_cached_data("weather", city, data, DEFAULT_TTL_WEATHER)
+async def set_weather_cached(city: str, data: Dict[str, Any], raw: bool = False) -> bool:
+    """Сохранение погоды в кэш (TTL — до ожидаемого обновления в WeatherAPI)"""
+    cache_type = raw_cache_type("weather") if raw else "weather"
+    ttl = adaptive_ttl(city, data, DEFAULT_TTL_WEATHER)
+    return await set_cached_data(cache_type, city, data, ttl, max(HARD_TTL_WEATHER, ttl))
 
-async def get_forecast_cached(city: str) -> Optional[Dict[str, Any]]:
+async def get_forecast_cached(
+    city: str, refresh: Optional[Callable[[], Awaitable[Any]]] = None, raw: bool = False
+) -> Optional[Dict[str, Any]]:
     """Получение прогноза с кэшированием"""
-    return await get_cached_data("forecast", city)
+    return await get_cached_data(raw_cache_type("forecast") if raw else "forecast", city, refresh)
 
-async def set_forecast_cached(city: str, data: Dict[str, Any]) -> bool:
+async def set_forecast_cached(city: str, data: Dict[str, Any], raw: bool = False) -> bool:
     """Сохранение прогноза в кэш"""
-    return await set_cached_data("forecast", city, data, DEFAULT_TTL_FORECAST)
+    cache_type = raw_cache_type("forecast") if raw else "forecast"
+    return await set_cached_data(cache_type, city, data, DEFAULT_TTL_FORECAST, HARD_TTL_FORECAST)
+
+async def is_location_missing(location: str) -> bool:
+    """WeatherAPI недавно ответил, что такого города нет"""
+    return bool(await get_cached_data("missing", location))
+
+async def set_location_missing(location: str) -> bool:
+    """Запоминание «город не найден» на NEGATIVE_TTL"""
+    return await set_cached_data("missing", location, True, NEGATIVE_TTL)
 
 async def get_cities_cached(query: str) -> Optional[List[Dict[str, Any]]]:
-    """Получение списка городов с кэшированием"""
+    """Получение списка городов с кэшированием (пустой список — город не найден)"""
     cached_data = await get_cached_data("cities", query)
-    if cached_data and isinstance(cached_data, list):
+    if isinstance(cached_data, list):
         return cached_data
     return None
 
 async def set_cities_cached(query: str, data: List[Dict[str, Any]]) -> bool:
-    """Сохранение списка городов в кэш"""
-    return await set_cached_data("cities", query, data, DEFAULT_TTL_CITIES)
+    """Сохранение списка городов в кэш; пустой результат хранится NEGATIVE_TTL"""
+    if not data:
+        return await set_cached_data("cities", query, data, NEGATIVE_TTL)
+    return await set_cached_data("cities", query, data, DEFAULT_TTL_CITIES, HARD_TTL_CITIES)
+
+_PNG_SIGNATURE = b"\x89PNG"
 
-async def clear_cache(cache_type: Optional[str] = None, identifier: Optional[str] = None) -> bool:
-    """Очистка кэша"""
+async def get_image_cached(content_key: str) -> Optional[bytes]:
+    """Получение готовой PNG-картинки из кэша"""
+    if not redis_client:
+        return None
+
+    try:
+        cache_key = _generate_cache_key("image", content_key)
+        image = _local_cache.get(cache_key)
+        if image is not None:
+            count_cache("image", "l1_hit")
+            return image
+        with REDIS_SECONDS["get"].time():
+            image = await redis_client.get(cache_key)
+        if image:
+            count_cache("image", "l2_hit")
+            if not image.startswith(_PNG_SIGNATURE):
+                # Запись старого формата (base64) — читается, пока не истечёт
+                image = base64.b64decode(image)
+            _local_cache.set(cache_key, image, L1_TTL["image"], len(image))
+            return image
+        count_cache("image", "miss")
+    except Exception as e:
+        CACHE_ERRORS.labels("image", "get").inc()
+        logger.error(f"Ошибка при получении картинки из кэша: {e}")
+
+    return None
+
+async def set_image_cached(content_key: str, image: bytes, ttl: int = DEFAULT_TTL_WEATHER) -> bool:
+    """Сохранение PNG-картинки в кэш (в Redis — байты как есть) на время свежести погоды, по которой она нарисована"""
+    if not redis_client:
+        return False
+
+    try:
+        cache_key = _generate_cache_key("image", content_key)
+        with REDIS_SECONDS["set"].time():
+            await redis_client.set(cache_key, image, ex=ttl)
+        _local_cache.set(cache_key, image, min(L1_TTL["image"], ttl), len(image))
+        return True
+    except Exception as e:
+        CACHE_ERRORS.labels("image", "set").inc()
+        logger.error(f"Ошибка при сохранении картинки в кэш: {e}")
+        return False
+
+async def _unlink_matching(job: Dict[str, Any], pattern: str):
+    """Удаление ключей по шаблону: SCAN порциями, UNLINK пачками (Redis не блокируется)"""
+    batch: List[Any] = []
+    cursor = 0
+    while True:
+        cursor, keys = await redis_client.scan(cursor, match=pattern, count=CACHE_CLEAR_SCAN_COUNT)
+        job["scanned"] += len(keys)
+        batch.extend(keys)
+        while len(batch) >= CACHE_CLEAR_BATCH_SIZE:
+            job["deleted"] += await redis_client.unlink(*batch[:CACHE_CLEAR_BATCH_SIZE])
+            del batch[:CACHE_CLEAR_BATCH_SIZE]
+        if not cursor:
+            break
+    if batch:
+        job["deleted"] += await redis_client.unlink(*batch)
+
+async def _run_clear_job(job: Dict[str, Any]):
+    try:
+        for cache_type in _with_raw(job["cache_type"]):
+            await _unlink_matching(job, f"{cache_type}:*")
+        job["status"] = "done"
+        logger.info(f"Очищено {job['deleted']} ключей типа: {job['cache_type']}")
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+        logger.error(f"Ошибка при очистке кэша типа {job['cache_type']}: {e}")
+    finally:
+        job["finished_at"] = time.time()
+        # Во время прохода L1 мог снова заполниться удаляемыми записями — у нас и у остальных воркеров
+        for cache_type in _with_raw(job["cache_type"]):
+            _invalidate_local(cache_type)
+            await _publish_invalidation(cache_type, None)
+
+def start_clear_job(cache_type: str) -> Dict[str, Any]:
+    """Запуск фоновой очистки всех ключей типа; прогресс — в возвращённом словаре"""
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "cache_type": cache_type,
+        "status": "running",
+        "scanned": 0,
+        "deleted": 0,
+        "started_at": time.time(),
+        "finished_at": None,
+        "error": None,
+    }
+    _clear_jobs[job["id"]] = job
+    while len(_clear_jobs) > CACHE_CLEAR_JOBS_KEEP:
+        _clear_jobs.popitem(last=False)
+    task = asyncio.create_task(_run_clear_job(job))
+    job["task"] = task
+    _clear_tasks.add(task)
+    task.add_done_callback(_clear_tasks.discard)
+    return job
+
+def get_clear_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Прогресс задачи очистки (без ссылки на asyncio-задачу)"""
+    job = _clear_jobs.get(job_id)
+    return {k: v for k, v in job.items() if k != "task"} if job else None
+
+def list_clear_jobs() -> List[Dict[str, Any]]:
+    """Последние задачи очистки, новые в конце"""
+    return [get_clear_job(job_id) for job_id in _clear_jobs]
+
+async def bump_generation(cache_type: str) -> int:
+    """Логическая очистка типа за O(1): новое поколение ключей"""
+    generation = int(await redis_client.incr(GENERATION_KEY_PREFIX + cache_type))
+    _generations[cache_type] = generation
+    return generation
+
+async def clear_cache(
+    cache_type: Optional[str] = None, identifier: Optional[str] = None, background: bool = False
+) -> Any:
+    """Очистка кэша.
+
+    Очистка типа — новое поколение ключей (CACHE_GENERATIONS=1) или фоновый
+    проход SCAN + UNLINK; при background=True возвращается задача очистки,
+    иначе её завершение дожидается вызывающий. Вместе с weather и forecast
+    очищаются их полные ответы (weather_raw, forecast_raw).
+    """
     if not redis_client:
         return False
     
+    result: Any = True
+    generations: Dict[str, Optional[int]] = {}
     try:
         if cache_type and identifier:
             # Очистка конкретного ключа
-            cache_key = _generate_cache_key(cache_type, identifier)
-            await redis_client.delete(cache_key)
-            logger.info(f"Кэш очищен: {cache_key}")
+            cache_keys = [_generate_cache_key(t, identifier) for t in _with_raw(cache_type)]
+            await redis_client.unlink(*cache_keys)
+            logger.info(f"Кэш очищен: {', '.join(cache_keys)}")
+        elif cache_type and CACHE_GENERATIONS:
+            for t in _with_raw(cache_type):
+                generations[t] = await bump_generation(t)
+                logger.info(f"Новое поколение ключей типа {t}: {generations[t]}")
         elif cache_type:
             # Очистка всех ключей определенного типа
-            pattern = f"{cache_type}:*"
-            keys = await redis_client.keys(pattern)
-            if keys:
-                await redis_client.delete(*keys)
-                logger.info(f"Очищено {len(keys)} ключей типа: {cache_type}")
+            job = start_clear_job(cache_type)
+            if background:
+                result = get_clear_job(job["id"])
+            else:
+                await job["task"]
+                result = job["status"] == "done"
         else:
-            # Очистка всего кэша
-            await redis_client.flushdb()
+            # Очистка всего кэша (FLUSHDB ASYNC освобождает память в фоне)
+            await redis_client.flushdb(asynchronous=True)
+            _generations.clear()
             logger.info("Весь кэш очищен")
-        return True
     except Exception as e:
         logger.error(f"Ошибка при очистке кэша: {e}")
+        result = False
+    for t in _with_raw(cache_type) if cache_type else [cache_type]:
+        _invalidate_local(t, identifier)
+        await _publish_invalidation(t, identifier, generations.get(t))
+    return result
+
+# Хэш Redis с городами пользователей (user_id -> city_id)
+USER_CITY_HASH = "user_city"
+
+async def get_user_city_cached(user_id: int) -> Optional[int]:
+    """Получение города пользователя из Redis"""
+    if not redis_client:
+        return None
+
+    try:
+        city_id = await redis_client.hget(USER_CITY_HASH, str(user_id))
+        return int(city_id) if city_id is not None else None
+    except Exception as e:
+        logger.error(f"Ошибка при получении города пользователя из кэша: {e}")
+        return None
+
+async def set_user_city_cached(user_id: int, city_id: int) -> bool:
+    """Сохранение города пользователя в Redis"""
+    if not redis_client:
+        return False
+
+    try:
+        await redis_client.hset(USER_CITY_HASH, str(user_id), city_id)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении города пользователя в кэш: {e}")
         return False
 
+# Снятие блокировки только её владельцем (сравнение токена и удаление атомарно)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+def _lock_key(name: str) -> str:
+    """Ключ распределённой блокировки"""
+    return f"lock:{name}"
+
+async def acquire_lock(name: str, ttl: float) -> Optional[str]:
+    """Попытка взять распределённую блокировку.
+
+    Возвращает токен владельца или None, если блокировку держит другой процесс.
+    Без Redis координировать некого, поэтому блокировка считается взятой.
+    """
+    token = uuid.uuid4().hex
+    if not redis_client:
+        return token
+
+    try:
+        acquired = await redis_client.set(_lock_key(name), token, nx=True, px=int(ttl * 1000))
+        return token if acquired else None
+    except Exception as e:
+        logger.error(f"Ошибка при взятии блокировки {name}: {e}")
+        return token
+
+async def release_lock(name: str, token: str) -> bool:
+    """Снятие распределённой блокировки"""
+    if not redis_client:
+        return False
+
+    try:
+        return bool(await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, _lock_key(name), token))
+    except Exception as e:
+        logger.error(f"Ошибка при снятии блокировки {name}: {e}")
+        return False
+
+async def is_locked(name: str) -> bool:
+    """Проверка, держит ли кто-то блокировку"""
+    if not redis_client:
+        return False
+
+    try:
+        return bool(await redis_client.exists(_lock_key(name)))
+    except Exception as e:
+        logger.error(f"Ошибка при проверке блокировки {name}: {e}")
+        return False
+
+def get_local_cache_stats() -> Dict[str, Any]:
+    """Статистика локального кэша и доли попаданий в L1 и L2"""
+    lookups = sum(_hit_stats.values())
+    return {
+        "entries": len(_local_cache),
+        "size_bytes": _local_cache.size_bytes,
+        **_hit_stats,
+        "l1_hit_ratio": round(_hit_stats["l1_hits"] / lookups, 4) if lookups else 0.0,
+        "l2_hit_ratio": round(_hit_stats["l2_hits"] / lookups, 4) if lookups else 0.0,
+    }
+
 async def get_cache_stats() -> Dict[str, Any]:
     """Получение статистики кэша"""
     if not redis_client:
@@ -134,7 +885,9 @@ async def get_cache_stats() -> Dict[str, Any]:
             "connected": True,
             "keys_count": keys_count,
             "memory_usage": info.get("used_memory_human", "N/A"),
-            "uptime": info.get("uptime_in_seconds", 0)
+            "uptime": info.get("uptime_in_seconds", 0),
+            "l1": get_local_cache_stats(),
+            "adaptive_ttl": get_adaptive_ttl_stats(),
         }
     except Exception as e:
         logger.error(f"Ошибка при получении статистики кэша: {e}")
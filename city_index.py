@@ -0,0 +1,277 @@
+import bisect
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Настройки локального индекса городов
+CITY_INDEX_ENABLED = os.getenv("CITY_INDEX_ENABLED", "1") == "1"
+CITY_INDEX_PATH = os.getenv("CITY_INDEX_PATH", "data/cities.json")  # набор городов для начальной загрузки
+CITY_INDEX_SAVE = os.getenv("CITY_INDEX_SAVE", "1") == "1"  # сохранять выученное при остановке
+CITY_INDEX_MAX_KEYS = int(os.getenv("CITY_INDEX_MAX_KEYS", "200000"))
+CITY_INDEX_MAX_CITIES = int(os.getenv("CITY_INDEX_MAX_CITIES", "50000"))
+CITY_INDEX_MAX_QUERIES = int(os.getenv("CITY_INDEX_MAX_QUERIES", "50000"))
+CITY_INDEX_MAX_RESULTS = int(os.getenv("CITY_INDEX_MAX_RESULTS", "20"))
+CITY_INDEX_QUERY_TTL = int(os.getenv("CITY_INDEX_QUERY_TTL", os.getenv("CACHE_TTL_CITIES", "3600")))  # сколько верить ответу WeatherAPI
+CITY_INDEX_MAX_ALIASES = int(os.getenv("CITY_INDEX_MAX_ALIASES", "50000"))
+LOCATION_MATCH_DEGREES = 0.1  # допуск по координатам при сопоставлении ответа WeatherAPI с городом
+
+# Транслитерация кириллицы в латиницу: «Казань» и «Kazan» дают один ключ
+_TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "iu",
+    "я": "ia", "і": "i", "ї": "i", "є": "e", "ґ": "g",
+})
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+def normalize(text: str) -> str:
+    """Ключ поиска: нижний регистр, кириллица в латинице, без диакритики и знаков"""
+    text = text.lower().translate(_TRANSLIT)
+    text = "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(" ", text).strip()
+
+class CityIndex:
+    """
+    Индекс городов в памяти процесса.
+
+    Поиск отвечает только повтором запроса, на который WeatherAPI уже ответил:
+    search.json — автодополнение с ограниченным и ранжированным ответом, и
+    ответ на «Мо» не содержит всех городов на «Мос». Ответы живут query_ttl
+    секунд. Города хранятся не больше max_cities, давно не нужные вытесняются
+    вместе со своими ключами. Ключи — нормализованные названия городов и
+    запросы, на которые WeatherAPI вернул этот город; хранятся в
+    отсортированном списке (двоичный поиск).
+    """
+
+    def __init__(
+        self,
+        max_keys: int = CITY_INDEX_MAX_KEYS,
+        max_cities: int = CITY_INDEX_MAX_CITIES,
+        max_queries: int = CITY_INDEX_MAX_QUERIES,
+        max_aliases: int = CITY_INDEX_MAX_ALIASES,
+        query_ttl: float = CITY_INDEX_QUERY_TTL,
+    ):
+        self.max_keys = max_keys
+        self.max_cities = max_cities
+        self.max_queries = max_queries
+        self.max_aliases = max_aliases
+        self.query_ttl = query_ttl
+        self._cities: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._keys: List[Tuple[str, int]] = []
+        self._key_set = set()
+        self._city_keys: Dict[int, List[str]] = {}
+        # Ответы WeatherAPI на точные запросы — (истекает, id в исходном порядке)
+        self._queries: "OrderedDict[str, Tuple[float, List[int]]]" = OrderedDict()
+        # Названия из запросов погоды -> id города, который для них вернул WeatherAPI
+        self._aliases: "OrderedDict[str, int]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "learned": 0}
+
+    def __len__(self) -> int:
+        return len(self._cities)
+
+    def get(self, city_id: int) -> Optional[Dict[str, Any]]:
+        """Город по id WeatherAPI"""
+        return self._cities.get(city_id)
+
+    def _add_key(self, key: str, city_id: int):
+        if not key or (key, city_id) in self._key_set:
+            return
+        if len(self._keys) >= self.max_keys:
+            return
+        self._key_set.add((key, city_id))
+        self._city_keys.setdefault(city_id, []).append(key)
+        bisect.insort(self._keys, (key, city_id))
+
+    def add(self, city: Dict[str, Any], aliases: Iterable[str] = ()):
+        """Добавление города (формат search.json WeatherAPI) с дополнительными названиями"""
+        city_id = city.get("id")
+        if city_id is None or not city.get("name"):
+            return
+        self._cities[city_id] = city
+        self._cities.move_to_end(city_id)
+        self._add_key(normalize(city["name"]), city_id)
+        for alias in aliases:
+            self._add_key(normalize(alias), city_id)
+        while len(self._cities) > self.max_cities:
+            self._evict(next(iter(self._cities)))
+
+    def _evict(self, city_id: int):
+        """Удаление города и его ключей; выученные ответы с ним перестают отвечать"""
+        del self._cities[city_id]
+        for key in self._city_keys.pop(city_id, ()):
+            self._key_set.discard((key, city_id))
+            position = bisect.bisect_left(self._keys, (key, city_id))
+            if position < len(self._keys) and self._keys[position] == (key, city_id):
+                del self._keys[position]
+
+    def learn(self, query: str, cities: List[Dict[str, Any]]):
+        """Запоминание ответа WeatherAPI: сами города и запрос как их название"""
+        key = normalize(query)
+        if not key:
+            return
+        for city in cities:
+            self.add(city, (query,))
+        ids = [city["id"] for city in cities if city.get("id") is not None]
+        self._queries[key] = (time.time() + self.query_ttl, ids)
+        self._queries.move_to_end(key)
+        while len(self._queries) > self.max_queries:
+            self._queries.popitem(last=False)
+        self._stats["learned"] += 1
+
+    def _learned(self, key: str) -> Optional[List[int]]:
+        """Ответ WeatherAPI на этот запрос, если он ещё не истёк"""
+        entry = self._queries.get(key)
+        if entry is None:
+            return None
+        expires_at, ids = entry
+        if expires_at <= time.time():
+            del self._queries[key]
+            return None
+        self._queries.move_to_end(key)
+        return ids
+
+    def search(self, query: str, limit: int = CITY_INDEX_MAX_RESULTS) -> Optional[List[Dict[str, Any]]]:
+        """Города из выученного ответа WeatherAPI на этот запрос или None, если индексу нечего ответить"""
+        key = normalize(query)
+        ids = self._learned(key) if len(key) >= 2 else None
+        if ids and any(city_id not in self._cities for city_id in ids):
+            # Часть городов ответа вытеснена — ответ неполный, спрашиваем WeatherAPI заново
+            del self._queries[key]
+            ids = None
+        if not ids:
+            self._stats["misses"] += 1
+            return None
+        for city_id in ids:
+            self._cities.move_to_end(city_id)
+        self._stats["hits"] += 1
+        return [self._cities[city_id] for city_id in ids[:limit]]
+
+    def find(self, name: str, lat: float, lon: float) -> Optional[int]:
+        """id города с таким названием и координатами (блок location ответа WeatherAPI)"""
+        key = normalize(name)
+        start = bisect.bisect_left(self._keys, (key,))
+        for found, city_id in self._keys[start:]:
+            if found != key:
+                break
+            city = self._cities[city_id]
+            if (
+                abs(city.get("lat", 1000) - lat) <= LOCATION_MATCH_DEGREES
+                and abs(city.get("lon", 1000) - lon) <= LOCATION_MATCH_DEGREES
+            ):
+                return city_id
+        return None
+
+    def resolve(self, name: str) -> Optional[int]:
+        """id города, к которому WeatherAPI уже приводил это название"""
+        key = normalize(name)
+        city_id = self._aliases.get(key)
+        if city_id is not None:
+            self._aliases.move_to_end(key)
+        return city_id
+
+    def learn_location(self, name: str, location: Dict[str, Any]) -> Optional[int]:
+        """Запоминание, к какому городу WeatherAPI привёл название; None — город неизвестен индексу"""
+        key = normalize(name)
+        if not key or "lat" not in location or "lon" not in location:
+            return None
+        city_id = self.find(location.get("name", ""), location["lat"], location["lon"])
+        if city_id is None:
+            return None
+        self._aliases[key] = city_id
+        self._aliases.move_to_end(key)
+        while len(self._aliases) > self.max_aliases:
+            self._aliases.popitem(last=False)
+        return city_id
+
+    def load(self, path: str) -> int:
+        """Загрузка набора городов: список из search.json или файл, сохранённый save()"""
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        if isinstance(payload, list):
+            payload = {"cities": payload}
+        for city in payload.get("cities", []):
+            self.add(city, city.get("aliases", ()))
+        now = time.time()
+        for key, entry in payload.get("queries", {}).items():
+            # Истёкшие ответы и ответы без срока (старый формат файла) не загружаем
+            if isinstance(entry, dict) and entry.get("expires_at", 0) > now:
+                self._queries[key] = (entry["expires_at"], entry["ids"])
+        self._aliases.update(payload.get("aliases", {}))
+        return len(self._cities)
+
+    def save(self, path: str):
+        """Сохранение городов и выученных названий (атомарно, через временный файл)"""
+        aliases: Dict[int, List[str]] = {}
+        for key, city_id in self._keys:
+            aliases.setdefault(city_id, []).append(key)
+        payload = {
+            "cities": [dict(city, aliases=aliases.get(city_id, [])) for city_id, city in self._cities.items()],
+            "queries": {
+                key: {"expires_at": expires_at, "ids": ids}
+                for key, (expires_at, ids) in self._queries.items()
+                if expires_at > time.time()
+            },
+            "aliases": dict(self._aliases),
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            "enabled": CITY_INDEX_ENABLED,
+            "cities": len(self._cities),
+            "keys": len(self._keys),
+            "queries": len(self._queries),
+            "aliases": len(self._aliases),
+            **self._stats,
+            "hit_ratio": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+city_index = CityIndex()
+
+def location_key(city: Optional[str] = None, city_id: Optional[Any] = None) -> str:
+    """Идентификатор города в кэше погоды, прогноза и картинок.
+
+    Запросы по id и названия, которые WeatherAPI уже приводил к этому городу,
+    дают один ключ id_<id>; незнакомые названия — само название без лишних пробелов.
+    """
+    if city_id:
+        return f"id_{city_id}"
+    name = " ".join((city or "").split())
+    if CITY_INDEX_ENABLED:
+        resolved = city_index.resolve(name)
+        if resolved is not None:
+            return f"id_{resolved}"
+    return name
+
+def load_city_index():
+    """Начальная загрузка индекса из CITY_INDEX_PATH, если файл есть"""
+    if not CITY_INDEX_ENABLED or not os.path.exists(CITY_INDEX_PATH):
+        return
+    try:
+        count = city_index.load(CITY_INDEX_PATH)
+        logger.info(f"Индекс городов загружен из {CITY_INDEX_PATH}: {count} городов")
+    except Exception as e:
+        logger.error(f"Не удалось загрузить индекс городов из {CITY_INDEX_PATH}: {e}")
+
+def save_city_index():
+    """Сохранение выученного индекса при остановке"""
+    if not CITY_INDEX_ENABLED or not CITY_INDEX_SAVE or not len(city_index):
+        return
+    try:
+        city_index.save(CITY_INDEX_PATH)
+        logger.info(f"Индекс городов сохранён в {CITY_INDEX_PATH}: {len(city_index)} городов")
+    except Exception as e:
+        logger.error(f"Не удалось сохранить индекс городов в {CITY_INDEX_PATH}: {e}")
@@ -0,0 +1,60 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Глобальная HTTP-сессия для запросов к WeatherAPI (одна на процесс)
+http_session: Optional[aiohttp.ClientSession] = None
+
+# Настройки пула соединений
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))  # всего соединений
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", "20"))  # соединений на один хост
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))  # секунд
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))  # секунд
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))  # секунд
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))  # секунд
+
+def _create_session() -> aiohttp.ClientSession:
+    """Создание сессии с настроенным пулом соединений и таймаутами"""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_SIZE,
+        limit_per_host=HTTP_POOL_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        use_dns_cache=True,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=HTTP_CONNECT_TIMEOUT,
+        sock_read=HTTP_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+async def init_http_session():
+    """Создание общей HTTP-сессии при запуске приложения"""
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = _create_session()
+        logger.info(
+            f"HTTP-сессия создана (пул: {HTTP_POOL_SIZE}, на хост: {HTTP_POOL_PER_HOST})"
+        )
+
+async def close_http_session():
+    """Закрытие общей HTTP-сессии"""
+    global http_session
+    if http_session:
+        await http_session.close()
+        http_session = None
+        logger.info("HTTP-сессия закрыта")
+
+@asynccontextmanager
+async def weather_api_session() -> AsyncIterator[aiohttp.ClientSession]:
+    """Общая сессия, если она создана; иначе временная (например, без startup в тестах)"""
+    if http_session is not None and not http_session.closed:
+        yield http_session
+        return
+    async with _create_session() as session:
+        yield session
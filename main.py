@@ -1,16 +1,27 @@
-from fastapi import FastAPI, HTTPException, Depends, Response
+from fastapi import FastAPI, HTTPException, Depends, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import uvicorn
 import os
+import base64
+import json
 from dotenv import load_dotenv
-import aiohttp
 import asyncio
 import logging
-import sqlite3
-from weather_image import generate_weather_image
-from cache import init_redis, close_redis, get_weather_cached, set_weather_cached, get_forecast_cached, set_forecast_cached, get_cities_cached, set_cities_cached, get_cache_stats, clear_cache
+from weather_image import image_content_key
+from weather_model import trim_weather, current_from_forecast, forecast_horizon, slice_forecast, FORECAST_HORIZON_FIELD
+from metrics import render_metrics
+from upstream import call_upstream, get_breaker_stats, LocationNotFound, UPSTREAM_ATTEMPTS
+from render_pool import start_render_pool, stop_render_pool, render_weather_image, get_render_stats, RenderQueueFull
+from http_client import init_http_session, close_http_session, weather_api_session
+from singleflight import single_flight
+from warmer import start_warmer, stop_warmer, get_warmer_stats
+from user_store import UserStore
+from city_index import city_index, normalize, location_key, load_city_index, save_city_index, CITY_INDEX_ENABLED
+from cache import LocalCache, _generate_cache_key, get_user_city_cached, set_user_city_cached, init_redis, close_redis, get_weather_cached, set_weather_cached, get_many_cached, get_forecast_cached, set_forecast_cached, get_cities_cached, set_cities_cached, is_location_missing, set_location_missing, get_stale_cached_data, raw_cache_type, get_image_cached, set_image_cached, freshness_ttl, get_cache_stats, clear_cache, get_clear_job, list_clear_jobs, DEFAULT_TTL_CITIES, NEGATIVE_TTL
 
 load_dotenv()
 
@@ -46,7 +57,7 @@ class CitySearchRequest(BaseModel):
 class WeatherResponse(BaseModel):
     success: bool
     formatted_message: Optional[str] = None
-    raw_data: Optional[Dict[str, Any]] = None
+    raw_data: Optional[Dict[str, Any]] = None  # компактная модель, полный ответ WeatherAPI — с include_raw=1
     error: Optional[str] = None
 
 class CitySearchResponse(BaseModel):
@@ -57,6 +68,7 @@ class CitySearchResponse(BaseModel):
 class CityListResponse(BaseModel):
     cities: List[Dict[str, Any]]
     has_next: bool
+    total: int = 0
 
 class CityWeatherRequest(BaseModel):
     city: str
@@ -64,44 +76,58 @@ class CityWeatherRequest(BaseModel):
 # === Работа с БД пользователей ===
 DB_PATH = os.getenv("USERS_DB_PATH", "data/users.db")
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    conn = get_db_connection()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            city_id INTEGER
-        )
-        """
-    )
-    conn.commit()
-    conn.close()
-
-init_db()
-
-def set_user_city(user_id: int, city_id: int):
-    conn = get_db_connection()
-    conn.execute(
-        "INSERT OR REPLACE INTO users (user_id, city_id) VALUES (?, ?)",
-        (user_id, city_id)
-    )
-    conn.commit()
-    conn.close()
-
-def get_user_city(user_id: int) -> Optional[int]:
-    conn = get_db_connection()
-    cur = conn.execute(
-        "SELECT city_id FROM users WHERE user_id = ?",
-        (user_id,)
-    )
-    row = cur.fetchone()
-    conn.close()
-    return row["city_id"] if row else None
+user_store = UserStore(DB_PATH)
+
+# Кэш user_id -> city_id в памяти процесса (и, опционально, в Redis) перед SQLite
+USER_CITY_CACHE_SIZE = int(os.getenv("USER_CITY_CACHE_SIZE", "100000"))
+USER_CITY_CACHE_TTL = int(os.getenv("USER_CITY_CACHE_TTL", "3600"))
+USER_CITY_CACHE_REDIS = os.getenv("USER_CITY_CACHE_REDIS", "0") == "1"
+# С Redis город могут сменить через другой воркер: в процессе держим его недолго, дальше читаем хэш Redis
+USER_CITY_LOCAL_TTL = int(os.getenv("USER_CITY_LOCAL_TTL", "5"))
+_user_city_cache = LocalCache(USER_CITY_CACHE_SIZE)
+
+def _user_city_local_ttl() -> int:
+    return USER_CITY_LOCAL_TTL if USER_CITY_CACHE_REDIS else USER_CITY_CACHE_TTL
+
+async def set_user_city(user_id: int, city_id: int):
+    await user_store.set_city(user_id, city_id)
+    _user_city_cache.set(str(user_id), city_id, _user_city_local_ttl(), 1)
+    if USER_CITY_CACHE_REDIS:
+        await set_user_city_cached(user_id, city_id)
+
+async def get_user_city(user_id: int) -> Optional[int]:
+    city_id = _user_city_cache.get(str(user_id))
+    if city_id is not None:
+        return city_id
+    if USER_CITY_CACHE_REDIS:
+        city_id = await get_user_city_cached(user_id)
+    if city_id is None:
+        city_id = await user_store.get_city(user_id)
+        if city_id is not None and USER_CITY_CACHE_REDIS:
+            await set_user_city_cached(user_id, city_id)
+    if city_id is not None:
+        _user_city_cache.set(str(user_id), city_id, _user_city_local_ttl(), 1)
+    return city_id
+
+# Результаты поиска для постраничного вывода: (id, name, country) на нормализованный запрос
+SEARCH_RESULTS_CACHE_SIZE = int(os.getenv("SEARCH_RESULTS_CACHE_SIZE", "10000"))
+_search_results_cache = LocalCache(SEARCH_RESULTS_CACHE_SIZE)
+
+async def get_search_results(query: str) -> List[Tuple[int, str, str]]:
+    """Полный результат поиска в компактном виде; перелистывание страниц не разбирает его заново"""
+    key = normalize(query)
+    results = _search_results_cache.get(key)
+    if results is None:
+        cities = await search_cities_api(query)
+        if cities is None:
+            return []
+        results = [(c["id"], c["name"], c.get("country", "")) for c in cities]
+        _search_results_cache.set(key, results, DEFAULT_TTL_CITIES if results else NEGATIVE_TTL, 1)
+    return results
+
+async def get_top_user_city_ids(limit: int) -> List[int]:
+    """Города, выбранные наибольшим числом пользователей"""
+    return await user_store.get_top_city_ids(limit)
 
 # === Модели для новых эндпоинтов ===
 class UserStartRequest(BaseModel):
@@ -118,6 +144,35 @@ class UserCityRequest(BaseModel):
     city_id: int
     city_name: Optional[str] = None
 
+class UserCityWeatherRequest(BaseModel):
+    user_id: int
+    city_id: int
+    city_name: Optional[str] = None
+    include_image: bool = False
+
+class UserCityWeatherResponse(BaseModel):
+    success: bool
+    city_name: Optional[str] = None
+    formatted_message: Optional[str] = None
+    image_base64: Optional[str] = None
+    error: Optional[str] = None
+
+class WeatherBatchRequest(BaseModel):
+    cities: List[str] = []
+    city_ids: List[int] = []
+    stream: bool = False  # NDJSON: строка на город по мере готовности
+
+class WeatherBatchItem(BaseModel):
+    city: Optional[str] = None
+    city_id: Optional[int] = None
+    success: bool
+    formatted_message: Optional[str] = None
+    raw_data: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+class WeatherBatchResponse(BaseModel):
+    results: List[WeatherBatchItem]
+
 class SimpleMessageResponse(BaseModel):
     message: str
 
@@ -132,6 +187,10 @@ API_BASE_URL = os.getenv("API_BASE_URL", "http://0.0.0.0:8000")
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "8000"))
 
+# Пакетный запрос погоды
+WEATHER_BATCH_MAX_CITIES = int(os.getenv("WEATHER_BATCH_MAX_CITIES", "50"))
+WEATHER_BATCH_CONCURRENCY = int(os.getenv("WEATHER_BATCH_CONCURRENCY", "8"))  # запросов к WeatherAPI одновременно
+
 IMGUR_URL = "https://imgur.com/vT8VBK5.jpg"
 WELCOME_TEXT = (
     "<b>НА туда👉🏼👈🏼</b> сильно похож на <b>НА куда👀</b>\n"
@@ -148,36 +207,66 @@ if not WEATHER_API_KEY:
 async def startup_event():
     """Инициализация при запуске"""
     await init_redis()
+    await init_http_session()
+    await user_store.open()
+    await asyncio.to_thread(load_city_index)
+    start_render_pool()
+    if WEATHER_API_KEY:
+        start_warmer(fetch_weather_api, get_top_user_city_ids)
     logger.info("Приложение запущено")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Очистка при остановке"""
+    await stop_warmer()
+    await user_store.close()
+    await asyncio.to_thread(save_city_index)
+    stop_render_pool()
+    await close_http_session()
     await close_redis()
     logger.info("Приложение остановлено")
 
 # Функции для работы с WeatherAPI
+async def weather_api_get(endpoint: str, params: Dict[str, Any]) -> Tuple[int, Any]:
+    """Один GET к WeatherAPI: статус и JSON (при ошибке — тело с кодом ошибки, если оно есть)"""
+    async with weather_api_session() as session:
+        async with session.get(f"{WEATHER_API_BASE_URL}/{endpoint}", params=params) as response:
+            if response.status == 200:
+                return response.status, await response.json()
+            if 400 <= response.status < 500:
+                try:
+                    return response.status, await response.json(content_type=None)
+                except ValueError:
+                    pass
+            return response.status, None
+
 async def fetch_weather_api(
     city: Optional[str] = None,
     city_id: Optional[str] = None,
-    retries: int = 3,
+    retries: int = UPSTREAM_ATTEMPTS,
     forecast_days: Optional[int] = None,
+    use_cache: bool = True,
+    include_raw: bool = False,
 ) -> Optional[Dict[str, Any]]:
-    """Получение данных о погоде от WeatherAPI с кэшированием"""
+    """Получение данных о погоде от WeatherAPI с кэшированием.
+
+    По умолчанию возвращается и кэшируется компактная модель (trim_weather);
+    include_raw=True — полный ответ WeatherAPI, он кэшируется отдельно.
+    use_cache=False — запросить WeatherAPI, не читая кэш (прогрев), результат всё равно сохраняется.
+    """
     if not city and not city_id:
         return None
 
     # Определяем тип кэша и ключ
     cache_type = "forecast" if forecast_days else "weather"
-    cache_key = city if city else f"id_{city_id}"
-
-    # Пробуем получить из кэша
-    cached_data = await get_weather_cached(cache_key) if cache_type == "weather" else await get_forecast_cached(cache_key)
-    if cached_data:
-        logger.info(f"Данные получены из кэша для {cache_key}")
-        return cached_data
+    cache_key = location_key(city, city_id)
+    stored_type = raw_cache_type(cache_type) if include_raw else cache_type
+    flight_key = _generate_cache_key(stored_type, cache_key)
+    if forecast_days:
+        # Прогноз хранится одной записью на самый широкий запрошенный горизонт;
+        # запросы на разное число дней, пришедшие одновременно, не ждут друг друга
+        flight_key = f"{flight_key}:{forecast_days}"
 
-    # Если в кэше нет, делаем запрос к API
     params = {
         "key": WEATHER_API_KEY,
         "lang": "ru",
@@ -187,59 +276,118 @@ async def fetch_weather_api(
     endpoint = "current.json"
     if forecast_days:
         endpoint = "forecast.json"
-        params["days"] = forecast_days
 
-    for attempt in range(retries):
+    async def load():
+        request_params = params
+        if forecast_days:
+            # Не сужаем запись: запрашиваем не меньше дней, чем в ней уже есть
+            existing = await get_stale_cached_data(stored_type, cache_key)
+            days = max(forecast_days, forecast_horizon(existing) if existing else 0)
+            request_params = dict(params, days=days)
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{WEATHER_API_BASE_URL}/{endpoint}", params=params
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        # Сохраняем в кэш
-                        if cache_type == "weather":
-                            await set_weather_cached(cache_key, data)
-                        else:
-                            await set_forecast_cached(cache_key, data)
-                        logger.info(f"Данные получены от API и сохранены в кэш для {cache_key}")
-                        return data
-                    logger.warning(f"WeatherAPI вернул статус {response.status}")
-        except Exception as e:
-            logger.error(f"Ошибка WeatherAPI на попытке {attempt + 1}: {e}")
-        await asyncio.sleep(1)
-    return None
+            data = await call_upstream(endpoint, lambda: weather_api_get(endpoint, request_params), retries)
+        except LocationNotFound:
+            # Повтор той же опечатки ответит из кэша, без WeatherAPI
+            logger.info(f"WeatherAPI не нашёл город {cache_key}")
+            await set_location_missing(cache_key)
+            return None
+        if data is None:
+            return None
+        store_key = cache_key
+        if CITY_INDEX_ENABLED and not city_id and not cache_key.startswith("id_"):
+            # Запоминаем, к какому городу WeatherAPI привёл название: дальше оно делит запись с id города
+            resolved = city_index.learn_location(city, data.get("location", {}))
+            if resolved is not None:
+                store_key = f"id_{resolved}"
+        trimmed = trim_weather(data)
+        if forecast_days:
+            trimmed[FORECAST_HORIZON_FIELD] = data[FORECAST_HORIZON_FIELD] = request_params["days"]
+        # Сохраняем в кэш компактную модель, полный ответ — только по запросу
+        set_cached = set_weather_cached if cache_type == "weather" else set_forecast_cached
+        await set_cached(store_key, trimmed)
+        if include_raw:
+            await set_cached(store_key, data, raw=True)
+        if forecast_days:
+            # В ответе forecast.json есть и текущая погода — заполняем запись weather: тем же запросом
+            await set_weather_cached(store_key, current_from_forecast(trimmed))
+            if include_raw:
+                await set_weather_cached(store_key, current_from_forecast(data), raw=True)
+        logger.info(f"Данные получены от API и сохранены в кэш для {store_key}")
+        return data if include_raw else trimmed
+
+    async def get_cached(refresh=None):
+        if cache_type == "weather":
+            data = await get_weather_cached(cache_key, refresh, raw=include_raw)
+            if data is None:
+                # Текущая погода есть и в свежей записи прогноза
+                forecast = await get_forecast_cached(cache_key, raw=include_raw)
+                if forecast:
+                    data = current_from_forecast(forecast)
+            return data
+        data = await get_forecast_cached(cache_key, refresh, raw=include_raw)
+        if data and forecast_horizon(data) < forecast_days:
+            # В записи меньше дней, чем нужно — это промах
+            return None
+        return data
+
+    def result(data):
+        return slice_forecast(data, forecast_days) if data and forecast_days else data
+
+    # Пробуем получить из кэша; устаревшая запись отдаётся сразу и обновляется в фоне
+    cached_data = await get_cached(refresh=lambda: single_flight(flight_key, load)) if use_cache else None
+    if cached_data:
+        logger.info(f"Данные получены из кэша для {cache_key}")
+        return result(cached_data)
+    if use_cache and await is_location_missing(cache_key):
+        logger.info(f"Город {cache_key} недавно не найден WeatherAPI, запрос не отправляем")
+        return None
 
-async def search_cities_api(query: str, retries: int = 3) -> Optional[List[Dict[str, Any]]]:
+    # Если в кэше нет, делаем запрос к API; одновременные промахи делают один запрос
+    data = await single_flight(flight_key, load, recheck=get_cached)
+    if data is None:
+        # WeatherAPI недоступен — отдаём устаревшие данные, если они ещё есть
+        stale_data = await get_stale_cached_data(stored_type, cache_key)
+        if stale_data:
+            logger.warning(f"WeatherAPI недоступен, отдаём устаревшие данные для {cache_key}")
+            return result(stale_data)
+    return result(data)
+
+async def search_cities_api(query: str, retries: int = UPSTREAM_ATTEMPTS) -> Optional[List[Dict[str, Any]]]:
     """Поиск городов через WeatherAPI с кэшированием"""
     if len(query) < 2:
         return None
 
+    # Сначала локальный индекс по префиксу: «Моск», «Москв» и «Москва» не требуют отдельных запросов
+    if CITY_INDEX_ENABLED:
+        local_data = city_index.search(query)
+        if local_data:
+            logger.info(f"Список городов получен из локального индекса для запроса '{query}'")
+            return local_data
+
     # Пробуем получить из кэша
     cached_data = await get_cities_cached(query)
-    if cached_data:
+    if cached_data is not None:
         logger.info(f"Список городов получен из кэша для запроса '{query}'")
+        if CITY_INDEX_ENABLED and cached_data:
+            city_index.learn(query, cached_data)
         return cached_data
 
     # Если в кэше нет, делаем запрос к API
-    for attempt in range(retries):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{WEATHER_API_BASE_URL}/search.json",
-                    params={"key": WEATHER_API_KEY, "q": query},
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        # Сохраняем в кэш
-                        await set_cities_cached(query, data)
-                        logger.info(f"Список городов получен от API и сохранен в кэш для запроса '{query}'")
-                        return data
-                    logger.warning(f"Поиск городов не удался со статусом {response.status}")
-        except Exception as e:
-            logger.error(f"Ошибка поиска городов на попытке {attempt + 1}: {e}")
-        await asyncio.sleep(1)
-    return None
+    try:
+        data = await call_upstream(
+            "search.json", lambda: weather_api_get("search.json", {"key": WEATHER_API_KEY, "q": query}), retries
+        )
+    except LocationNotFound:
+        data = []
+    if data is None:
+        logger.warning(f"Поиск городов не удался для запроса '{query}'")
+        return None
+    # Сохраняем в кэш
+    await set_cities_cached(query, data)
+    if CITY_INDEX_ENABLED and data:
+        city_index.learn(query, data)
+    logger.info(f"Список городов получен от API и сохранен в кэш для запроса '{query}'")
+    return data
 
 # Функции форматирования (перенесены из бота)
 async def format_weather(weather: dict) -> str:
@@ -289,11 +437,11 @@ async def health_check():
     return {"status": "healthy", "api_key_configured": bool(WEATHER_API_KEY)}
 
 @app.post("/weather", response_model=WeatherResponse)
-async def get_weather_by_user(request: UserStartRequest):
-    city_id = get_user_city(request.user_id)
+async def get_weather_by_user(request: UserStartRequest, include_raw: bool = False):
+    city_id = await get_user_city(request.user_id)
     if not city_id:
         return WeatherResponse(success=False, error="Сначала выберите город")
-    weather_data = await fetch_weather_api(city_id=str(city_id))
+    weather_data = await fetch_weather_api(city_id=str(city_id), include_raw=include_raw)
     if not weather_data:
         return WeatherResponse(success=False, error="Не удалось получить данные о погоде")
     formatted_message = await format_weather(weather_data)
@@ -320,10 +468,10 @@ async def search_cities(request: CitySearchRequest):
         )
 
 @app.get("/weather/current/{city}")
-async def get_current_weather(city: str):
+async def get_current_weather(city: str, include_raw: bool = False):
     """Получение текущей погоды по городу (GET запрос)"""
     try:
-        weather_data = await fetch_weather_api(city=city)
+        weather_data = await fetch_weather_api(city=city, include_raw=include_raw)
         
         if weather_data:
             formatted_message = await format_weather(weather_data)
@@ -339,10 +487,10 @@ async def get_current_weather(city: str):
         raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
 
 @app.get("/weather/forecast/{city}")
-async def get_weather_forecast(city: str, days: int = 3):
+async def get_weather_forecast(city: str, days: int = 3, include_raw: bool = False):
     """Получение прогноза погоды по городу (GET запрос)"""
     try:
-        weather_data = await fetch_weather_api(city=city, forecast_days=days)
+        weather_data = await fetch_weather_api(city=city, forecast_days=days, include_raw=include_raw)
         
         if weather_data:
             formatted_message = await format_forecast(weather_data)
@@ -363,80 +511,230 @@ async def user_start(request: UserStartRequest):
 
 @app.post("/city/search", response_model=CityListResponse)
 async def city_search(request: CitySearchRequestV2):
-    cities = await search_cities_api(request.query)
+    cities = await get_search_results(request.query)
     if not cities:
-        return {"cities": [], "has_next": False}
+        return {"cities": [], "has_next": False, "total": 0}
     # Пагинация
     start = (request.page - 1) * request.page_size
     end = start + request.page_size
     page_cities = cities[start:end]
     has_next = end < len(cities)
     # Формируем нужные поля: id, name, country
-    result = [{"id": c["id"], "name": c["name"], "country": c.get("country", "")} for c in page_cities]
-    return {"cities": result, "has_next": has_next}
+    result = [{"id": city_id, "name": name, "country": country} for city_id, name, country in page_cities]
+    return {"cities": result, "has_next": has_next, "total": len(cities)}
 
 @app.post("/user/city", response_model=SimpleMessageResponse)
 async def user_city(request: UserCityRequest):
-    set_user_city(request.user_id, request.city_id)
+    await set_user_city(request.user_id, request.city_id)
     return {"message": f"Город выбран!"}
 
+@app.post("/user/city/weather", response_model=UserCityWeatherResponse)
+async def user_city_weather(request: UserCityWeatherRequest):
+    """Выбор города и погода в нём одним запросом"""
+    _, weather_data = await asyncio.gather(
+        set_user_city(request.user_id, request.city_id),
+        fetch_weather_api(city_id=str(request.city_id)),
+    )
+    # Название из выдачи поиска, если WeatherAPI его не вернул
+    known_city = city_index.get(request.city_id)
+    fallback_name = request.city_name or (known_city["name"] if known_city else None)
+    if not weather_data:
+        return UserCityWeatherResponse(
+            success=False, city_name=fallback_name, error="Не удалось получить данные о погоде"
+        )
+    city_name = weather_data.get("location", {}).get("name") or fallback_name
+    image_base64 = None
+    if request.include_image:
+        try:
+            image = await get_weather_image_bytes(weather_data, city_name or "Город")
+            image_base64 = base64.b64encode(image).decode("ascii")
+        except RenderQueueFull as e:
+            logger.warning(f"Отрисовка отклонена: {e}")
+    return UserCityWeatherResponse(
+        success=True,
+        city_name=city_name,
+        formatted_message=await format_weather(weather_data),
+        image_base64=image_base64,
+    )
+
 @app.post("/weather/by_city", response_model=WeatherResponse)
-async def get_weather_by_city(request: CityWeatherRequest):
-    weather_data = await fetch_weather_api(city=request.city)
+async def get_weather_by_city(request: CityWeatherRequest, include_raw: bool = False):
+    weather_data = await fetch_weather_api(city=request.city, include_raw=include_raw)
     if not weather_data:
         return WeatherResponse(success=False, error="Не удалось получить данные о погоде")
     formatted_message = await format_weather(weather_data)
     return WeatherResponse(success=True, formatted_message=formatted_message, raw_data=weather_data)
 
 @app.post("/weather/forecast_by_city", response_model=WeatherResponse)
-async def get_forecast_by_city(request: CityWeatherRequest):
-    weather_data = await fetch_weather_api(city=request.city, forecast_days=3)
+async def get_forecast_by_city(request: CityWeatherRequest, include_raw: bool = False):
+    weather_data = await fetch_weather_api(city=request.city, forecast_days=3, include_raw=include_raw)
     if not weather_data:
         return WeatherResponse(success=False, error="Не удалось получить прогноз")
     formatted_message = await format_forecast(weather_data)
     return WeatherResponse(success=True, formatted_message=formatted_message, raw_data=weather_data)
 
+@app.post("/weather/batch", response_model=WeatherBatchResponse)
+async def get_weather_batch(request: WeatherBatchRequest, include_raw: bool = False):
+    """Погода для нескольких городов: попадания одним MGET, промахи параллельно с ограничением"""
+    targets = [(city, None, location_key(city)) for city in request.cities]
+    targets += [(None, city_id, location_key(city_id=city_id)) for city_id in request.city_ids]
+    if not targets:
+        raise HTTPException(status_code=400, detail="Не указаны города")
+    if len(targets) > WEATHER_BATCH_MAX_CITIES:
+        raise HTTPException(status_code=400, detail=f"Не больше {WEATHER_BATCH_MAX_CITIES} городов за запрос")
+
+    cache_type = raw_cache_type("weather") if include_raw else "weather"
+    cached = await get_many_cached(cache_type, [cache_key for _, _, cache_key in targets])
+    semaphore = asyncio.Semaphore(WEATHER_BATCH_CONCURRENCY)
+
+    async def resolve(city: Optional[str], city_id: Optional[int], cache_key: str) -> WeatherBatchItem:
+        try:
+            weather_data = cached.get(cache_key)
+            if weather_data is None:
+                async with semaphore:
+                    weather_data = await fetch_weather_api(
+                        city=city, city_id=str(city_id) if city_id is not None else None, include_raw=include_raw
+                    )
+            if not weather_data:
+                return WeatherBatchItem(
+                    city=city, city_id=city_id, success=False, error="Не удалось получить данные о погоде"
+                )
+            return WeatherBatchItem(
+                city=city,
+                city_id=city_id,
+                success=True,
+                formatted_message=await format_weather(weather_data),
+                raw_data=weather_data,
+            )
+        except Exception as e:
+            logger.error(f"Ошибка пакетного запроса погоды для {city or city_id}: {e}")
+            return WeatherBatchItem(city=city, city_id=city_id, success=False, error="Внутренняя ошибка сервера")
+
+    if not request.stream:
+        results = await asyncio.gather(*(resolve(*target) for target in targets))
+        return WeatherBatchResponse(results=results)
+
+    async def ndjson():
+        tasks = [asyncio.ensure_future(resolve(*target)) for target in targets]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                yield json.dumps(jsonable_encoder(item), ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+async def get_weather_image_bytes(weather_data: Dict[str, Any], city: str, content_key: Optional[str] = None) -> bytes:
+    """Готовая картинка из кэша или новая отрисовка (может выбросить RenderQueueFull)"""
+    content_key = content_key or image_content_key(weather_data, city)
+    image = await get_image_cached(content_key)
+    if image is None:
+        image = await render_weather_image(weather_data, city)
+        await set_image_cached(content_key, image, freshness_ttl(weather_data))
+    return image
+
+async def weather_image_response(weather_data: Dict[str, Any], city: str, if_none_match: Optional[str]) -> Response:
+    """PNG с погодой: 304 по If-None-Match, готовая картинка из кэша или новая отрисовка"""
+    content_key = image_content_key(weather_data, city)
+    etag = f'"{content_key}"'
+    # Картинка и браузерный кэш живут столько же, сколько запись погоды, по которой она нарисована
+    headers = {"ETag": etag, "Cache-Control": f"max-age={freshness_ttl(weather_data)}"}
+    if if_none_match:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+
+    try:
+        image = await get_weather_image_bytes(weather_data, city, content_key)
+    except RenderQueueFull as e:
+        logger.warning(f"Отрисовка отклонена: {e}")
+        return Response(
+            content="Сервис перегружен, попробуйте позже",
+            media_type="text/plain",
+            status_code=503,
+            headers={"Retry-After": "1"},
+        )
+    return Response(content=image, media_type="image/png", headers=headers)
+
 @app.post("/weather/image")
-async def weather_image(request: UserStartRequest):
-    city_id = get_user_city(request.user_id)
+async def weather_image(request: UserStartRequest, if_none_match: Optional[str] = Header(None)):
+    city_id = await get_user_city(request.user_id)
     if not city_id:
         return Response(content="Сначала выберите город", media_type="text/plain", status_code=400)
     weather_data = await fetch_weather_api(city_id=str(city_id))
     if not weather_data:
         return Response(content="Ошибка получения погоды", media_type="text/plain", status_code=500)
     city_name = weather_data.get("location", {}).get("name", "Город")
-    buf = generate_weather_image(weather_data, city_name)
-    return Response(content=buf.read(), media_type="image/png")
+    return await weather_image_response(weather_data, city_name, if_none_match)
 
 @app.post("/weather/image_by_city")
-async def weather_image_by_city(request: CityWeatherRequest):
+async def weather_image_by_city(request: CityWeatherRequest, if_none_match: Optional[str] = Header(None)):
     weather_data = await fetch_weather_api(city=request.city)
     if not weather_data:
         return Response(content="Ошибка получения погоды", media_type="text/plain", status_code=500)
-    buf = generate_weather_image(weather_data, request.city)
-    return Response(content=buf.read(), media_type="image/png")
+    # Название из ответа WeatherAPI, как в /weather/image: все написания города дают одну картинку
+    city_name = weather_data.get("location", {}).get("name") or request.city
+    return await weather_image_response(weather_data, city_name, if_none_match)
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики в формате Prometheus"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/render/stats")
+async def get_render_statistics():
+    """Очередь и время отрисовки картинок"""
+    return get_render_stats()
 
 # === Эндпоинты для управления кэшем ===
 @app.get("/cache/stats")
 async def get_cache_statistics():
     """Получение статистики кэша"""
     stats = await get_cache_stats()
+    stats["warmer"] = get_warmer_stats()
+    stats["city_index"] = city_index.stats()
+    stats["upstream"] = get_breaker_stats()
     return stats
 
+# Типы кэша, записи которых хранятся под ключом города из location_key()
+LOCATION_CACHE_TYPES = ("weather", "forecast", "weather_raw", "forecast_raw", "missing")
+
 @app.delete("/cache/clear")
 async def clear_cache_endpoint(cache_type: Optional[str] = None, identifier: Optional[str] = None):
-    """Очистка кэша"""
-    success = await clear_cache(cache_type, identifier)
-    if success:
+    """Очистка кэша (очистка типа идёт в фоне, прогресс — в /cache/clear/jobs/{job_id})"""
+    cache_identifier = identifier
+    if identifier and cache_type in LOCATION_CACHE_TYPES:
+        # Известные индексу названия хранятся под id города
+        cache_identifier = location_key(identifier)
+    result = await clear_cache(cache_type, cache_identifier, background=True)
+    if result:
         message = "Кэш очищен"
         if cache_type:
             message += f" для типа: {cache_type}"
         if identifier:
             message += f" и идентификатора: {identifier}"
+        if isinstance(result, dict):
+            return {"success": True, "message": f"Очистка кэша для типа {cache_type} запущена", "job": result}
         return {"success": True, "message": message}
     else:
         raise HTTPException(status_code=500, detail="Ошибка при очистке кэша")
 
+@app.get("/cache/clear/jobs")
+async def clear_cache_jobs():
+    """Последние задачи очистки кэша"""
+    return {"jobs": list_clear_jobs()}
+
+@app.get("/cache/clear/jobs/{job_id}")
+async def clear_cache_job(job_id: str):
+    """Прогресс задачи очистки кэша"""
+    job = get_clear_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задача очистки не найдена")
+    return job
+
 @app.get("/cache/health")
 async def cache_health_check():
     """Проверка состояния кэша"""
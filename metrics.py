@@ -0,0 +1,85 @@
+from typing import Dict, Tuple
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Метрики API сервиса в формате Prometheus (GET /metrics).
+# Каждый воркер uvicorn отдаёт свои значения — Prometheus суммирует их по инстансам.
+
+CACHE_REQUESTS = Counter(
+    "weather_cache_requests_total",
+    "Чтения кэша по типам: l1_hit, l2_hit, miss",
+    ["cache_type", "result"],
+)
+CACHE_ERRORS = Counter(
+    "weather_cache_errors_total",
+    "Ошибки Redis при чтении и записи кэша",
+    ["cache_type", "operation"],
+)
+CACHE_REDIS_SECONDS = Histogram(
+    "weather_cache_redis_seconds",
+    "Время запросов к Redis из кэша",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+REDIS_SECONDS = {operation: CACHE_REDIS_SECONDS.labels(operation) for operation in ("get", "mget", "set")}
+CACHE_L1_ENTRIES = Gauge("weather_cache_l1_entries", "Записей в локальном кэше (L1)")
+CACHE_L1_BYTES = Gauge("weather_cache_l1_bytes", "Размер локального кэша (L1), байт")
+
+UPSTREAM_REQUESTS = Counter(
+    "weatherapi_requests_total",
+    "Запросы к WeatherAPI по эндпоинтам и статусам (error — сетевая ошибка)",
+    ["endpoint", "status"],
+)
+UPSTREAM_SECONDS = Histogram(
+    "weatherapi_request_seconds",
+    "Время запросов к WeatherAPI",
+    ["endpoint"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+UPSTREAM_RETRIES = Counter(
+    "weatherapi_retries_total",
+    "Повторные попытки запросов к WeatherAPI",
+    ["endpoint"],
+)
+UPSTREAM_SHORT_CIRCUITS = Counter(
+    "weatherapi_short_circuits_total",
+    "Запросы, не отправленные в WeatherAPI из-за открытого предохранителя",
+    ["endpoint"],
+)
+UPSTREAM_CIRCUIT_STATE = Gauge(
+    "weatherapi_circuit_state",
+    "Состояние предохранителя WeatherAPI: 0 — закрыт, 1 — пробный запрос, 2 — открыт",
+)
+
+RENDER_SECONDS = Histogram(
+    "weather_image_render_seconds",
+    "Время отрисовки картинки в пуле",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+RENDER_WAIT_SECONDS = Histogram(
+    "weather_image_render_wait_seconds",
+    "Ожидание свободного воркера пула отрисовки",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+RENDER_REJECTED = Counter("weather_image_render_rejected_total", "Отрисовки, отклонённые из-за полной очереди")
+RENDER_QUEUE_DEPTH = Gauge("weather_image_render_queue_depth", "Отрисовок в работе и в очереди")
+
+# Дочерние метрики с метками создаются один раз: labels() на каждый вызов берёт блокировку
+_cache_requests: Dict[Tuple[str, str], Counter] = {}
+_upstream_requests: Dict[Tuple[str, str], Counter] = {}
+
+def count_cache(cache_type: str, result: str):
+    child = _cache_requests.get((cache_type, result))
+    if child is None:
+        child = _cache_requests[(cache_type, result)] = CACHE_REQUESTS.labels(cache_type, result)
+    child.inc()
+
+def observe_upstream(endpoint: str, status: str, seconds: float):
+    child = _upstream_requests.get((endpoint, status))
+    if child is None:
+        child = _upstream_requests[(endpoint, status)] = UPSTREAM_REQUESTS.labels(endpoint, status)
+    child.inc()
+    UPSTREAM_SECONDS.labels(endpoint).observe(seconds)
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Текст для ответа /metrics и его Content-Type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+from weather_image import generate_weather_image
+from metrics import RENDER_QUEUE_DEPTH, RENDER_REJECTED, RENDER_SECONDS, RENDER_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Настройки пула отрисовки картинок
+RENDER_POOL_KIND = os.getenv("RENDER_POOL_KIND", "process")  # process или thread
+RENDER_POOL_WORKERS = int(os.getenv("RENDER_POOL_WORKERS", str(min(os.cpu_count() or 1, 4))))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "32"))  # отрисовок в работе и в очереди
+
+class RenderQueueFull(Exception):
+    """Очередь отрисовки переполнена — запрос нужно отклонить"""
+
+_executor: Optional[Executor] = None
+_in_flight = 0
+_render_stats = {
+    "rendered": 0,
+    "rejected": 0,
+    "failed": 0,
+    "render_seconds_total": 0.0,
+    "render_seconds_max": 0.0,
+    "wait_seconds_total": 0.0,
+}
+RENDER_QUEUE_DEPTH.set_function(lambda: _in_flight)
+
+def _render_png(weather_data: Dict[str, Any], city: str) -> Tuple[bytes, float]:
+    """Выполняется в пуле: PNG и время отрисовки"""
+    started = time.perf_counter()
+    image = generate_weather_image(weather_data, city).read()
+    return image, time.perf_counter() - started
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if RENDER_POOL_KIND == "thread":
+            _executor = ThreadPoolExecutor(max_workers=RENDER_POOL_WORKERS, thread_name_prefix="render")
+        else:
+            _executor = ProcessPoolExecutor(max_workers=RENDER_POOL_WORKERS)
+        logger.info(f"Пул отрисовки запущен ({RENDER_POOL_KIND}, воркеров: {RENDER_POOL_WORKERS})")
+    return _executor
+
+def start_render_pool():
+    """Создание пула отрисовки при запуске приложения"""
+    _get_executor()
+
+def stop_render_pool():
+    """Остановка пула отрисовки"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+        logger.info("Пул отрисовки остановлен")
+
+async def render_weather_image(weather_data: Dict[str, Any], city: str) -> bytes:
+    """Отрисовка PNG в пуле; при переполненной очереди сразу выбрасывает RenderQueueFull"""
+    global _in_flight
+    if _in_flight >= RENDER_QUEUE_SIZE:
+        _render_stats["rejected"] += 1
+        RENDER_REJECTED.inc()
+        raise RenderQueueFull(f"В очереди отрисовки уже {_in_flight} картинок")
+
+    _in_flight += 1
+    started = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        image, render_seconds = await loop.run_in_executor(_get_executor(), _render_png, weather_data, city)
+    except Exception:
+        _render_stats["failed"] += 1
+        raise
+    finally:
+        _in_flight -= 1
+
+    wait_seconds = max(time.perf_counter() - started - render_seconds, 0.0)
+    _render_stats["rendered"] += 1
+    _render_stats["render_seconds_total"] += render_seconds
+    _render_stats["render_seconds_max"] = max(_render_stats["render_seconds_max"], render_seconds)
+    _render_stats["wait_seconds_total"] += wait_seconds
+    RENDER_SECONDS.observe(render_seconds)
+    RENDER_WAIT_SECONDS.observe(wait_seconds)
+    return image
+
+def get_render_stats() -> Dict[str, Any]:
+    """Глубина очереди и время отрисовки"""
+    rendered = _render_stats["rendered"]
+    return {
+        "pool": RENDER_POOL_KIND,
+        "workers": RENDER_POOL_WORKERS,
+        "queue_size": RENDER_QUEUE_SIZE,
+        "queue_depth": _in_flight,
+        "rendered": rendered,
+        "rejected": _render_stats["rejected"],
+        "failed": _render_stats["failed"],
+        "render_ms_avg": round(_render_stats["render_seconds_total"] / rendered * 1000, 2) if rendered else 0.0,
+        "render_ms_max": round(_render_stats["render_seconds_max"] * 1000, 2),
+        "wait_ms_avg": round(_render_stats["wait_seconds_total"] / rendered * 1000, 2) if rendered else 0.0,
+    }
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+from cache import acquire_lock, release_lock, is_locked
+
+logger = logging.getLogger(__name__)
+
+# Запросы к WeatherAPI, которые выполняются прямо сейчас (ключ кэша -> задача)
+_inflight: Dict[str, "asyncio.Task[Any]"] = {}
+
+# Координация между воркерами/репликами через блокировку в Redis
+SINGLEFLIGHT_REDIS_LOCK = os.getenv("SINGLEFLIGHT_REDIS_LOCK", "0") == "1"
+SINGLEFLIGHT_LOCK_TTL = float(os.getenv("SINGLEFLIGHT_LOCK_TTL", "15"))  # секунд
+SINGLEFLIGHT_LOCK_WAIT = float(os.getenv("SINGLEFLIGHT_LOCK_WAIT", "10"))  # секунд
+SINGLEFLIGHT_POLL_INTERVAL = 0.1  # секунд
+
+async def single_flight(
+    key: str,
+    fetch: Callable[[], Awaitable[Any]],
+    recheck: Optional[Callable[[], Awaitable[Any]]] = None,
+) -> Any:
+    """Объединение одновременных промахов кэша в один запрос.
+
+    Первый вызов для ключа выполняет fetch, остальные ждут тот же результат.
+    recheck читает кэш и нужен для режима с блокировкой в Redis: пока запрос
+    делает другой воркер, мы ждём, когда результат появится в кэше.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_run(key, fetch, recheck))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _forget(key, t))
+    else:
+        logger.info(f"Ожидание уже выполняющегося запроса для {key}")
+    # shield: отмена одного ожидающего не отменяет запрос для остальных
+    return await asyncio.shield(task)
+
+def _forget(key: str, task: "asyncio.Task[Any]"):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+
+async def _run(
+    key: str,
+    fetch: Callable[[], Awaitable[Any]],
+    recheck: Optional[Callable[[], Awaitable[Any]]],
+) -> Any:
+    if not SINGLEFLIGHT_REDIS_LOCK or recheck is None:
+        return await fetch()
+
+    token = await acquire_lock(key, SINGLEFLIGHT_LOCK_TTL)
+    if token:
+        try:
+            return await fetch()
+        finally:
+            await release_lock(key, token)
+
+    # Запрос уже делает другой воркер — ждём, пока результат попадёт в кэш
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SINGLEFLIGHT_LOCK_WAIT
+    while loop.time() < deadline:
+        await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+        result = await recheck()
+        if result:
+            logger.info(f"Результат для {key} получен от другого воркера")
+            return result
+        if not await is_locked(key):
+            break
+    return await fetch()
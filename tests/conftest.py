@@ -1,15 +1,28 @@
 """
 Fixtures for tests
 """
+import fnmatch
+import os
+import shutil
+import tempfile
 import pytest
+
+# Tests must not write to the real data/users.db and data/cities.json: point them at a temp dir before main is imported
+TEST_DATA_DIR = tempfile.mkdtemp(prefix="weather-api-tests-")
+os.environ["USERS_DB_PATH"] = os.path.join(TEST_DATA_DIR, "users.db")
+os.environ["CITY_INDEX_PATH"] = os.path.join(TEST_DATA_DIR, "cities.json")
+
 from fastapi.testclient import TestClient
 from main import app
-import os
 print("WORKING DIR:", os.getcwd())
 os.makedirs("data", exist_ok=True)
 print("DATA DIR EXISTS:", os.path.exists("data"))
 
 
+def pytest_unconfigure(config):
+    shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
+
+
 @pytest.fixture
 def client():
     """
@@ -29,4 +42,147 @@ def test_weather_data():
         "description": "Clear sky",
         "humidity": 65,
         "wind_speed": 5.5
-    } 
\ No newline at end of file
+    } 
+
+class FakeRedis:
+    """
+    Minimal in-memory stand-in for redis.asyncio.Redis (string keys only)
+    """
+    def __init__(self):
+        self.store = {}
+        self.ttl = {}
+
+    async def get(self, key):
+        return self.store.get(key)
+
+    async def mget(self, keys):
+        self.mget_calls = getattr(self, "mget_calls", 0) + 1
+        return [self.store.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        self.ttl[key] = ex if ex is not None else (px / 1000 if px is not None else None)
+        return True
+
+    async def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            if self.store.pop(key, None) is not None:
+                removed += 1
+            self.ttl.pop(key, None)
+        return removed
+
+    async def unlink(self, *keys):
+        return await self.delete(*keys)
+
+    async def scan(self, cursor=0, match=None, count=10):
+        self.scan_calls = getattr(self, "scan_calls", 0) + 1
+        if cursor == 0:
+            # Как и в Redis, удаление ключей во время обхода не сдвигает курсор
+            self._scan_keys = sorted(key for key in self.store if match is None or fnmatch.fnmatchcase(key, match))
+        keys = self._scan_keys
+        page = keys[cursor:cursor + count]
+        next_cursor = cursor + count if cursor + count < len(keys) else 0
+        return next_cursor, page
+
+    async def incr(self, key):
+        self.store[key] = str(int(self.store.get(key, 0)) + 1)
+        return int(self.store[key])
+
+    async def flushdb(self, asynchronous=False):
+        self.store.clear()
+        self.ttl.clear()
+        return True
+
+    async def exists(self, key):
+        return int(key in self.store)
+
+    async def publish(self, channel, message):
+        self.published = getattr(self, "published", []) + [message]
+        return 0
+
+    async def hget(self, name, key):
+        return self.store.get(name, {}).get(key)
+
+    async def hset(self, name, key, value):
+        self.store.setdefault(name, {})[key] = str(value)
+        return 1
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    Replace the Redis client in cache.py with an in-memory fake
+    """
+    import cache
+    fake = FakeRedis()
+    monkeypatch.setattr(cache, "redis_client", fake)
+    monkeypatch.setattr(cache, "_generations", {})
+    cache._local_cache.clear()
+    yield fake
+    cache._local_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def upstream_breaker(monkeypatch):
+    """
+    Fresh WeatherAPI circuit breaker per test, so failures don't leak between tests
+    """
+    import upstream
+    breaker = upstream.CircuitBreaker(threshold=3, reset_timeout=30)
+    monkeypatch.setattr(upstream, "breaker", breaker)
+    return breaker
+
+
+class FakeWeatherAPI:
+    """
+    Stand-in for the WeatherAPI HTTP session used by main.weather_api_get.
+    respond(endpoint, params) returns (status, json); every request is recorded in calls
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.respond = lambda endpoint, params: (200, {})
+
+    def get(self, url, params=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls.append((endpoint, params))
+        status, payload = self.respond(endpoint, params)
+        return FakeWeatherAPIResponse(status, payload)
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeWeatherAPIResponse:
+    def __init__(self, status, payload):
+        self.status = status
+        self._payload = payload
+
+    async def json(self, content_type="application/json"):
+        return self._payload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+@pytest.fixture
+def fake_weather_api(monkeypatch):
+    """
+    Replace WeatherAPI HTTP calls made by main.py with FakeWeatherAPI
+    """
+    import main
+    api = FakeWeatherAPI()
+    monkeypatch.setattr(main, "weather_api_session", api)
+    return api
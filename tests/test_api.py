@@ -60,4 +60,460 @@ def test_get_weather_invalid_data(client, invalid_data):
     assert response.status_code in [
         status.HTTP_422_UNPROCESSABLE_ENTITY,
         status.HTTP_400_BAD_REQUEST
-    ] 
\ No newline at end of file
+    ] 
+
+@pytest.mark.asyncio
+async def test_user_city_lookup_is_cached(monkeypatch, fake_redis):
+    """
+    Test that a returning user's city is resolved without hitting SQLite
+    """
+    import main
+
+    reads = 0
+    original_get_city = main.user_store.get_city
+
+    async def counting_get_city(user_id):
+        nonlocal reads
+        reads += 1
+        return await original_get_city(user_id)
+
+    monkeypatch.setattr(main.user_store, "get_city", counting_get_city)
+    monkeypatch.setattr(main, "USER_CITY_CACHE_REDIS", True)
+    main._user_city_cache.clear()
+
+    await main.set_user_city(1001, 2145091)
+    assert await main.get_user_city(1001) == 2145091
+    assert reads == 0
+    assert fake_redis.store["user_city"]["1001"] == "2145091"
+
+    # Новый процесс: локальный кэш пуст, город берётся из Redis
+    main._user_city_cache.clear()
+    assert await main.get_user_city(1001) == 2145091
+    assert reads == 0
+
+    # Нет ни в локальном кэше, ни в Redis — читаем SQLite один раз
+    main._user_city_cache.clear()
+    fake_redis.store["user_city"].clear()
+    assert await main.get_user_city(1001) == 2145091
+    assert await main.get_user_city(1001) == 2145091
+    assert reads == 1
+
+
+@pytest.mark.asyncio
+async def test_user_city_change_in_other_worker_is_seen(monkeypatch, fake_redis):
+    """
+    Test that with the Redis hash a city changed by another worker replaces the local copy after USER_CITY_LOCAL_TTL
+    """
+    import main
+
+    monkeypatch.setattr(main, "USER_CITY_CACHE_REDIS", True)
+    monkeypatch.setattr(main, "USER_CITY_LOCAL_TTL", 0)
+    main._user_city_cache.clear()
+
+    await main.set_user_city(1002, 2145091)
+    assert await main.get_user_city(1002) == 2145091
+    # Другой воркер сменил город пользователя
+    fake_redis.store["user_city"]["1002"] = "2108341"
+    assert await main.get_user_city(1002) == 2108341
+
+
+SAMPLE_WEATHER = {
+    "location": {"name": "Москва", "country": "Россия", "localtime": "2024-07-12 12:00"},
+    "current": {
+        "temp_c": 20.0,
+        "feelslike_c": 19.5,
+        "wind_kph": 13.0,
+        "humidity": 65,
+        "condition": {"text": "Ясно"},
+    },
+}
+
+
+def test_weather_image_etag_and_cache(client, monkeypatch, fake_redis):
+    """
+    Test that rendered images are cached by content and revalidated with ETag
+    """
+    import main
+
+    async def fake_fetch(**kwargs):
+        return SAMPLE_WEATHER
+
+    renders = 0
+    original_render = main.render_weather_image
+
+    async def counting_render(weather_data, city):
+        nonlocal renders
+        renders += 1
+        return await original_render(weather_data, city)
+
+    monkeypatch.setattr(main, "fetch_weather_api", fake_fetch)
+    monkeypatch.setattr(main, "render_weather_image", counting_render)
+
+    response = client.post("/weather/image_by_city", json={"city": "Москва"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "image/png"
+    etag = response.headers["etag"]
+    assert "max-age" in response.headers["cache-control"]
+
+    # Повторный показ той же погоды не перерисовывает картинку
+    again = client.post("/weather/image_by_city", json={"city": "Москва"})
+    assert again.content == response.content
+    assert renders == 1
+
+    not_modified = client.post(
+        "/weather/image_by_city", json={"city": "Москва"}, headers={"If-None-Match": etag}
+    )
+    assert not_modified.status_code == status.HTTP_304_NOT_MODIFIED
+    assert not_modified.content == b""
+
+    # Изменилась погода — новая картинка и новый ETag
+    SAMPLE_WEATHER_WARMER = {**SAMPLE_WEATHER, "current": {**SAMPLE_WEATHER["current"], "temp_c": 25.0}}
+
+    async def warmer_fetch(**kwargs):
+        return SAMPLE_WEATHER_WARMER
+
+    monkeypatch.setattr(main, "fetch_weather_api", warmer_fetch)
+    changed = client.post(
+        "/weather/image_by_city", json={"city": "Москва"}, headers={"If-None-Match": etag}
+    )
+    assert changed.status_code == status.HTTP_200_OK
+    assert changed.headers["etag"] != etag
+    assert renders == 2
+
+
+def test_weather_image_lives_as_long_as_weather_entry(client, monkeypatch, fake_redis):
+    """
+    Test that the cached image and Cache-Control follow the adaptive TTL of the weather it was drawn from
+    """
+    import time
+    import main
+    import cache
+
+    monkeypatch.setattr(cache, "CACHE_ADAPTIVE_TTL", True)
+    monkeypatch.setattr(cache, "_update_intervals", [])
+    weather = {**SAMPLE_WEATHER, "current": {**SAMPLE_WEATHER["current"], "last_updated_epoch": int(time.time()) - 60}}
+
+    async def fake_fetch(**kwargs):
+        return weather
+
+    monkeypatch.setattr(main, "fetch_weather_api", fake_fetch)
+
+    response = client.post("/weather/image_by_city", json={"city": "Москва"})
+    ttl = cache.freshness_ttl(weather)
+    assert ttl != cache.DEFAULT_TTL_WEATHER
+    assert response.headers["cache-control"] == f"max-age={ttl}"
+    image_key = "image:" + response.headers["etag"].strip('"')
+    assert fake_redis.ttl[image_key] == ttl
+
+
+def test_weather_image_backpressure(client, monkeypatch):
+    """
+    Test that a full render queue fails fast with 503
+    """
+    import main
+    import render_pool
+
+    async def fake_fetch(**kwargs):
+        return SAMPLE_WEATHER
+
+    monkeypatch.setattr(main, "fetch_weather_api", fake_fetch)
+    monkeypatch.setattr(render_pool, "RENDER_QUEUE_SIZE", 0)
+
+    response = client.post("/weather/image_by_city", json={"city": "Казань"})
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["retry-after"] == "1"
+    assert client.get("/render/stats").json()["rejected"] >= 1
+
+
+def test_user_city_weather_single_round_trip(client, monkeypatch):
+    """
+    Test that choosing a city returns its name, weather and optional image in one response
+    """
+    import base64
+    import main
+
+    requested = []
+
+    async def fake_fetch(**kwargs):
+        requested.append(kwargs)
+        return SAMPLE_WEATHER
+
+    monkeypatch.setattr(main, "fetch_weather_api", fake_fetch)
+
+    response = client.post(
+        "/user/city/weather", json={"user_id": 2002, "city_id": 2145091, "include_image": True}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["success"] is True
+    assert data["city_name"] == "Москва"
+    assert "Москва" in data["formatted_message"]
+    assert base64.b64decode(data["image_base64"]).startswith(b"\x89PNG")
+    assert requested == [{"city_id": "2145091"}]
+
+    without_image = client.post("/user/city/weather", json={"user_id": 2002, "city_id": 2145091}).json()
+    assert without_image["image_base64"] is None
+
+
+def test_weather_batch_reads_cache_once_and_fetches_misses(client, monkeypatch, fake_redis):
+    """
+    Test that a batch resolves hits with one MGET, fetches only misses and reports per-city errors
+    """
+    import json
+    import main
+
+    fake_redis.store["weather:москва"] = json.dumps(SAMPLE_WEATHER)
+    fetched = []
+
+    async def fake_fetch(city=None, city_id=None, **kwargs):
+        fetched.append(city or city_id)
+        return SAMPLE_WEATHER if city else None
+
+    monkeypatch.setattr(main, "fetch_weather_api", fake_fetch)
+
+    response = client.post("/weather/batch", json={"cities": ["Москва", "Казань"], "city_ids": [1]})
+    assert response.status_code == status.HTTP_200_OK
+    results = response.json()["results"]
+    assert [item["success"] for item in results] == [True, True, False]
+    assert results[2]["city_id"] == 1 and results[2]["error"]
+    assert sorted(fetched) == ["1", "Казань"]
+    assert fake_redis.mget_calls == 1
+
+    streamed = client.post("/weather/batch", json={"cities": ["Москва", "Казань"], "stream": True})
+    assert streamed.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in streamed.text.splitlines()]
+    assert sorted(item["city"] for item in lines) == ["Казань", "Москва"]
+
+    too_many = client.post("/weather/batch", json={"cities": ["x"] * (main.WEATHER_BATCH_MAX_CITIES + 1)})
+    assert too_many.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_city_search_uses_local_index(monkeypatch, fake_weather_api):
+    """
+    Test that repeats of a learned query are answered locally, other queries go upstream
+    """
+    import main
+    import cache
+    from city_index import CityIndex
+
+    results = {
+        "Мо": [
+            {"id": 2145091, "name": "Moscow", "country": "Russia"},
+            {"id": 1, "name": "Mostar", "country": "Bosnia and Herzegovina"},
+        ],
+        "Mos": [
+            {"id": 2145091, "name": "Moscow", "country": "Russia"},
+            {"id": 1, "name": "Mostar", "country": "Bosnia and Herzegovina"},
+            {"id": 2, "name": "Mosul", "country": "Iraq"},
+        ],
+    }
+    fake_weather_api.respond = lambda endpoint, params: (200, results[params["q"]])
+    monkeypatch.setattr(cache, "redis_client", None)
+    monkeypatch.setattr(main, "city_index", CityIndex())
+
+    assert len(await main.search_cities_api("Мо")) == 2
+    assert len(await main.search_cities_api("мо")) == 2
+    # Ответ на «Мо» ограничен — «Mos» спрашиваем у WeatherAPI
+    assert [c["name"] for c in await main.search_cities_api("Mos")] == ["Moscow", "Mostar", "Mosul"]
+    assert [params["q"] for _, params in fake_weather_api.calls] == ["Мо", "Mos"]
+
+
+def test_city_search_pages_reuse_one_search(client, monkeypatch):
+    """
+    Test that page turns are served from the stored result and report the total count
+    """
+    import main
+    from cache import LocalCache
+
+    cities = [{"id": i, "name": f"Город {i}", "country": "Россия", "region": "", "url": ""} for i in range(7)]
+    searches = []
+
+    async def fake_search(query):
+        searches.append(query)
+        return cities
+
+    monkeypatch.setattr(main, "search_cities_api", fake_search)
+    monkeypatch.setattr(main, "_search_results_cache", LocalCache(10))
+
+    first = client.post("/city/search", json={"user_id": 1, "query": "Город", "page": 1, "page_size": 3}).json()
+    assert first["total"] == 7 and first["has_next"] is True
+    assert first["cities"][0] == {"id": 0, "name": "Город 0", "country": "Россия"}
+
+    last = client.post("/city/search", json={"user_id": 1, "query": "город", "page": 3, "page_size": 3}).json()
+    assert [city["id"] for city in last["cities"]] == [6]
+    assert last["has_next"] is False and last["total"] == 7
+    assert searches == ["Город"]
+
+
+def test_weather_serves_trimmed_model_and_raw_on_request(client, fake_redis, fake_weather_api):
+    """
+    Test that the compact model is cached and served by default and the full payload only with include_raw
+    """
+    import copy
+    from cache import decode_value
+
+    full = copy.deepcopy(SAMPLE_WEATHER)
+    full["current"].update({"temp_f": 68.0, "wind_mph": 8.1, "pressure_in": 29.97})
+    fake_weather_api.respond = lambda endpoint, params: (200, full)
+    upstream_calls = fake_weather_api.calls
+
+    trimmed = client.post("/weather/by_city", json={"city": "Москва"}).json()
+    assert trimmed["success"] is True
+    assert "temp_f" not in trimmed["raw_data"]["current"]
+    assert trimmed["raw_data"]["current"]["temp_c"] == 20.0
+    assert "temp_f" not in decode_value(fake_redis.store["weather:москва"])["data"]["current"]
+
+    raw = client.post("/weather/by_city?include_raw=1", json={"city": "Москва"}).json()
+    assert raw["raw_data"]["current"]["temp_f"] == 68.0
+    assert len(upstream_calls) == 2
+
+    client.post("/weather/by_city", json={"city": "Москва"})
+    client.post("/weather/by_city?include_raw=1", json={"city": "Москва"})
+    assert len(upstream_calls) == 2
+
+
+def test_metrics_endpoint_reports_cache_and_upstream(client, fake_redis, fake_weather_api):
+    """
+    Test that /metrics exposes cache hit/miss counters and WeatherAPI call metrics
+    """
+    fake_weather_api.respond = lambda endpoint, params: (200, SAMPLE_WEATHER)
+    client.post("/weather/by_city", json={"city": "Метрикино"})
+    client.post("/weather/by_city", json={"city": "Метрикино"})
+
+    response = client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'weather_cache_requests_total{cache_type="weather",result="miss"}' in body
+    assert 'weather_cache_requests_total{cache_type="weather",result="l1_hit"}' in body
+    assert 'weatherapi_requests_total{endpoint="current.json",status="200"}' in body
+    assert "weatherapi_request_seconds_bucket" in body
+    assert "weather_image_render_queue_depth" in body
+
+
+def test_forecast_cache_serves_shorter_ranges_from_widest_entry(client, fake_redis, fake_weather_api):
+    """
+    Test that one forecast entry holds the widest horizon and shorter requests are sliced from it
+    """
+    def respond(endpoint, params):
+        days = [{"date": f"2024-01-0{i + 1}", "day": {"maxtemp_c": i, "mintemp_c": -i}} for i in range(params["days"])]
+        return 200, dict(SAMPLE_WEATHER, forecast={"forecastday": days})
+
+    fake_weather_api.respond = respond
+
+    def requested_days():
+        return [params["days"] for _, params in fake_weather_api.calls]
+
+    def forecast(days):
+        response = client.get(f"/weather/forecast/Москва?days={days}").json()
+        assert response["success"] is True
+        return response["raw_data"]["forecast"]["forecastday"]
+
+    assert len(forecast(3)) == 3
+    assert len(forecast(5)) == 5
+    assert requested_days() == [3, 5]
+
+    assert len(forecast(3)) == 3
+    assert len(forecast(1)) == 1
+    assert len(forecast(5)) == 5
+    assert requested_days() == [3, 5]
+
+    # Служебное поле горизонта не попадает в ответ
+    main_forecast = client.post("/weather/forecast_by_city", json={"city": "Москва"}).json()
+    assert "horizon_days" not in main_forecast["raw_data"]
+    assert len(main_forecast["raw_data"]["forecast"]["forecastday"]) == 3
+    assert requested_days() == [3, 5]
+
+
+@pytest.mark.asyncio
+async def test_forecast_refresh_keeps_widest_horizon(fake_redis, fake_weather_api):
+    """
+    Test that refreshing a forecast (as the warmer does) refetches the horizon already cached
+    """
+    import main
+
+    fake_weather_api.respond = lambda endpoint, params: (
+        200, dict(SAMPLE_WEATHER, forecast={"forecastday": [{"date": "2024-01-01", "day": {}}] * params["days"]})
+    )
+
+    await main.fetch_weather_api(city="Казань", forecast_days=7)
+    refreshed = await main.fetch_weather_api(city="Казань", forecast_days=3, use_cache=False)
+    assert len(refreshed["forecast"]["forecastday"]) == 3
+    assert [params["days"] for _, params in fake_weather_api.calls] == [7, 7]
+
+
+def test_forecast_fetch_serves_current_weather(client, fake_redis, fake_weather_api):
+    """
+    Test that one forecast.json call fills the current-weather cache for the same city
+    """
+    import cache
+
+    fake_weather_api.respond = lambda endpoint, params: (
+        200, dict(SAMPLE_WEATHER, forecast={"forecastday": [{"date": "2024-01-01", "day": {}}]})
+    )
+
+    def endpoints():
+        return [endpoint for endpoint, _ in fake_weather_api.calls]
+
+    assert client.post("/weather/forecast_by_city", json={"city": "Самара"}).json()["success"] is True
+    weather = client.post("/weather/by_city", json={"city": "Самара"}).json()
+    assert weather["success"] is True
+    assert weather["raw_data"]["current"]["temp_c"] == 20.0
+    assert "forecast" not in weather["raw_data"]
+    assert endpoints() == ["forecast.json"]
+
+    # Без записи weather: текущая погода берётся из свежей записи прогноза
+    fake_redis.store.pop("weather:самара")
+    cache._local_cache.clear()
+    assert client.post("/weather/by_city", json={"city": "Самара"}).json()["success"] is True
+    assert endpoints() == ["forecast.json"]
+
+
+def test_city_names_and_id_share_one_weather_entry(client, monkeypatch, fake_redis, fake_weather_api):
+    """
+    Test that once WeatherAPI resolves a name to a known city, the name, its aliases and the id share one cache entry
+    """
+    import main
+    import city_index
+    from city_index import CityIndex
+
+    index = CityIndex()
+    index.add({"id": 2145091, "name": "Moscow", "country": "Russia", "lat": 55.75, "lon": 37.62})
+    monkeypatch.setattr(main, "city_index", index)
+    monkeypatch.setattr(city_index, "city_index", index)
+    fake_weather_api.respond = lambda endpoint, params: (
+        200, dict(SAMPLE_WEATHER, location={"name": "Moscow", "country": "Russia", "lat": 55.75, "lon": 37.62})
+    )
+
+    assert client.post("/weather/by_city", json={"city": "Москва"}).json()["success"] is True
+    assert "weather:id_2145091" in fake_redis.store
+    assert client.post("/user/city/weather", json={"user_id": 1, "city_id": 2145091}).json()["success"] is True
+    assert client.post("/weather/by_city", json={"city": "москва "}).json()["success"] is True
+    assert [params["q"] for _, params in fake_weather_api.calls] == ["Москва"]
+
+    # Очистка по названию удаляет общую запись города
+    assert client.delete("/cache/clear", params={"cache_type": "weather", "identifier": "Москва"}).json()["success"] is True
+    assert "weather:id_2145091" not in fake_redis.store
+
+
+def test_unknown_city_and_empty_search_are_negatively_cached(client, fake_redis, fake_weather_api):
+    """
+    Test that "no matching location" and empty searches are cached so repeats don't reach WeatherAPI
+    """
+    import cache
+
+    def respond(endpoint, params):
+        if endpoint == "search.json":
+            return 200, []
+        return 400, {"error": {"code": 1006, "message": "No matching location found."}}
+
+    fake_weather_api.respond = respond
+
+    for _ in range(2):
+        assert client.post("/weather/by_city", json={"city": "Мсоква"}).json()["success"] is False
+        assert client.post("/cities/search", json={"query": "Мсоква"}).json()["success"] is False
+    assert client.post("/weather/forecast_by_city", json={"city": "Мсоква"}).json()["success"] is False
+    assert [endpoint for endpoint, _ in fake_weather_api.calls] == ["current.json", "search.json"]
+    assert fake_redis.ttl["missing:мсоква"] == cache.NEGATIVE_TTL
+    assert fake_redis.ttl["cities:мсоква"] == cache.NEGATIVE_TTL
@@ -0,0 +1,42 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from prometheus_client import REGISTRY
+from bot import api
+
+@pytest.mark.asyncio
+async def test_api_post_retries_and_reuses_session(monkeypatch):
+    """Клиент бота повторяет запрос при 503 и переиспользует одну сессию"""
+    calls = 0
+
+    async def weather(request):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            return web.Response(status=503, text="busy")
+        return web.json_response({"success": True})
+
+    async def image(request):
+        return web.Response(status=400, text="Сначала выберите город")
+
+    app = web.Application()
+    app.router.add_post("/weather", weather)
+    app.router.add_post("/weather/image", image)
+    server = TestServer(app)
+    await server.start_server()
+    monkeypatch.setattr(api, "API_URL", str(server.make_url("")).rstrip("/"))
+    monkeypatch.setattr(api, "BOT_HTTP_BACKOFF", 0)
+    retries_before = REGISTRY.get_sample_value("bot_api_retries_total", {"endpoint": "/weather"}) or 0
+    try:
+        await api.init_api_session()
+        session = api._session
+        assert await api.api_post("/weather", {"user_id": 1}) == {"success": True}
+        assert calls == 2
+        assert REGISTRY.get_sample_value("bot_api_retries_total", {"endpoint": "/weather"}) == retries_before + 1
+        assert REGISTRY.get_sample_value("bot_api_requests_total", {"endpoint": "/weather", "status": "503"}) >= 1
+        assert await api.get_weather_image(1) is None
+        assert api._session is session
+    finally:
+        await api.close_api_session()
+        await server.close()
+    assert api._session is None
@@ -1,5 +1,7 @@
 import pytest
 import json
+import time
+from collections import OrderedDict, deque
 from cache import _generate_cache_key
 
 def test_generate_cache_key():
@@ -85,4 +87,224 @@ async def test_cache_functions_with_mock_redis():
         # Тест статистики
         stats = await get_cache_stats()
         assert stats["connected"] is True
-        assert stats["keys_count"] == 5 
\ No newline at end of file
+        assert stats["keys_count"] == 5 
+@pytest.mark.asyncio
+async def test_stale_entry_served_and_refreshed_in_background(fake_redis, monkeypatch):
+    """Между мягким и жёстким TTL отдаётся устаревшая запись и запускается обновление"""
+    import asyncio
+    import cache
+    from cache import get_weather_cached, set_weather_cached, get_stale_cached_data
+
+    await set_weather_cached("Moscow", {"temp": 20})
+    assert fake_redis.ttl["weather:moscow"] == cache.HARD_TTL_WEATHER
+    assert await get_weather_cached("Moscow") == {"temp": 20}
+
+    # Запись устарела по мягкому TTL
+    monkeypatch.setattr(cache.time, "time", lambda: 10 ** 12)
+    refreshed = asyncio.Event()
+
+    async def refresh():
+        refreshed.set()
+
+    assert await get_weather_cached("Moscow") is None
+    assert await get_weather_cached("Moscow", refresh) == {"temp": 20}
+    await asyncio.wait_for(refreshed.wait(), 1)
+    assert await get_stale_cached_data("weather", "Moscow") == {"temp": 20}
+
+@pytest.mark.asyncio
+async def test_entry_without_hard_ttl_is_plain_json(fake_redis):
+    """Без жёсткого TTL запись хранится без конверта SWR"""
+    from cache import set_cached_data, decode_value
+
+    await set_cached_data("cities", "mosc", [{"id": 1}], ttl=60)
+    assert decode_value(fake_redis.store["cities:mosc"]) == [{"id": 1}]
+    assert fake_redis.ttl["cities:mosc"] == 60
+
+def test_local_cache_lru_and_limits():
+    """L1 вытесняет давно неиспользуемые записи и соблюдает лимит по байтам"""
+    from cache import LocalCache
+
+    local = LocalCache(max_entries=2)
+    local.set("weather:a", "A", ttl=60, size=1)
+    local.set("weather:b", "B", ttl=60, size=1)
+    assert local.get("weather:a") == "A"  # a становится самой свежей
+    local.set("weather:c", "C", ttl=60, size=1)
+    assert local.get("weather:b") is None
+    assert local.get("weather:a") == "A"
+
+    local = LocalCache(max_entries=100, max_bytes=10)
+    local.set("k1", 1, ttl=60, size=6)
+    local.set("k2", 2, ttl=60, size=6)
+    assert local.get("k1") is None
+    assert local.size_bytes == 6
+    local.set("huge", 3, ttl=60, size=11)
+    assert local.get("huge") is None
+
+    local.set("k3", 3, ttl=0, size=1)
+    assert local.get("k3") is None
+
+@pytest.mark.asyncio
+async def test_local_cache_in_front_of_redis(fake_redis):
+    """Повторное чтение обслуживается L1 без обращения к Redis, очистка сбрасывает L1"""
+    from cache import get_weather_cached, clear_cache, get_local_cache_stats, _hit_stats
+
+    fake_redis.store["weather:moscow"] = json.dumps({"temp": 20})
+    before = dict(_hit_stats)
+    assert await get_weather_cached("Moscow") == {"temp": 20}
+    del fake_redis.store["weather:moscow"]
+    assert await get_weather_cached("Moscow") == {"temp": 20}
+    assert _hit_stats["l2_hits"] == before["l2_hits"] + 1
+    assert _hit_stats["l1_hits"] == before["l1_hits"] + 1
+
+    await clear_cache("weather", "Moscow")
+    assert await get_weather_cached("Moscow") is None
+    stats = get_local_cache_stats()
+    assert 0 < stats["l1_hit_ratio"] < 1
+
+
+@pytest.mark.parametrize("codec", ["json", "orjson", "msgpack"])
+@pytest.mark.parametrize("compression", ["none", "zlib", "lz4"])
+def test_codecs_round_trip(codec, compression, monkeypatch):
+    """Каждый доступный кодек и вид сжатия читает то, что записал"""
+    import cache
+
+    if codec not in cache.CODECS or compression not in cache.COMPRESSIONS:
+        pytest.skip(f"{codec}/{compression} не установлен")
+    monkeypatch.setattr(cache, "CACHE_COMPRESS_MIN_BYTES", 16)
+    value = {"location": {"name": "Москва"}, "hours": [{"temp_c": 20.5, "is_day": 1}] * 10}
+    raw = cache.encode_value(value, codec, compression)
+    assert raw[0] == cache._CODEC_VERSION
+    assert cache.decode_value(raw) == value
+
+@pytest.mark.asyncio
+async def test_legacy_json_entries_still_read(fake_redis):
+    """Записи в старом формате (JSON-текст) читаются после смены кодека"""
+    from cache import get_weather_cached, decode_value
+
+    fake_redis.store["weather:moscow"] = json.dumps({"temp": 20}).encode("utf-8")
+    assert await get_weather_cached("Moscow") == {"temp": 20}
+    assert decode_value('[{"id": 1}]') == [{"id": 1}]
+
+def test_large_values_are_compressed(monkeypatch):
+    """Значения больше порога сжимаются, маленькие — нет"""
+    import cache
+
+    monkeypatch.setattr(cache, "CACHE_COMPRESS_MIN_BYTES", 1024)
+    small = cache.encode_value({"temp": 20}, "json", "zlib")
+    large_value = {"hours": [{"temp_c": 20.0, "condition": "Ясно"}] * 200}
+    large = cache.encode_value(large_value, "json", "zlib")
+    assert small[2] == 0
+    assert large[2] == cache.COMPRESSIONS["zlib"][0]
+    assert len(large) < len(json.dumps(large_value)) / 5
+
+@pytest.mark.asyncio
+async def test_clear_type_scans_and_unlinks_in_batches(fake_redis, monkeypatch):
+    """Очистка типа идёт через SCAN и UNLINK пачками, захватывает полные ответы и не трогает другие типы"""
+    import cache
+    from cache import clear_cache, get_clear_job, set_weather_cached, set_cities_cached
+
+    monkeypatch.setattr(cache, "CACHE_CLEAR_SCAN_COUNT", 7)
+    monkeypatch.setattr(cache, "CACHE_CLEAR_BATCH_SIZE", 5)
+    for i in range(23):
+        await set_weather_cached(f"city-{i}", {"temp": i})
+    await set_weather_cached("city-1", {"temp": 1, "extra": True}, raw=True)
+    await set_cities_cached("mosc", [{"id": 1}])
+
+    job = await clear_cache("weather", background=True)
+    assert job["status"] == "running"
+    await cache._clear_jobs[job["id"]]["task"]
+
+    progress = get_clear_job(job["id"])
+    assert progress["status"] == "done"
+    assert progress["scanned"] == progress["deleted"] == 24
+    assert fake_redis.scan_calls == 5
+    assert not any(key.startswith("weather") for key in fake_redis.store)
+    assert "cities:mosc" in fake_redis.store
+    assert await cache.get_weather_cached("city-1") is None
+    assert await cache.get_weather_cached("city-1", raw=True) is None
+
+@pytest.mark.asyncio
+async def test_clear_job_notifies_workers_after_sweep(fake_redis, monkeypatch):
+    """Остальные воркеры сбрасывают L1 и после прохода: во время него они могли заполнить его снова"""
+    import cache
+    from cache import clear_cache, set_weather_cached
+
+    monkeypatch.setattr(cache, "L1_PUBSUB", True)
+    await set_weather_cached("Moscow", {"temp": 20})
+    job = await clear_cache("weather", background=True)
+    assert len(fake_redis.published) == 2
+    await cache._clear_jobs[job["id"]]["task"]
+    assert [json.loads(message)["cache_type"] for message in fake_redis.published[2:]] == ["weather", "weather_raw"]
+
+@pytest.mark.asyncio
+async def test_generation_bump_invalidates_type_in_o1(fake_redis, monkeypatch):
+    """С поколениями очистка типа — один INCR, старые записи больше не читаются"""
+    import cache
+    from cache import clear_cache, get_weather_cached, set_weather_cached, get_cities_cached, set_cities_cached
+
+    monkeypatch.setattr(cache, "CACHE_GENERATIONS", True)
+    await set_weather_cached("Moscow", {"temp": 20})
+    await set_cities_cached("mosc", [{"id": 1}])
+
+    assert await clear_cache("weather") is True
+    assert fake_redis.store["cache:generation:weather"] == "1"
+    assert fake_redis.store["cache:generation:weather_raw"] == "1"
+    assert getattr(fake_redis, "scan_calls", 0) == 0
+    assert await get_weather_cached("Moscow") is None
+    assert await get_cities_cached("mosc") == [{"id": 1}]
+
+    await set_weather_cached("Moscow", {"temp": 25})
+    assert "weather:v1:moscow" in fake_redis.store
+    assert await get_weather_cached("Moscow") == {"temp": 25}
+
+    # Другой воркер узнаёт о новом поколении при сверке с Redis
+    cache._generations.clear()
+    monkeypatch.setattr(cache, "_generations_checked", 0.0)
+    assert await get_weather_cached("Moscow") == {"temp": 25}
+
+
+@pytest.mark.asyncio
+async def test_weather_ttl_follows_upstream_update_time(fake_redis, monkeypatch):
+    """Погода свежая до ожидаемого обновления в WeatherAPI, интервал берётся из наблюдений"""
+    import cache
+    monkeypatch.setattr(cache, "CACHE_ADAPTIVE_TTL", True)
+    monkeypatch.setattr(cache, "_last_updated", OrderedDict())
+    monkeypatch.setattr(cache, "_update_intervals", deque(maxlen=10))
+    now = time.time()
+
+    def weather(updated):
+        return {"current": {"last_updated_epoch": int(updated), "temp_c": 1.0}}
+
+    # Данным 5 минут, обновление раз в 15 минут: свежие ещё ~10 минут плюс запас
+    assert cache.adaptive_ttl("a", weather(now - 300), 600) == pytest.approx(900 - 300 + cache.ADAPTIVE_TTL_LAG, abs=2)
+    # Обновление запаздывает — проверяем снова через минимальный TTL
+    assert cache.adaptive_ttl("b", weather(now - 3000), 600) == cache.ADAPTIVE_TTL_MIN
+    # Без времени обновления — обычный TTL
+    assert cache.adaptive_ttl("c", {"current": {}}, 600) == 600
+
+    # Наблюдаемый интервал обновлений заменяет начальную оценку
+    cache.adaptive_ttl("a", weather(now), 600)
+    assert cache.update_interval() == pytest.approx(300, abs=1)
+
+    await cache.set_weather_cached("moscow", weather(now - 60))
+    entry = cache.decode_value(fake_redis.store["weather:moscow"])
+    assert entry["fresh_until"] == pytest.approx(now - 60 + 300 + cache.ADAPTIVE_TTL_LAG, abs=2)
+
+    # Картинка по этим данным живёт столько же, сколько запись погоды
+    await cache.set_image_cached("moscow", b"\x89PNG", cache.freshness_ttl(weather(now - 60)))
+    assert fake_redis.ttl["image:moscow"] == pytest.approx(entry["fresh_until"] - now, abs=2)
+
+
+@pytest.mark.asyncio
+async def test_image_stored_as_raw_bytes(fake_redis):
+    """PNG хранится в Redis без base64; старые записи в base64 читаются"""
+    import base64
+    import cache
+    png = b"\x89PNG\r\n\x1a\n" + bytes(range(256))
+    await cache.set_image_cached("abc", png)
+    assert fake_redis.store["image:abc"] == png
+    cache._local_cache.clear()
+    assert await cache.get_image_cached("abc") == png
+
+    fake_redis.store["image:old"] = base64.b64encode(png)
+    assert await cache.get_image_cached("old") == png
@@ -0,0 +1,105 @@
+from city_index import CityIndex, normalize
+
+MOSCOW = {"id": 2145091, "name": "Moscow", "region": "Moscow City", "country": "Russia"}
+MOSCOW_IDAHO = {"id": 2145092, "name": "Moscow", "region": "Idaho", "country": "United States of America"}
+KAZAN = {"id": 2108341, "name": "Kazan", "region": "Tatarstan", "country": "Russia"}
+
+def test_normalize_case_script_and_punctuation():
+    """Регистр, кириллица/латиница, ё и дефисы приводятся к одному ключу"""
+    assert normalize("Казань") == normalize("KAZAN") == "kazan"
+    assert normalize("Ростов-на-Дону") == "rostov na donu"
+    assert normalize("Орёл") == normalize("Орел")
+    assert normalize("São Paulo") == "sao paulo"
+
+MOSTAR = {"id": 1, "name": "Mostar", "region": "Herzegovina-Neretva", "country": "Bosnia and Herzegovina"}
+MOSUL = {"id": 2, "name": "Mosul", "region": "Ninawa", "country": "Iraq"}
+
+def test_only_learned_queries_are_answered():
+    """Отвечается только повтор выученного запроса: ответ search.json ограничен, его не уточнить локально"""
+    index = CityIndex()
+    index.learn("Москва", [MOSCOW, MOSCOW_IDAHO])
+    assert index.search("Москва") == [MOSCOW, MOSCOW_IDAHO]
+    assert index.search("МОСКВА ") == [MOSCOW, MOSCOW_IDAHO]
+    assert index.search("Моск") is None
+
+    index.learn("Mo", [MOSCOW, MOSTAR, MOSUL, KAZAN])
+    # В ответе WeatherAPI на «Mos» могут быть города, которых нет в ограниченном ответе на «Mo»
+    assert index.search("Mos") is None
+    assert index.search("mo", limit=2) == [MOSCOW, MOSTAR]
+    assert index.search("м") is None
+
+def test_cities_are_evicted_with_their_keys():
+    """Число городов ограничено: давно не нужные вытесняются, ответы с ними перестают отвечать"""
+    index = CityIndex(max_cities=2)
+    index.learn("Mostar", [MOSTAR])
+    index.learn("Mosul", [MOSUL])
+    assert index.search("Mostar") == [MOSTAR]
+    index.learn("Казань", [KAZAN])
+    assert len(index) == 2
+    assert index.get(MOSUL["id"]) is None
+    assert index.search("Mosul") is None
+    assert index.search("Mostar") == [MOSTAR]
+    assert index.stats()["keys"] == 2
+
+def test_learned_queries_expire():
+    """Ответ WeatherAPI хранится query_ttl секунд"""
+    index = CityIndex(query_ttl=0)
+    index.learn("Казань", [KAZAN])
+    assert index.search("Казань") is None
+    assert index.stats()["queries"] == 0
+
+def test_save_and_load_round_trip(tmp_path):
+    """Выученные города и ответы переживают сохранение и загрузку, истёкшие ответы — нет"""
+    path = str(tmp_path / "cities.json")
+    index = CityIndex()
+    index.learn("Казань", [KAZAN])
+    index.save(path)
+
+    restored = CityIndex()
+    assert restored.load(path) == 1
+    assert restored.search("Казань")[0]["name"] == "Kazan"
+
+    stale = CityIndex(query_ttl=-1)
+    stale.learn("Казань", [KAZAN])
+    stale.save(path)
+    restored = CityIndex()
+    restored.load(path)
+    assert restored.get(KAZAN["id"]) == dict(KAZAN, aliases=["kazan"])
+    assert restored.search("Казань") is None
+
+def test_seed_from_search_json_list(tmp_path):
+    """Набор городов в формате search.json: города и названия без ответов на запросы"""
+    path = tmp_path / "seed.json"
+    path.write_text(
+        '[{"id": 2145091, "name": "Moscow", "country": "Russia", "lat": 55.75, "lon": 37.62, "aliases": ["Москва"]}]',
+        encoding="utf-8",
+    )
+    index = CityIndex()
+    index.load(str(path))
+    assert index.search("Moscow") is None
+    assert index.find("Moscow", 55.75, 37.62) == 2145091
+    assert index.find("Москва", 55.75, 37.62) == 2145091
+
+def test_learn_location_picks_city_by_coordinates():
+    """Название приводится к городу из ответа WeatherAPI, одноимённые города различаются по координатам"""
+    index = CityIndex()
+    index.add(dict(MOSCOW, lat=55.75, lon=37.62))
+    index.add(dict(MOSCOW_IDAHO, lat=46.73, lon=-117.0))
+    assert index.learn_location("Москва", {"name": "Moscow", "lat": 55.75, "lon": 37.62}) == MOSCOW["id"]
+    assert index.learn_location("moscow id", {"name": "Moscow", "lat": 46.73, "lon": -117.0}) == MOSCOW_IDAHO["id"]
+    assert index.learn_location("Лондон", {"name": "London", "lat": 51.52, "lon": -0.11}) is None
+    assert index.resolve("москва ") == MOSCOW["id"]
+    assert index.resolve("Лондон") is None
+    assert index.stats()["aliases"] == 2
+
+def test_location_key_shares_entry_between_names_and_id(monkeypatch):
+    """Id города и выученные названия дают один ключ кэша; незнакомое название — само себя"""
+    import city_index
+    index = CityIndex()
+    index.add(dict(MOSCOW, lat=55.75, lon=37.62))
+    monkeypatch.setattr(city_index, "city_index", index)
+    assert city_index.location_key("  Moscow ") == "Moscow"
+    index.learn_location("Moscow", {"name": "Moscow", "lat": 55.75, "lon": 37.62})
+    index.learn_location("Москва", {"name": "Moscow", "lat": 55.75, "lon": 37.62})
+    assert city_index.location_key("moscow ") == city_index.location_key("Москва") == "id_2145091"
+    assert city_index.location_key(city_id=2145091) == "id_2145091"
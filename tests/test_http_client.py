@@ -0,0 +1,27 @@
+import pytest
+import http_client
+from http_client import init_http_session, close_http_session, weather_api_session
+
+@pytest.mark.asyncio
+async def test_weather_api_session_reuses_shared_session():
+    """Общая сессия переиспользуется между запросами"""
+    await init_http_session()
+    try:
+        async with weather_api_session() as first:
+            pass
+        async with weather_api_session() as second:
+            pass
+        assert first is second is http_client.http_session
+        assert not first.closed
+    finally:
+        await close_http_session()
+    assert http_client.http_session is None
+
+@pytest.mark.asyncio
+async def test_weather_api_session_fallback_without_startup():
+    """Без startup создаётся временная сессия, которая закрывается после запроса"""
+    async with weather_api_session() as session:
+        assert not session.closed
+        assert session.connector.limit == http_client.HTTP_POOL_SIZE
+        assert session.timeout.connect == http_client.HTTP_CONNECT_TIMEOUT
+    assert session.closed
@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+import singleflight
+from singleflight import single_flight
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_fetch():
+    """Одновременные вызовы с одним ключом делают один запрос"""
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"temp_c": 20}
+
+    results = await asyncio.gather(*(single_flight("weather:moscow", fetch) for _ in range(10)))
+    assert calls == 1
+    assert all(r == {"temp_c": 20} for r in results)
+    assert "weather:moscow" not in singleflight._inflight
+
+    # После завершения следующий промах снова идёт в API
+    await single_flight("weather:moscow", fetch)
+    assert calls == 2
+
+@pytest.mark.asyncio
+async def test_error_is_shared_and_not_cached():
+    """Ошибка получают все ожидающие, следующий вызов повторяет запрос"""
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    results = await asyncio.gather(
+        *(single_flight("weather:paris", failing) for _ in range(3)),
+        return_exceptions=True,
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert "weather:paris" not in singleflight._inflight
+
+@pytest.mark.asyncio
+async def test_redis_lock_waits_for_other_worker(monkeypatch):
+    """Если блокировку держит другой воркер, результат берётся из кэша"""
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_REDIS_LOCK", True)
+    monkeypatch.setattr(singleflight, "SINGLEFLIGHT_POLL_INTERVAL", 0.01)
+
+    async def lock_held(name, ttl):
+        return None
+
+    async def still_locked(name):
+        return True
+
+    monkeypatch.setattr(singleflight, "acquire_lock", lock_held)
+    monkeypatch.setattr(singleflight, "is_locked", still_locked)
+
+    checks = 0
+
+    async def recheck():
+        nonlocal checks
+        checks += 1
+        return {"temp_c": 5} if checks >= 3 else None
+
+    async def fetch():
+        raise AssertionError("запрос к API не должен выполняться")
+
+    result = await single_flight("weather:oslo", fetch, recheck=recheck)
+    assert result == {"temp_c": 5}
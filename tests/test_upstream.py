@@ -0,0 +1,98 @@
+import asyncio
+import pytest
+import upstream
+from upstream import call_upstream
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_BACKOFF_BASE", 0.001)
+
+def responses(*items):
+    """send() для call_upstream: отдаёт ответы по очереди и считает вызовы"""
+    calls = []
+
+    async def send():
+        item = items[len(calls)]
+        calls.append(item)
+        if isinstance(item, Exception):
+            raise item
+        if item == "hang":
+            await asyncio.sleep(10)
+        return item
+
+    return send, calls
+
+@pytest.mark.asyncio
+async def test_client_error_is_not_retried(upstream_breaker):
+    """Ответ 4xx возвращается сразу, без повторов и без срабатывания предохранителя"""
+    send, calls = responses((400, None), (200, {"ok": True}))
+    assert await call_upstream("current.json", send, attempts=3) is None
+    assert len(calls) == 1
+    assert upstream_breaker.failures == 0
+
+@pytest.mark.asyncio
+async def test_server_error_and_network_error_are_retried():
+    """5xx и сетевые ошибки повторяются"""
+    send, calls = responses((503, None), ConnectionError("reset"), (200, {"ok": True}))
+    assert await call_upstream("current.json", send, attempts=3) == {"ok": True}
+    assert len(calls) == 3
+
+@pytest.mark.asyncio
+async def test_deadline_limits_all_attempts():
+    """Дедлайн ограничивает запрос вместе с повторами"""
+    send, calls = responses("hang", "hang", "hang")
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    assert await call_upstream("current.json", send, attempts=3, deadline=0.1) is None
+    assert loop.time() - started < 0.5
+    assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_breaker_opens_and_short_circuits(upstream_breaker):
+    """После threshold неудач запросы не отправляются, пока не придёт время пробного"""
+    for _ in range(upstream_breaker.threshold):
+        send, _ = responses((500, None))
+        assert await call_upstream("current.json", send, attempts=1) is None
+    assert upstream_breaker.state == "open"
+
+    send, calls = responses((200, {"ok": True}))
+    assert await call_upstream("current.json", send) is None
+    assert calls == []
+
+@pytest.mark.asyncio
+async def test_breaker_half_open_probe(upstream_breaker):
+    """Пробный запрос после reset_timeout закрывает предохранитель или снова открывает его"""
+    upstream_breaker.reset_timeout = 0
+    for _ in range(upstream_breaker.threshold):
+        upstream_breaker.record_failure()
+
+    send, _ = responses((500, None))
+    assert await call_upstream("current.json", send, attempts=1) is None
+    assert upstream_breaker.state == "open"
+
+    send, calls = responses((200, {"ok": True}))
+    assert await call_upstream("current.json", send) == {"ok": True}
+    assert len(calls) == 1
+    assert upstream_breaker.state == "closed"
+
+@pytest.mark.asyncio
+async def test_no_matching_location_raises(upstream_breaker):
+    """Ошибка WeatherAPI 1006 отличается от остальных 4xx: город не найден"""
+    send, calls = responses((400, {"error": {"code": 1006, "message": "No matching location found."}}))
+    with pytest.raises(upstream.LocationNotFound):
+        await call_upstream("current.json", send, attempts=3)
+    assert len(calls) == 1
+    assert upstream_breaker.state == "closed"
+
+@pytest.mark.asyncio
+async def test_auth_and_quota_errors_open_breaker(upstream_breaker):
+    """401/403/429 не повторяются, но открывают предохранитель: WeatherAPI недоступен с этим ключом"""
+    for status_code in (401, 403, 429):
+        send, calls = responses((status_code, {"error": {"code": 2006}}), (200, {"ok": True}))
+        assert await call_upstream("current.json", send, attempts=3) is None
+        assert len(calls) == 1
+    assert upstream_breaker.state == "open"
+
+    send, calls = responses((200, {"ok": True}))
+    assert await call_upstream("current.json", send) is None
+    assert calls == []
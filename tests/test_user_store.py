@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from user_store import UserStore
+
+@pytest_asyncio.fixture
+async def store(tmp_path):
+    store = UserStore(str(tmp_path / "users.db"))
+    await store.open()
+    yield store
+    await store.close()
+
+@pytest.mark.asyncio
+async def test_set_and_get_city(store):
+    """Сохранение и чтение города пользователя"""
+    assert await store.get_city(1) is None
+    await store.set_city(1, 2145091)
+    assert await store.get_city(1) == 2145091
+    await store.set_city(1, 524901)
+    assert await store.get_city(1) == 524901
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_are_batched(store, monkeypatch):
+    """Одновременные записи фиксируются одной транзакцией"""
+    batches = []
+    original = store._write_many
+
+    def write_many(rows):
+        batches.append(len(rows))
+        original(rows)
+
+    monkeypatch.setattr(store, "_write_many", write_many)
+    await asyncio.gather(*(store.set_city(user_id, 0 if user_id < 30 else 1 if user_id < 45 else 2) for user_id in range(50)))
+    assert sum(batches) == 50
+    assert len(batches) < 50
+    assert await store.get_top_city_ids(2) == [0, 1]
+
+@pytest.mark.asyncio
+async def test_wal_mode_and_reopen(tmp_path):
+    """База в режиме WAL, данные переживают переоткрытие"""
+    path = str(tmp_path / "users.db")
+    store = UserStore(path)
+    await store.set_city(7, 42)
+    mode = await store._run(store._reader_pool, lambda: store._connect().execute("PRAGMA journal_mode").fetchone()[0])
+    assert mode == "wal"
+    await store.close()
+
+    store = UserStore(path)
+    assert await store.get_city(7) == 42
+    await store.close()
+
+@pytest.mark.asyncio
+async def test_cancelled_first_writer_does_not_block_batch(store, monkeypatch):
+    """Отмена вызова, открывшего пачку, не мешает её фиксации и следующим записям"""
+    monkeypatch.setattr("user_store.USER_STORE_FLUSH_DELAY", 0.05)
+    first = asyncio.create_task(store.set_city(1, 10))
+    await asyncio.sleep(0)
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+    await asyncio.wait_for(store.set_city(2, 20), 1)
+    assert store._batch is None
+    assert await store._run(store._reader_pool, store._read_city, 2) == 20
+    assert await store._run(store._reader_pool, store._read_city, 1) == 10
+    await asyncio.wait_for(store.close(), 1)
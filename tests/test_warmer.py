@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+import pytest
+import warmer
+from warmer import UpstreamBudget, collect_targets, warm_once
+from bot.keyboards import POPULAR_CITIES
+
+def test_upstream_budget():
+    """Лимит запросов в окне"""
+    budget = UpstreamBudget(limit=2, window=3600)
+    assert budget.try_acquire()
+    assert budget.try_acquire()
+    assert not budget.try_acquire()
+    assert budget.remaining == 0
+
+def test_collect_targets():
+    """Популярные города — погода и прогноз, города пользователей — погода по id"""
+    targets = collect_targets([2145091])
+    assert len(targets) == 2 * len(POPULAR_CITIES) + 1
+    assert ("weather", "id_2145091", {"city_id": "2145091"}) in targets
+
+@pytest.mark.asyncio
+async def test_warm_once_refreshes_only_expiring_entries(fake_redis, monkeypatch):
+    """Обновляются только отсутствующие и скоро истекающие записи, с учётом лимитов"""
+    monkeypatch.setattr(warmer, "POPULAR_CITIES", ["Москва", "Казань"])
+    monkeypatch.setattr(warmer, "_budget", UpstreamBudget(limit=2))
+    monkeypatch.setattr(warmer, "WARMER_CONCURRENCY", 2)
+    monkeypatch.setattr(warmer, "CACHE_ADAPTIVE_TTL", False)
+
+    envelope = {"__swr__": 1, "data": {}}
+    # Свежая запись — не трогаем; истекающая — обновляем
+    fake_redis.store["weather:москва"] = json.dumps({**envelope, "fresh_until": time.time() + 3600})
+    fake_redis.store["weather:казань"] = json.dumps({**envelope, "fresh_until": time.time() + 5})
+
+    calls = []
+    active = 0
+    max_active = 0
+
+    async def fetch(**kwargs):
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        calls.append(kwargs)
+        return {"ok": True}
+
+    async def top_city_ids(limit):
+        return [42]
+
+    refreshed = await warm_once(fetch, top_city_ids)
+    # Кандидаты: 2 прогноза (нет в кэше) и id_42 (нет в кэше); погоду Казани (истекает)
+    # обновит её прогноз. Прогнозы — первыми, лимит 2
+    assert refreshed == 2
+    assert len(calls) == 2
+    assert all(c["use_cache"] is False and c["forecast_days"] for c in calls)
+    assert {"city": "Москва", "use_cache": False} not in calls
+    assert {"city": "Казань", "use_cache": False} not in calls
+    assert max_active <= 2
+    assert warmer._warmer_stats["skipped_budget"] >= 1
+
+@pytest.mark.asyncio
+async def test_warm_once_without_redis_does_nothing(monkeypatch):
+    """Без Redis прогревать нечего"""
+    import cache
+    monkeypatch.setattr(cache, "redis_client", None)
+
+    async def fetch(**kwargs):
+        raise AssertionError("не должен вызываться")
+
+    assert await warm_once(fetch, lambda limit: []) == 0
+
+@pytest.mark.asyncio
+async def test_warm_once_refreshes_weather_alone_when_forecast_is_fresh(fake_redis, monkeypatch):
+    """Погода обновляется отдельно, только если прогноз того же города ещё свежий"""
+    monkeypatch.setattr(warmer, "POPULAR_CITIES", ["Казань"])
+    monkeypatch.setattr(warmer, "_budget", UpstreamBudget(limit=10))
+    monkeypatch.setattr(warmer, "CACHE_ADAPTIVE_TTL", False)
+    envelope = {"__swr__": 1, "data": {}}
+    fake_redis.store["forecast:казань"] = json.dumps({**envelope, "fresh_until": time.time() + 3600})
+
+    calls = []
+
+    async def fetch(**kwargs):
+        calls.append(kwargs)
+        return {"ok": True}
+
+    async def top_city_ids(limit):
+        return []
+
+    assert await warm_once(fetch, top_city_ids) == 1
+    assert calls == [{"city": "Казань", "use_cache": False}]
@@ -59,4 +59,59 @@ def test_generate_weather_image_invalid_condition(test_image_data, invalid_condi
         city=test_image_data["city"]
     )
     # Проверяем, что вернулся BytesIO даже при невалидном condition
-    assert hasattr(buf, 'read') 
\ No newline at end of file
+    assert hasattr(buf, 'read') 
+
+def _legacy_background_and_fonts():
+    """
+    Per-request setup of the original implementation: row-by-row gradient and font loading
+    """
+    from PIL import ImageDraw, ImageFont
+    from weather_image import WIDTH, HEIGHT, TOP_COLOR, MIDDLE_COLOR, BOTTOM_COLOR, FONT_PATH
+
+    img = Image.new("RGB", (WIDTH, HEIGHT), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    for y in range(HEIGHT):
+        if y < HEIGHT // 2:
+            ratio = y / (HEIGHT // 2)
+            start, end = TOP_COLOR, MIDDLE_COLOR
+        else:
+            ratio = (y - HEIGHT // 2) / (HEIGHT // 2)
+            start, end = MIDDLE_COLOR, BOTTOM_COLOR
+        color = tuple(int(start[i] * (1 - ratio) + end[i] * ratio) for i in range(3))
+        draw.line([(0, y), (WIDTH, y)], fill=color)
+    fonts = [ImageFont.truetype(FONT_PATH, size) for size in (28, 44, 24, 18)]
+    return img, fonts
+
+
+def test_background_template_matches_legacy_gradient():
+    """
+    Precomputed background is pixel-identical to the row-by-row gradient
+    """
+    from weather_image import _background_template
+
+    legacy, _ = _legacy_background_and_fonts()
+    assert _background_template().tobytes() == legacy.tobytes()
+
+
+def test_render_setup_benchmark(test_image_data):
+    """
+    Micro-benchmark: per-image setup (background + fonts) is much cheaper than before
+    """
+    import timeit
+    from weather_image import _background_template, _load_fonts
+
+    def cached_setup():
+        return _background_template().copy(), _load_fonts()
+
+    cached_setup()
+    legacy = min(timeit.repeat(_legacy_background_and_fonts, number=20, repeat=3)) / 20
+    cached = min(timeit.repeat(cached_setup, number=20, repeat=3)) / 20
+    render = min(timeit.repeat(
+        lambda: generate_weather_image(test_image_data["weather_data"], test_image_data["city"]),
+        number=20, repeat=3,
+    )) / 20
+    print(
+        f"\nsetup per image: legacy {legacy * 1000:.3f} ms, cached {cached * 1000:.3f} ms; "
+        f"full render {render * 1000:.3f} ms (was ~{(render - cached + legacy) * 1000:.3f} ms)"
+    )
+    assert cached * 5 < legacy
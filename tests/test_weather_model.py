@@ -0,0 +1,47 @@
+import json
+from weather_model import trim_weather
+
+FULL_FORECAST = {
+    "location": {"name": "Москва", "region": "Moscow City", "country": "Россия", "localtime": "2024-07-12 12:00"},
+    "current": {
+        "last_updated_epoch": 1720774800,
+        "temp_c": 20.0,
+        "temp_f": 68.0,
+        "feelslike_c": 19.5,
+        "feelslike_f": 67.1,
+        "wind_kph": 13.0,
+        "wind_mph": 8.1,
+        "humidity": 65,
+        "condition": {"text": "Ясно", "icon": "//cdn/113.png", "code": 1000},
+    },
+    "forecast": {
+        "forecastday": [
+            {
+                "date": "2024-07-12",
+                "date_epoch": 1720742400,
+                "day": {"maxtemp_c": 24.0, "mintemp_c": 14.0, "maxtemp_f": 75.2, "condition": {"text": "Солнечно"}},
+                "astro": {"sunrise": "03:55 AM"},
+                "hour": [{"temp_c": 14.0 + h} for h in range(24)],
+            }
+        ]
+    },
+}
+
+def test_trim_keeps_fields_used_by_messages_and_images():
+    """Компактная модель сохраняет поля для сообщений и картинок в той же структуре"""
+    trimmed = trim_weather(FULL_FORECAST)
+    assert trimmed["location"]["name"] == "Москва"
+    assert trimmed["location"]["country"] == "Россия"
+    assert trimmed["current"]["temp_c"] == 20.0
+    assert trimmed["current"]["condition"]["text"] == "Ясно"
+    assert trimmed["current"]["last_updated_epoch"] == 1720774800
+    day = trimmed["forecast"]["forecastday"][0]
+    assert day["date"] == "2024-07-12"
+    assert day["day"] == {"maxtemp_c": 24.0, "mintemp_c": 14.0, "condition": {"text": "Солнечно"}}
+
+def test_trim_drops_hourly_and_imperial_fields():
+    """Почасовой прогноз и единицы в милях/фаренгейтах не кэшируются"""
+    trimmed = trim_weather(FULL_FORECAST)
+    assert "temp_f" not in trimmed["current"]
+    assert "hour" not in trimmed["forecast"]["forecastday"][0]
+    assert len(json.dumps(trimmed)) < len(json.dumps(FULL_FORECAST))
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from metrics import UPSTREAM_CIRCUIT_STATE, UPSTREAM_RETRIES, UPSTREAM_SHORT_CIRCUITS, observe_upstream
+
+logger = logging.getLogger(__name__)
+
+# Повторы запросов к WeatherAPI
+UPSTREAM_ATTEMPTS = int(os.getenv("UPSTREAM_ATTEMPTS", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.2"))  # секунд, удваивается с каждой попыткой
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "2"))  # секунд
+UPSTREAM_DEADLINE = float(os.getenv("UPSTREAM_DEADLINE", "8"))  # секунд на запрос со всеми повторами
+
+# Предохранитель: после стольких неудачных запросов подряд WeatherAPI не вызывается
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+UPSTREAM_BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", "30"))  # секунд до пробного запроса
+
+# Код ошибки WeatherAPI «No matching location found»
+WEATHERAPI_NO_LOCATION = 1006
+# Ключ API неверный, отключён или исчерпал квоту: WeatherAPI отвечает, но пользоваться им нельзя
+UNAVAILABLE_STATUSES = (401, 403, 429)
+
+class LocationNotFound(Exception):
+    """WeatherAPI не знает такого города — повторять и ждать бессмысленно"""
+
+class CircuitBreaker:
+    """
+    Предохранитель для WeatherAPI.
+
+    closed — запросы идут как обычно; после threshold неудач подряд — open:
+    запросы не отправляются reset_timeout секунд; затем half_open — пропускается
+    один пробный запрос, его результат закрывает или снова открывает предохранитель.
+    """
+
+    def __init__(self, threshold: int = UPSTREAM_BREAKER_THRESHOLD, reset_timeout: float = UPSTREAM_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started = 0.0
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить запрос"""
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open":
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self._probe_started = now
+            logger.info("Предохранитель WeatherAPI: пробный запрос")
+            return True
+        # half_open: один пробный запрос; если он завис, через reset_timeout — ещё один
+        if now - self._probe_started >= self.reset_timeout:
+            self._probe_started = now
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("Предохранитель WeatherAPI закрыт")
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                logger.warning(f"Предохранитель WeatherAPI открыт после {self.failures} неудач подряд")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+breaker = CircuitBreaker()
+UPSTREAM_CIRCUIT_STATE.set_function(lambda: {"closed": 0, "half_open": 1, "open": 2}[breaker.state])
+
+def backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером"""
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+
+async def call_upstream(
+    endpoint: str,
+    send: Callable[[], Awaitable[Tuple[int, Any]]],
+    attempts: int = UPSTREAM_ATTEMPTS,
+    deadline: float = UPSTREAM_DEADLINE,
+) -> Optional[Any]:
+    """Запрос к WeatherAPI с повторами.
+
+    send() возвращает (статус, данные). Данные возвращаются при 200; ответ 4xx
+    не повторяется; сетевые ошибки и 5xx повторяются с задержкой, пока есть
+    попытки и время до дедлайна. 401/403/429 не повторяются, но считаются
+    неудачей для предохранителя. None — данных нет (в том числе при открытом
+    предохранителе — тогда без обращения к WeatherAPI).
+    Если WeatherAPI ответил, что города нет, выбрасывается LocationNotFound.
+    """
+    if not breaker.allow():
+        UPSTREAM_SHORT_CIRCUITS.labels(endpoint).inc()
+        logger.warning(f"Предохранитель открыт, запрос {endpoint} не отправлен")
+        return None
+
+    loop = asyncio.get_running_loop()
+    finish_by = loop.time() + deadline
+    for attempt in range(max(attempts, 1)):
+        remaining = finish_by - loop.time()
+        if remaining <= 0:
+            break
+        if attempt:
+            UPSTREAM_RETRIES.labels(endpoint).inc()
+        started = time.perf_counter()
+        status = "error"
+        try:
+            status_code, data = await asyncio.wait_for(send(), remaining)
+            status = str(status_code)
+            if status_code == 200:
+                breaker.record_success()
+                return data
+            if status_code in UNAVAILABLE_STATUSES:
+                logger.error(f"WeatherAPI {endpoint} отказал в доступе (статус {status_code}), без повтора")
+                breaker.record_failure()
+                return None
+            if 400 <= status_code < 500:
+                # WeatherAPI работает, ошибка в самом запросе (например, город не найден) — повтор не поможет
+                breaker.record_success()
+                error = data.get("error", {}) if isinstance(data, dict) else {}
+                if error.get("code") == WEATHERAPI_NO_LOCATION:
+                    raise LocationNotFound(error.get("message", ""))
+                logger.warning(f"WeatherAPI {endpoint} вернул статус {status_code}, без повтора")
+                return None
+            logger.warning(f"WeatherAPI {endpoint} вернул статус {status_code} на попытке {attempt + 1}")
+        except LocationNotFound:
+            raise
+        except asyncio.TimeoutError:
+            status = "timeout"
+            logger.error(f"Дедлайн запроса {endpoint} истёк на попытке {attempt + 1}")
+        except Exception as e:
+            logger.error(f"Ошибка WeatherAPI {endpoint} на попытке {attempt + 1}: {e}")
+        finally:
+            observe_upstream(endpoint, status, time.perf_counter() - started)
+
+        if attempt + 1 < attempts:
+            delay = backoff_delay(attempt)
+            if loop.time() + delay >= finish_by:
+                break
+            await asyncio.sleep(delay)
+
+    breaker.record_failure()
+    return None
+
+def get_breaker_stats() -> Dict[str, Any]:
+    """Состояние предохранителя для /cache/stats"""
+    return {
+        "state": breaker.state,
+        "failures": breaker.failures,
+        "threshold": breaker.threshold,
+        "reset_timeout": breaker.reset_timeout,
+    }
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Настройки хранилища пользователей
+USER_STORE_READERS = int(os.getenv("USER_STORE_READERS", "2"))  # потоков для чтения
+USER_STORE_BATCH_SIZE = int(os.getenv("USER_STORE_BATCH_SIZE", "100"))  # записей в одной транзакции
+USER_STORE_FLUSH_DELAY = float(os.getenv("USER_STORE_FLUSH_DELAY", "0.002"))  # секунд ожидания пачки
+
+# Настройки SQLite для каждого соединения
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+class UserStore:
+    """Хранилище выбранных городов пользователей (таблица users в SQLite).
+
+    Запросы выполняются вне event loop: запись — в одном потоке с постоянным
+    соединением, чтение — в пуле потоков со своими соединениями (WAL позволяет
+    читать параллельно с записью). Одновременные записи собираются в пачку и
+    фиксируются одной транзакцией.
+    """
+
+    def __init__(self, db_path: str, readers: int = USER_STORE_READERS):
+        self.db_path = db_path
+        self._readers = max(readers, 1)
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._reader_pool: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._opened = False
+        # Записи, ожидающие фиксации, и future текущей пачки
+        self._pending: Dict[int, int] = {}
+        self._batch: Optional[asyncio.Future] = None
+        self._batch_full: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Каталог базы не хранится в git — создаём его при первом подключении
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            for pragma in _PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                city_id INTEGER
+            )
+            """
+        )
+        conn.commit()
+
+    def _write_many(self, rows: List[Tuple[int, int]]):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, city_id) VALUES (?, ?)",
+                rows
+            )
+
+    def _read_city(self, user_id: int) -> Optional[int]:
+        row = self._connect().execute(
+            "SELECT city_id FROM users WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        return row["city_id"] if row else None
+
+    def _read_top_city_ids(self, limit: int) -> List[int]:
+        rows = self._connect().execute(
+            "SELECT city_id FROM users WHERE city_id IS NOT NULL "
+            "GROUP BY city_id ORDER BY COUNT(*) DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [row["city_id"] for row in rows]
+
+    async def _run(self, executor: ThreadPoolExecutor, func: Callable[..., Any], *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    async def open(self):
+        """Создание пулов потоков и таблицы"""
+        if self._opened:
+            return
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="users-writer")
+            self._reader_pool = ThreadPoolExecutor(max_workers=self._readers, thread_name_prefix="users-reader")
+        await self._run(self._writer, self._init_schema)
+        self._opened = True
+        logger.info(f"Хранилище пользователей открыто: {self.db_path}")
+
+    async def close(self):
+        """Фиксация ожидающих записей и закрытие соединений"""
+        if self._batch is not None:
+            await asyncio.shield(self._batch)
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._reader_pool.shutdown(wait=True)
+            self._writer = self._reader_pool = None
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+        self._opened = False
+        logger.info("Хранилище пользователей закрыто")
+
+    async def _flush(self, batch: asyncio.Future):
+        """Сбор пачки и её фиксация; результат получают все вызовы set_city этой пачки"""
+        try:
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), USER_STORE_FLUSH_DELAY)
+            except asyncio.TimeoutError:
+                pass
+            rows = list(self._pending.items())
+            self._pending = {}
+            self._batch = self._batch_full = self._flush_task = None
+            await self._run(self._writer, self._write_many, rows)
+        except Exception as e:
+            batch.set_exception(e)
+            # Ошибку получат все ожидающие; помечаем её как обработанную
+            batch.exception()
+        else:
+            batch.set_result(len(rows))
+        finally:
+            # Задачу отменили (остановка event loop) — ожидающие не должны зависнуть
+            if self._batch is batch:
+                self._batch = self._batch_full = self._flush_task = None
+            if not batch.done():
+                batch.cancel()
+
+    async def set_city(self, user_id: int, city_id: int):
+        """Сохранение города пользователя (возвращается после фиксации в БД)"""
+        await self.open()
+        self._pending[user_id] = city_id
+        if self._batch is None:
+            # Пачку фиксирует отдельная задача: отмена вызова, открывшего пачку, не оставляет её незавершённой
+            self._batch = asyncio.get_running_loop().create_future()
+            self._batch_full = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush(self._batch))
+        if len(self._pending) >= USER_STORE_BATCH_SIZE:
+            self._batch_full.set()
+        await asyncio.shield(self._batch)
+
+    async def get_city(self, user_id: int) -> Optional[int]:
+        """Город пользователя (с учётом ещё не зафиксированных записей)"""
+        if user_id in self._pending:
+            return self._pending[user_id]
+        await self.open()
+        return await self._run(self._reader_pool, self._read_city, user_id)
+
+    async def get_top_city_ids(self, limit: int) -> List[int]:
+        """Города, выбранные наибольшим числом пользователей"""
+        await self.open()
+        return await self._run(self._reader_pool, self._read_top_city_ids, limit)
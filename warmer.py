@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from cache import get_fresh_seconds_left, is_cache_available, CACHE_ADAPTIVE_TTL
+from city_index import location_key
+from bot.keyboards import POPULAR_CITIES
+
+logger = logging.getLogger(__name__)
+
+# Настройки прогрева кэша
+WARMER_ENABLED = os.getenv("WARMER_ENABLED", "1") == "1"
+WARMER_INTERVAL = float(os.getenv("WARMER_INTERVAL", "60"))  # секунд между проходами
+WARMER_LEAD_TIME = float(os.getenv("WARMER_LEAD_TIME", "120"))  # обновлять за столько секунд до истечения
+WARMER_CONCURRENCY = int(os.getenv("WARMER_CONCURRENCY", "4"))  # одновременных запросов к WeatherAPI
+WARMER_TOP_N = int(os.getenv("WARMER_TOP_N", "20"))  # городов пользователей
+WARMER_QUOTA_PER_HOUR = int(os.getenv("WARMER_QUOTA_PER_HOUR", "1000"))  # запросов к WeatherAPI в час
+WARMER_FORECAST_DAYS = 3  # прогноз, который показывают кнопки популярных городов
+
+# Цель прогрева: (тип кэша, идентификатор в кэше, аргументы fetch_weather_api)
+Target = Tuple[str, str, Dict[str, Any]]
+
+class UpstreamBudget:
+    """Скользящее окно: не больше limit запросов к WeatherAPI за window секунд"""
+
+    def __init__(self, limit: int, window: float = 3600):
+        self.limit = limit
+        self.window = window
+        self._calls: deque = deque()
+
+    def _trim(self, now: float):
+        while self._calls and now - self._calls[0] >= self.window:
+            self._calls.popleft()
+
+    @property
+    def remaining(self) -> int:
+        self._trim(time.monotonic())
+        return max(self.limit - len(self._calls), 0)
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._calls) >= self.limit:
+            return False
+        self._calls.append(now)
+        return True
+
+_budget = UpstreamBudget(WARMER_QUOTA_PER_HOUR)
+_warmer_task: Optional["asyncio.Task[Any]"] = None
+_warmer_stats = {"cycles": 0, "refreshed": 0, "failed": 0, "skipped_budget": 0}
+
+def collect_targets(top_city_ids: List[int]) -> List[Target]:
+    """Популярные города (погода и прогноз) и города пользователей (погода)"""
+    targets: List[Target] = []
+    for city in POPULAR_CITIES:
+        targets.append(("weather", location_key(city), {"city": city}))
+        targets.append(("forecast", location_key(city), {"city": city, "forecast_days": WARMER_FORECAST_DAYS}))
+    for city_id in top_city_ids:
+        targets.append(("weather", location_key(city_id=city_id), {"city_id": str(city_id)}))
+    # Популярный город может оказаться и городом пользователей — он прогревается один раз
+    targets = list({(cache_type, key): (cache_type, key, kwargs) for cache_type, key, kwargs in targets}.values())
+    return targets
+
+async def warm_once(
+    fetch: Callable[..., Awaitable[Optional[Dict[str, Any]]]],
+    get_top_city_ids: Callable[[int], Awaitable[List[int]]],
+) -> int:
+    """Один проход прогрева: обновляет записи, которые скоро истекут. Возвращает число обновлённых."""
+    if not is_cache_available():
+        return 0
+
+    _warmer_stats["cycles"] += 1
+    targets = collect_targets(await get_top_city_ids(WARMER_TOP_N))
+
+    # Сначала те, что истекают раньше всех (отсутствующие — в самом начале)
+    due = []
+    for cache_type, identifier, kwargs in targets:
+        left = await get_fresh_seconds_left(cache_type, identifier)
+        # С адаптивным TTL погода свежая до обновления в WeatherAPI: раньше новых данных там нет
+        lead_time = 0 if cache_type == "weather" and CACHE_ADAPTIVE_TTL else WARMER_LEAD_TIME
+        if left is None or left < lead_time:
+            due.append((left if left is not None else float("-inf"), cache_type, identifier, kwargs))
+    # Прогноз заполняет и запись weather: того же города — отдельный current.json не нужен
+    forecast_due = {identifier for _, cache_type, identifier, _ in due if cache_type == "forecast"}
+    due = [item for item in due if not (item[1] == "weather" and item[2] in forecast_due)]
+    # При равном сроке прогнозы — первыми
+    due.sort(key=lambda item: (item[0], item[1] != "forecast"))
+
+    semaphore = asyncio.Semaphore(WARMER_CONCURRENCY)
+    refreshed = 0
+
+    async def refresh(kwargs: Dict[str, Any]):
+        nonlocal refreshed
+        async with semaphore:
+            data = await fetch(**kwargs, use_cache=False)
+        if data:
+            refreshed += 1
+        else:
+            _warmer_stats["failed"] += 1
+
+    tasks = []
+    for _, _, _, kwargs in due:
+        if not _budget.try_acquire():
+            _warmer_stats["skipped_budget"] += len(due) - len(tasks)
+            logger.warning(f"Прогрев кэша: исчерпан лимит {WARMER_QUOTA_PER_HOUR} запросов в час")
+            break
+        tasks.append(refresh(kwargs))
+    await asyncio.gather(*tasks)
+
+    _warmer_stats["refreshed"] += refreshed
+    if due:
+        logger.info(f"Прогрев кэша: обновлено {refreshed} из {len(due)} записей")
+    return refreshed
+
+async def _warmer_loop(
+    fetch: Callable[..., Awaitable[Optional[Dict[str, Any]]]],
+    get_top_city_ids: Callable[[int], Awaitable[List[int]]],
+):
+    while True:
+        try:
+            await warm_once(fetch, get_top_city_ids)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка прогрева кэша: {e}")
+        await asyncio.sleep(WARMER_INTERVAL)
+
+def start_warmer(
+    fetch: Callable[..., Awaitable[Optional[Dict[str, Any]]]],
+    get_top_city_ids: Callable[[int], Awaitable[List[int]]],
+):
+    """Запуск фонового прогрева кэша"""
+    global _warmer_task
+    if not WARMER_ENABLED or _warmer_task is not None:
+        return
+    _warmer_task = asyncio.create_task(_warmer_loop(fetch, get_top_city_ids))
+    logger.info(f"Прогрев кэша запущен (интервал: {WARMER_INTERVAL}s, параллельно: {WARMER_CONCURRENCY})")
+
+async def stop_warmer():
+    """Остановка фонового прогрева кэша"""
+    global _warmer_task
+    if _warmer_task is None:
+        return
+    _warmer_task.cancel()
+    try:
+        await _warmer_task
+    except asyncio.CancelledError:
+        pass
+    _warmer_task = None
+    logger.info("Прогрев кэша остановлен")
+
+def get_warmer_stats() -> Dict[str, Any]:
+    """Статистика прогрева кэша"""
+    return {
+        "enabled": WARMER_ENABLED,
+        "running": _warmer_task is not None,
+        "budget_remaining": _budget.remaining,
+        **_warmer_stats,
+    }
@@ -1,41 +1,74 @@
 from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
+from functools import lru_cache
+import hashlib
 import os
 import logging
 
+WIDTH, HEIGHT = 500, 300
+# Трёхцветный градиент: лаванда (#e0c3fc) -> светло-розовый (#f9e4ff) -> тёплый белый (#fffbe9)
+TOP_COLOR = (224, 195, 252)     # #e0c3fc
+MIDDLE_COLOR = (249, 228, 255)  # #f9e4ff
+BOTTOM_COLOR = (255, 251, 233)  # #fffbe9
+FONT_PATH = os.path.join(os.path.dirname(__file__), "fonts", "DejaVuSans.ttf")
+# Меняется при изменении оформления картинки, чтобы не отдавать старые из кэша
+IMAGE_VERSION = "1"
 
-def generate_weather_image(weather_data, city):
-    width, height = 500, 300
-    # Трёхцветный градиент: лаванда (#e0c3fc) -> светло-розовый (#f9e4ff) -> тёплый белый (#fffbe9)
-    img = Image.new("RGB", (width, height), (255, 255, 255))
-    draw = ImageDraw.Draw(img)
-    top_color = (224, 195, 252)    # #e0c3fc
-    middle_color = (249, 228, 255)  # #f9e4ff
-    bottom_color = (255, 251, 233)  # #fffbe9
-    for y in range(height):
-        if y < height // 2:
-            ratio = y / (height // 2)
-            r = int(top_color[0] * (1 - ratio) + middle_color[0] * ratio)
-            g = int(top_color[1] * (1 - ratio) + middle_color[1] * ratio)
-            b = int(top_color[2] * (1 - ratio) + middle_color[2] * ratio)
-        else:
-            ratio = (y - height // 2) / (height // 2)
-            r = int(middle_color[0] * (1 - ratio) + bottom_color[0] * ratio)
-            g = int(middle_color[1] * (1 - ratio) + bottom_color[1] * ratio)
-            b = int(middle_color[2] * (1 - ratio) + bottom_color[2] * ratio)
-        draw.line([(0, y), (width, y)], fill=(r, g, b))
-
-    font_path = os.path.join(os.path.dirname(__file__), "fonts", "DejaVuSans.ttf")
+
+def _gradient_color(y):
+    half = HEIGHT // 2
+    if y < half:
+        start, end, ratio = TOP_COLOR, MIDDLE_COLOR, y / half
+    else:
+        start, end, ratio = MIDDLE_COLOR, BOTTOM_COLOR, (y - half) / half
+    return tuple(int(start[i] * (1 - ratio) + end[i] * ratio) for i in range(3))
+
+
+@lru_cache(maxsize=1)
+def _background_template():
+    """Градиентный фон строится один раз: столбец в 1 пиксель растягивается на всю ширину"""
+    column = Image.new("RGB", (1, HEIGHT))
+    column.putdata([_gradient_color(y) for y in range(HEIGHT)])
+    return column.resize((WIDTH, HEIGHT), Image.NEAREST)
+
+
+@lru_cache(maxsize=1)
+def _load_fonts():
+    """Шрифты загружаются один раз: (город, температура, состояние, дата)"""
     try:
-        font_city = ImageFont.truetype(font_path, 28)
-        font_temp = ImageFont.truetype(font_path, 44)
-        font_cond = ImageFont.truetype(font_path, 24)
-        font_date = ImageFont.truetype(font_path, 18)
+        return (
+            ImageFont.truetype(FONT_PATH, 28),
+            ImageFont.truetype(FONT_PATH, 44),
+            ImageFont.truetype(FONT_PATH, 24),
+            ImageFont.truetype(FONT_PATH, 18),
+        )
     except Exception as e:
         logging.warning(
-            f"Не удалось загрузить шрифт {font_path}: {e}. Используется стандартный шрифт (английский, без кириллицы)"
+            f"Не удалось загрузить шрифт {FONT_PATH}: {e}. Используется стандартный шрифт (английский, без кириллицы)"
         )
-        font_city = font_temp = font_cond = font_date = ImageFont.load_default()
+        default = ImageFont.load_default()
+        return default, default, default, default
+
+
+def image_content_key(weather_data, city):
+    """Хэш всего, что видно на картинке: одинаковые данные дают одинаковую картинку"""
+    current = weather_data.get("current", {})
+    parts = [
+        IMAGE_VERSION,
+        city,
+        str(current.get("temp_c")),
+        current.get("condition", {}).get("text") or "",
+        weather_data.get("location", {}).get("localtime", "").split(" ")[0],
+    ]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def generate_weather_image(weather_data, city):
+    width, height = WIDTH, HEIGHT
+    # Каждая картинка рисуется на копии готового фона
+    img = _background_template().copy()
+    draw = ImageDraw.Draw(img)
+    font_city, font_temp, font_cond, font_date = _load_fonts()
 
     temp = weather_data['current']['temp_c']
     condition = weather_data['current']['condition'].get('text') or "Неизвестно"
@@ -0,0 +1,58 @@
+from typing import Any, Dict, Iterable
+
+# Поля ответа WeatherAPI, которые нужны сервису: сообщения, картинка, прогноз.
+# Остальное (почасовой прогноз, единицы в милях и фаренгейтах, астрономия) не кэшируется.
+LOCATION_FIELDS = ("name", "region", "country", "lat", "lon", "tz_id", "localtime_epoch", "localtime")
+CURRENT_FIELDS = (
+    "last_updated_epoch", "last_updated", "temp_c", "feelslike_c", "wind_kph",
+    "humidity", "is_day", "condition",
+)
+DAY_FIELDS = ("maxtemp_c", "mintemp_c", "avgtemp_c", "condition")
+CONDITION_FIELDS = ("text", "icon", "code")
+
+def _pick(source: Dict[str, Any], fields: Iterable[str]) -> Dict[str, Any]:
+    result = {field: source[field] for field in fields if field in source}
+    if isinstance(result.get("condition"), dict):
+        result["condition"] = _pick(result["condition"], CONDITION_FIELDS)
+    return result
+
+def trim_weather(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Компактная модель погоды с той же структурой, что у ответа WeatherAPI.
+
+    Форматирование, картинки и бот читают её так же, как полный ответ.
+    """
+    trimmed: Dict[str, Any] = {}
+    if "location" in data:
+        trimmed["location"] = _pick(data["location"], LOCATION_FIELDS)
+    if "current" in data:
+        trimmed["current"] = _pick(data["current"], CURRENT_FIELDS)
+    if "forecast" in data:
+        trimmed["forecast"] = {
+            "forecastday": [
+                {"date": day.get("date"), "date_epoch": day.get("date_epoch"), "day": _pick(day.get("day", {}), DAY_FIELDS)}
+                for day in data["forecast"].get("forecastday", [])
+            ]
+        }
+    return trimmed
+
+# Сколько дней запрашивалось у WeatherAPI для записи прогноза в кэше.
+# WeatherAPI может вернуть меньше дней (ограничение тарифа) — запись всё равно считается полной.
+FORECAST_HORIZON_FIELD = "horizon_days"
+
+def forecast_horizon(data: Dict[str, Any]) -> int:
+    """На сколько дней вперёд хватает записи прогноза"""
+    horizon = data.get(FORECAST_HORIZON_FIELD)
+    if horizon is None:
+        return len(data.get("forecast", {}).get("forecastday", []))
+    return horizon
+
+def slice_forecast(data: Dict[str, Any], days: int) -> Dict[str, Any]:
+    """Прогноз на первые days дней из более широкой записи (сама запись не меняется)"""
+    result = {key: value for key, value in data.items() if key != FORECAST_HORIZON_FIELD}
+    if "forecast" in data:
+        result["forecast"] = dict(data["forecast"], forecastday=data["forecast"].get("forecastday", [])[:days])
+    return result
+
+def current_from_forecast(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Текущая погода из ответа forecast.json: те же блоки location и current, что у current.json"""
+    return {key: data[key] for key in ("location", "current") if key in data}